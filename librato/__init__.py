@@ -23,23 +23,70 @@
 
 import re
 import six
-import platform
+import sys
 import time
 import logging
 import os
-from six.moves import http_client
+import importlib
 from six.moves import map
 from six import string_types
-import urllib
-import base64
+from six.moves.urllib.parse import urlencode
 import json
-import email.message
-from librato import exceptions
-from librato.queue import Queue
-from librato.metrics import Gauge, Counter, Metric
-from librato.alerts import Alert, Service
-from librato.annotations import Annotation
-from librato.spaces import Space, Chart
+from librato import exceptions, forksafe
+from librato.transport import get_transport
+from librato.workers import DEFAULT_MAX_WORKERS, imap_bounded
+from librato.bulk import BULK_CHUNK_SIZE, BulkResult, chunked, update_chunks
+from librato.instrumentation import HOOK_EVENTS, RequestInfo, count_measurements
+
+# The rest of the package is only imported when first used (see __getattr__
+# below), so that `import librato` stays cheap for short-lived processes.
+# Within this module, the methods needing them import them locally.
+_LAZY = {
+    'Queue': 'librato.queue',
+    'Rejected': 'librato.queue',
+    'SubmitReport': 'librato.queue',
+    'MeasurementValidator': 'librato.validation',
+    'AnnotationQueue': 'librato.annotation_queue',
+    'ColumnarDecoder': 'librato.columnar',
+    'StreamedList': 'librato.streaming',
+    'StreamingDecoder': 'librato.streaming',
+    'MetadataCache': 'librato.cache',
+    'SingleFlight': 'librato.cache',
+    'ValidatorCache': 'librato.cache',
+    'AlertSet': 'librato.sync',
+    'SpaceSet': 'librato.sync',
+    'Gauge': 'librato.metrics',
+    'Counter': 'librato.metrics',
+    'Metric': 'librato.metrics',
+    'Alert': 'librato.alerts',
+    'Service': 'librato.alerts',
+    'Annotation': 'librato.annotations',
+    'iter_events': 'librato.annotations',
+    'time_windows': 'librato.annotations',
+    'Space': 'librato.spaces',
+    'Chart': 'librato.spaces',
+    # Aliased so the tests can mock them out
+    'HTTPSConnection': 'six.moves.http_client',
+    'HTTPConnection': 'six.moves.http_client',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__ (PEP 562) before 3.7
+    for _name in _LAZY:
+        __getattr__(_name)
 
 __version__ = "3.1.0"
 
@@ -49,16 +96,14 @@ BASE_PATH = "/v1/"
 DEFAULT_TIMEOUT = 10
 
 log = logging.getLogger("librato")
+# Request and response bodies go to their own DEBUG channel
+body_log = logging.getLogger("librato.body")
+# Logged bodies are cut to this many characters
+LOG_BODY_LIMIT = 2048
 
-# Alias HTTPSConnection so the tests can mock it out.
-HTTPSConnection = http_client.HTTPSConnection
-HTTPConnection = http_client.HTTPConnection
-
-# Alias urlencode, it moved between py2 and py3.
-try:
-    urlencode = urllib.parse.urlencode  # py3
-except AttributeError:
-    urlencode = urllib.urlencode        # py2
+# python-librato/<version> (python; <python version>; <machine>-<system><release>),
+# the platform probing only happens for the first request
+_user_agent = None
 
 
 def sanitize_metric_name(metric_name):
@@ -83,7 +128,7 @@ class LibratoConnection(object):
     """
 
     def __init__(self, username, api_key, hostname=HOSTNAME, base_path=BASE_PATH, sanitizer=sanitize_no_op,
-                 protocol="https", tags={}):
+                 protocol="https", tags={}, transport=None):
         """Create a new connection to Librato Metrics.
         Doesn't actually connect yet or validate until you make a request.
 
@@ -91,6 +136,8 @@ class LibratoConnection(object):
         :type username: str
         :param api_key: The API Key (token) to use to authenticate
         :type api_key: str
+        :param transport: A librato.transport.Transport, or the name of one
+            ('stdlib', the default, 'urllib3', 'requests', 'httpx' or 'http2')
         """
         try:
             self.username = username.encode('ascii')
@@ -112,19 +159,20 @@ class LibratoConnection(object):
         self.sanitize = sanitizer
         self.timeout = DEFAULT_TIMEOUT
         self.tags = dict(tags)
+        self.transport = get_transport(transport)
+        self.metadata_cache = None
+        self.validator_cache = None
+        self.single_flight = None
+        self.measurement_validator = None
+        self.body_streaming = None
+        self.hooks = dict((event, []) for event in HOOK_EVENTS)
+        forksafe.register(self)
 
     def _compute_ua(self):
         if self.custom_ua:
             return self.custom_ua
         else:
-            # http://en.wikipedia.org/wiki/User_agent#Format
-            # librato-metrics/1.0.3 (ruby; 1.9.3p385; x86_64-darwin11.4.2) direct-faraday/0.8.4
-            ua_chunks = []  # Set user agent
-            ua_chunks.append("python-librato/" + __version__)
-            p = platform
-            system_info = (p.python_version(), p.machine(), p.system(), p.release())
-            ua_chunks.append("(python; %s; %s-%s%s)" % system_info)
-            return ' '.join(ua_chunks)
+            return _default_user_agent()
 
     def __getattr__(self, attr):
         def handle_undefined_method(*args):
@@ -137,6 +185,7 @@ class LibratoConnection(object):
 
     def _set_headers(self, headers):
         """ set headers for request """
+        import base64
         if headers is None:
             headers = {}
         headers['Authorization'] = b"Basic " + base64.b64encode(self.username + b":" + self.api_key).strip()
@@ -154,81 +203,212 @@ class LibratoConnection(object):
                 params_list.append((k, v))
         return urlencode(params_list)
 
-    def _make_request(self, conn, path, headers, query_props, method):
+    def _make_request(self, conn, path, headers, query_props, method, info=None):
         """ Perform the an https request to the server """
         uri = self.base_path + path
         body = None
+        streamed = False
         if query_props:
             if method == "POST" or method == "DELETE" or method == "PUT":
-                body = json.dumps(query_props)
+                streamed = self._streams_body(query_props)
+                if streamed:
+                    body = self._streamed_body(query_props, headers)
+                else:
+                    body = json.dumps(query_props)
                 headers['Content-Type'] = "application/json"
             else:
                 uri += "?" + self._url_encode_params(query_props)
 
-        log.info("method=%s uri=%s" % (method, uri))
-        log.info("body(->): %s" % body)
+        if info is not None:
+            info.uri = uri
+            info.request_bytes = len(body) if body and not streamed else 0
+
+        log.info("method=%s uri=%s", method, uri)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("headers(->): %s", _redact_headers(headers))
+        if streamed:
+            body_log.debug("body(->): streamed")
+        else:
+            _log_body("->", body)
         conn.request(method, uri, body=body, headers=headers)
+        if streamed and info is not None:
+            info.request_bytes = body.bytes_sent
 
         return conn.getresponse()
 
-    def _process_response(self, resp, backoff):
+    def _streams_body(self, query_props):
+        if self.body_streaming is None or not isinstance(query_props, dict):
+            return False
+        if not getattr(self.transport, 'streams_bodies', False):
+            return False
+        items = sum(len(v) for v in query_props.values() if isinstance(v, list))
+        return items >= self.body_streaming['min_items']
+
+    def _streamed_body(self, query_props, headers):
+        from librato.streaming import DEFAULT_BLOCK_SIZE, StreamedBody
+        body = StreamedBody(query_props, chunked=self.body_streaming['chunked'],
+                            block_size=self.body_streaming['block_size'] or DEFAULT_BLOCK_SIZE)
+        if body.length is not None:
+            headers['Content-Length'] = str(body.length)
+        return body
+
+    def _process_response(self, resp, backoff, decoder=None, info=None):
         """ Process the response from the server """
         success = True
         resp_data = None
         not_a_server_error = resp.status < 500
 
         if not_a_server_error:
-            resp_data = _decode_body(resp)
+            resp_data = _decode_body(resp, decoder, info)
             a_client_error = resp.status >= 400
             if a_client_error:
                 raise exceptions.get(resp.status, resp_data)
             return resp_data, success, backoff
         else:  # A server error, wait and retry
+            # Drain the body so the connection can be reused for the retry
+            resp.read()
             backoff = self.backoff_logic(backoff)
-            log.info("%s: waiting %s before re-trying" % (resp.status, backoff))
+            log.info("%s: waiting %s before re-trying", resp.status, backoff)
+            if info is not None:
+                info.retries += 1
+                info.backoff = backoff
+                self._fire('on_retry', info)
             time.sleep(backoff)
             return None, not success, backoff
 
+    #
+    # Hooks
+    #
+    def add_hook(self, event, callback):
+        """Call callback(info) on event, one of before_request,
+        after_response, on_retry or on_error. info is a
+        librato.instrumentation.RequestInfo."""
+        if event not in self.hooks:
+            raise ValueError("Unknown hook event: %s" % event)
+        self.hooks[event].append(callback)
+
+    def remove_hook(self, event, callback):
+        if event not in self.hooks:
+            raise ValueError("Unknown hook event: %s" % event)
+        if callback in self.hooks[event]:
+            self.hooks[event].remove(callback)
+
+    def _hooked(self):
+        for callbacks in self.hooks.values():
+            if callbacks:
+                return True
+        return False
+
+    def _fire(self, event, info):
+        for callback in list(self.hooks[event]):
+            try:
+                callback(info)
+            except Exception:
+                log.exception("%s hook %r failed", event, callback)
+
     def _parse_tags_params(self, tags):
         result = {}
         for k, v in tags.items():
             result["tags[%s]" % k] = v
         return result
 
-    def _mexe(self, path, method="GET", query_props=None, p_headers=None):
+    def _mexe(self, path, method="GET", query_props=None, p_headers=None, decoder=None):
         """Internal method for executing a command.
-           If we get server errors we exponentially wait before retrying
+           If we get server errors we exponentially wait before retrying.
+           A custom decoder (a callable taking the JSON text) can be given
+           to change how JSON bodies are parsed.
         """
+        # Identical GETs in flight at the same time share one request
+        if self.single_flight is not None and method == "GET" and decoder is None and not p_headers:
+            return self.single_flight.do(self._request_key(path, query_props),
+                                         lambda: self._send(path, method, query_props, p_headers, decoder))
+        return self._send(path, method, query_props, p_headers, decoder)
+
+    def _send(self, path, method, query_props, p_headers, decoder):
+        # Only pay for a RequestInfo when someone is listening
+        info = None
+        if self._hooked():
+            info = RequestInfo(method, path, count_measurements(query_props))
+            self._fire('before_request', info)
+        try:
+            resp_data = self._execute(path, method, query_props, p_headers, decoder, info)
+        except Exception as e:
+            if info is not None:
+                info.error = e
+                self._fire('on_error', info.finish())
+            raise
+        if info is not None:
+            self._fire('after_response', info.finish())
+        return resp_data
+
+    def _execute(self, path, method, query_props, p_headers, decoder, info):
+        from six.moves import http_client
+        # Conditional GETs only apply to the default decoding, without custom headers
+        conditional = method == "GET" and decoder is None and not p_headers and self.validator_cache is not None
         conn = self._setup_connection()
         headers = self._set_headers(p_headers)
         success = False
         backoff = 1
         resp_data = None
+        validator_key = validated = None
+        if conditional:
+            validator_key = self._request_key(path, query_props)
+            validated = self.validator_cache.get(validator_key)
+            if validated is not None:
+                etag, last_modified, _ = validated
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
         while not success:
-            resp = self._make_request(conn, path, headers, query_props, method)
+            resp = self._make_request(conn, path, headers, query_props, method, info)
+            if info is not None:
+                info.status = resp.status
+            if validated is not None and resp.status == 304:
+                resp.read()
+                self.validator_cache.not_modified += 1
+                conn.close()
+                return validated[2]
             try:
-                resp_data, success, backoff = self._process_response(resp, backoff)
+                resp_data, success, backoff = self._process_response(resp, backoff, decoder, info)
             except http_client.ResponseNotReady:
                 conn.close()
                 conn = self._setup_connection()
+        if getattr(decoder, 'streaming', False):
+            from librato.streaming import StreamedList
+            if isinstance(resp_data, StreamedList):
+                # The body is still being read, close once it has been
+                resp_data.on_close = conn.close
+                return resp_data
+        if validator_key is not None:
+            self._remember_validators(validator_key, resp, resp_data)
         conn.close()
         return resp_data
 
+    def _request_key(self, path, query_props):
+        """Canonical (path, query string) identifying a GET request"""
+        if not query_props:
+            return (path, '')
+        return (path, '&'.join(sorted(self._url_encode_params(query_props).split('&'))))
+
+    def _remember_validators(self, key, resp, resp_data):
+        etag = resp.getheader('ETag')
+        last_modified = resp.getheader('Last-Modified')
+        if etag or last_modified:
+            self.validator_cache.set(key, (etag, last_modified, resp_data))
+        else:
+            self.validator_cache.pop(key)
+
     def _do_we_want_to_fake_server_errors(self):
         return self.fake_n_errors > 0
 
     def _setup_connection(self):
-        connection_class = HTTPSConnection if self.protocol == "https" else HTTPConnection
+        return self.transport.connect(self)
 
-        if self._do_we_want_to_fake_server_errors():
-            return connection_class(self.hostname, fake_n_errors=self.fake_n_errors)
-        else:
-            return connection_class(self.hostname, timeout=self.timeout)
-
-    def _parse(self, resp, name, cls):
+    def _parse(self, resp, name, cls, **from_dict_args):
         """Parse to an object"""
         if name in resp:
-            return [cls.from_dict(self, m) for m in resp[name]]
+            return [cls.from_dict(self, m, **from_dict_args) for m in resp[name]]
         else:
             return resp
 
@@ -245,31 +425,42 @@ class LibratoConnection(object):
         self.tags.update(d)
 
     # Return all items for a "list" request
-    def _get_paginated_results(self, entity, klass, **query_props):
-        resp = self._mexe(entity, query_props=query_props)
-
-        results = self._parse(resp, entity, klass)
-        for result in results:
-            yield result
-
-        length = resp.get('query', {}).get('length', 0)
-        offset = query_props.get('offset', 0) + length
-        total = resp.get('query', {}).get('total', length)
-        if offset < total and length > 0:
-            query_props.update({'offset': offset})
-            for result in self._get_paginated_results(entity, klass, **query_props):
-                yield result
+    def _get_paginated_results(self, entity, klass, lazy=False, **query_props):
+        # Items are parsed and handed out as they arrive, page after page.
+        # Not with conditional requests: those keep whole pages to reuse them
+        from librato.streaming import StreamedList, StreamingDecoder
+        from_dict_args = {'lazy': True} if lazy else {}
+        decoder = StreamingDecoder(entity) if self.validator_cache is None else None
+        while True:
+            page = self._mexe(entity, query_props=query_props, decoder=decoder)
+            streamed = isinstance(page, StreamedList)
+            for item in (page if streamed else page.get(entity, [])):
+                yield klass.from_dict(self, item, **from_dict_args)
+
+            # The page metadata is complete once the items have been read
+            query = (page.meta if streamed else page).get('query', {})
+            length = query.get('length', 0)
+            offset = query_props.get('offset', 0) + length
+            total = query.get('total', length)
+            if offset >= total or length <= 0:
+                return
+            query_props['offset'] = offset
 
     #
     # Metrics
     #
-    def list_metrics(self, **query_props):
-        """List a page of metrics"""
+    def list_metrics(self, lazy=False, **query_props):
+        """List a page of metrics.
+        Lazy metrics only fill in their attributes when first accessed."""
+        from librato.metrics import Metric
         resp = self._mexe("metrics", query_props=query_props)
+        if lazy:
+            return self._parse(resp, "metrics", Metric, lazy=True)
         return self._parse(resp, "metrics", Metric)
 
-    def list_all_metrics(self, **query_props):
-        return self._get_paginated_results("metrics", Metric, **query_props)
+    def list_all_metrics(self, lazy=False, **query_props):
+        from librato.metrics import Metric
+        return self._get_paginated_results("metrics", Metric, lazy=lazy, **query_props)
 
     def submit(self, name, value, type="gauge", **query_props):
         if 'tags' in query_props or self.get_tags():
@@ -279,16 +470,23 @@ class LibratoConnection(object):
             metric = {'name': self.sanitize(name), 'value': value}
             for k, v in query_props.items():
                 metric[k] = v
+            if self.measurement_validator is not None:
+                metric = self.measurement_validator.validate(metric)
+                if metric is None:
+                    return
             payload[type + 's'].append(metric)
             self._mexe("metrics", method="POST", query_props=payload)
 
     def submit_tagged(self, name, value, **query_props):
-        payload = {'measurements': []}
-        payload['measurements'].append(self.create_tagged_payload(name, value, **query_props))
+        measurement = self.create_tagged_payload(name, value, **query_props)
+        if measurement is None:
+            return
+        payload = {'measurements': [measurement]}
         self._mexe("measurements", method="POST", query_props=payload)
 
     def create_tagged_payload(self, name, value, **query_props):
-        """Create the measurement for forwarding to Librato"""
+        """Create the measurement for forwarding to Librato. With validation
+        enabled, None when the measurement is invalid and dropped."""
         measurement = {
             'name': self.sanitize(name),
             'value': value
@@ -303,9 +501,17 @@ class LibratoConnection(object):
 
         for k, v in query_props.items():
             measurement[k] = v
+        if self.measurement_validator is not None:
+            return self.measurement_validator.validate(measurement)
         return measurement
 
     def get(self, name, **query_props):
+        if query_props:
+            return self._get(name, **query_props)
+        return self._cached('metric', (self.sanitize(name),), lambda: self._get(name))
+
+    def _get(self, name, **query_props):
+        from librato.metrics import Gauge, Counter
         resp = self._mexe("metrics/%s" % self.sanitize(name), method="GET", query_props=query_props)
         if resp['type'] == 'gauge':
             return Gauge.from_dict(self, resp)
@@ -315,7 +521,12 @@ class LibratoConnection(object):
             raise Exception('The server sent me something that is not a Gauge nor a Counter.')
 
     def get_tagged(self, name, **query_props):
-        """Fetches multi-dimensional metrics"""
+        """Fetches multi-dimensional metrics
+
+        Pass as_arrays=True (or one of 'array', 'numpy', 'pandas') to get the
+        measurements of every series back as columns instead of a list of dicts.
+        """
+        decoder = self._columnar_decoder(query_props.pop('as_arrays', None))
         if 'resolution' not in query_props:
             # Default to raw resolution
             query_props['resolution'] = 1
@@ -328,7 +539,8 @@ class LibratoConnection(object):
             parsed_tags = self._parse_tags_params(query_props.pop('tags'))
             query_props.update(parsed_tags)
 
-        return self._mexe("measurements/%s" % self.sanitize(name), method="GET", query_props=query_props)
+        return self._mexe("measurements/%s" % self.sanitize(name), method="GET", query_props=query_props,
+                          decoder=decoder)
 
     def get_measurements(self, name, **query_props):
         return self.get_tagged(name, **query_props)
@@ -342,17 +554,25 @@ class LibratoConnection(object):
                 query_props['resolution'] = 1
             if 'start_time' not in query_props:
                 raise Exception("You must provide a 'start_time'")
+            decoder = self._columnar_decoder(query_props.pop('as_arrays', None))
             query_props['compose'] = compose
-            return self._mexe('metrics', method="GET", query_props=query_props)
+            return self._mexe('metrics', method="GET", query_props=query_props, decoder=decoder)
 
     def get_composite_tagged(self, compose, **query_props):
+        decoder = self._columnar_decoder(query_props.pop('as_arrays', None))
         if 'resolution' not in query_props:
             # Default to raw resolution
             query_props['resolution'] = 1
         if 'start_time' not in query_props:
             raise Exception("You must provide a 'start_time'")
         query_props['compose'] = compose
-        return self._mexe('measurements', method="GET", query_props=query_props)
+        return self._mexe('measurements', method="GET", query_props=query_props, decoder=decoder)
+
+    def _columnar_decoder(self, as_arrays):
+        if not as_arrays:
+            return None
+        from librato.columnar import ColumnarDecoder
+        return ColumnarDecoder(as_arrays)
 
     def create_composite(self, name, compose, **query_props):
         query_props['composite'] = compose
@@ -360,7 +580,9 @@ class LibratoConnection(object):
         return self.update(name, **query_props)
 
     def update(self, name, **query_props):
-        return self._mexe("metrics/%s" % self.sanitize(name), method="PUT", query_props=query_props)
+        resp = self._mexe("metrics/%s" % self.sanitize(name), method="PUT", query_props=query_props)
+        self._invalidate('metric', self.sanitize(name))
+        return resp
 
     def delete(self, names):
         if isinstance(names, six.string_types):
@@ -372,27 +594,114 @@ class LibratoConnection(object):
         if not isinstance(names, string_types):
             payload = {'names': names}
             path = "metrics"
-        return self._mexe(path, method="DELETE", query_props=payload)
+        resp = self._mexe(path, method="DELETE", query_props=payload)
+        for name in ([names] if isinstance(names, string_types) else names):
+            self._invalidate('metric', name)
+        return resp
+
+    def bulk_delete(self, names, chunk_size=BULK_CHUNK_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """Delete many metrics, chunk_size names per request and up to
+        max_workers requests at a time.
+        This is a generator: requests are only sent as it is iterated. It
+        yields a BulkResult per chunk as soon as the chunk is done; a failed
+        chunk carries its error rather than stopping the others.
+        """
+        def delete_chunk(chunk):
+            self._mexe("metrics", method="DELETE", query_props={'names': chunk})
+            for name in chunk:
+                self._invalidate('metric', name)
+
+        chunks = chunked((self.sanitize(name) for name in names), chunk_size)
+        for chunk, _, error in imap_bounded(delete_chunk, chunks, max_workers, ordered=False):
+            yield BulkResult(chunk, None, error)
+
+    def bulk_update(self, updates, chunk_size=BULK_CHUNK_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """Update many metrics. updates maps metric names to the properties
+        to set (as for update), either as a dict or as (name, props) pairs.
+        Metrics getting the same properties are updated together, chunk_size
+        names per request and up to max_workers requests at a time.
+        Like bulk_delete, yields a BulkResult per chunk.
+        """
+        if isinstance(updates, dict):
+            updates = updates.items()
+
+        def update_chunk(chunk):
+            names, props = chunk
+            self._mexe("metrics", method="PUT", query_props=dict(props, names=names))
+            for name in names:
+                self._invalidate('metric', name)
+
+        chunks = update_chunks(((self.sanitize(name), props) for name, props in updates), chunk_size)
+        for (names, props), _, error in imap_bounded(update_chunk, chunks, max_workers, ordered=False):
+            yield BulkResult(names, props, error)
 
     #
     # Annotations
     #
     def list_annotation_streams(self, **query_props):
         """List all annotation streams"""
+        from librato.annotations import Annotation
         return self._get_paginated_results('annotations', Annotation, **query_props)
 
     def get_annotation_stream(self, name, **query_props):
         """Get an annotation stream (add start_date to query props for events)"""
+        from librato.annotations import Annotation
         resp = self._mexe("annotations/%s" % name, method="GET", query_props=query_props)
         return Annotation.from_dict(self, resp)
 
     def get_annotation(self, name, id, **query_props):
         """Get a specific annotation event by ID"""
+        from librato.annotations import Annotation
         resp = self._mexe("annotations/%s/%s" % (name, id), method="GET", query_props=query_props)
         return Annotation.from_dict(self, resp)
 
+    def iter_annotation_events(self, name, start_time, end_time=None, sources=None,
+                               window=86400, page_size=100, max_workers=DEFAULT_MAX_WORKERS):
+        """Iterate over the events of an annotation stream between start_time
+        and end_time (now by default), optionally only those of sources.
+        The range is walked in windows of window seconds, each paged through
+        page_size events at a time; up to max_workers windows are fetched
+        ahead concurrently. Events come out as AnnotationEvent tuples, in
+        start_time order, each event once.
+        """
+        from librato.annotations import iter_events, time_windows
+        if end_time is None:
+            end_time = int(time.time())
+
+        def fetch(bounds):
+            query = {'start_time': bounds[0], 'end_time': bounds[1], 'length': page_size, 'offset': 0}
+            if sources:
+                query['sources'] = list(sources)
+            events = []
+            while True:
+                resp = self._mexe("annotations/%s" % name, query_props=query)
+                page = list(iter_events(resp.get('events')))
+                events.extend(page)
+                length = resp.get('query', {}).get('length', len(page))
+                total = resp.get('query', {}).get('total', 0)
+                query['offset'] += length
+                if length <= 0 or query['offset'] >= total:
+                    return events
+
+        # Windows share their boundaries, so only the ids of the previous
+        # window are needed to drop the duplicates. Events without an id
+        # can't be told apart and are always yielded.
+        previous = current = set()
+        windows = time_windows(int(start_time), int(end_time), window)
+        for _, events, error in imap_bounded(fetch, windows, max_workers):
+            if error is not None:
+                raise error
+            previous, current = current, set()
+            for event in sorted(events, key=lambda e: (e.start_time or 0, e.id or 0)):
+                if event.id is not None:
+                    if event.id in previous or event.id in current:
+                        continue
+                    current.add(event.id)
+                yield event
+
     def update_annotation_stream(self, name, **query_props):
         """Update an annotation streams metadata"""
+        from librato.annotations import Annotation
         payload = Annotation(self, name).get_payload()
         for k, v in query_props.items():
             payload[k] = v
@@ -415,8 +724,10 @@ class LibratoConnection(object):
     #
     def create_alert(self, name, **query_props):
         """Create a new alert"""
+        from librato.alerts import Alert
         payload = Alert(self, name, **query_props).get_payload()
         resp = self._mexe("alerts", method="POST", query_props=payload)
+        self._invalidate('alert')
         return Alert.from_dict(self, resp)
 
     def update_alert(self, alert, **query_props):
@@ -426,6 +737,7 @@ class LibratoConnection(object):
             payload[k] = v
         resp = self._mexe("alerts/%s" % alert._id,
                           method="PUT", query_props=payload)
+        self._invalidate('alert')
         return resp
 
     # Delete an alert by name (not by id)
@@ -434,11 +746,19 @@ class LibratoConnection(object):
         alert = self.get_alert(name)
         if alert is None:
             return None
+        return self._delete_alert(alert)
+
+    def _delete_alert(self, alert):
         resp = self._mexe("alerts/%s" % alert._id, method="DELETE")
+        self._invalidate('alert')
         return resp
 
     def get_alert(self, name):
         """Get specific alert"""
+        return self._cached('alert', (name,), lambda: self._get_alert(name))
+
+    def _get_alert(self, name):
+        from librato.alerts import Alert
         resp = self._mexe("alerts", query_props={'name': name})
         alerts = self._parse(resp, "alerts", Alert)
         if len(alerts) > 0:
@@ -447,9 +767,23 @@ class LibratoConnection(object):
 
     def list_alerts(self, active_only=True, **query_props):
         """List all alerts (default to active only)"""
+        from librato.alerts import Alert
         return self._get_paginated_results("alerts", Alert, **query_props)
 
+    def sync_alerts(self, desired, delete_missing=False, dry_run=False, max_workers=DEFAULT_MAX_WORKERS):
+        """Make the account's alerts match desired (Alert objects or dicts).
+        All alerts are listed once and only the alerts that differ are created,
+        updated or (with delete_missing) deleted, max_workers at a time.
+        Returns the Plan; with dry_run it is returned without being applied.
+        """
+        from librato.sync import AlertSet
+        plan = AlertSet.fetch(self).diff(desired, delete_missing=delete_missing)
+        if not dry_run:
+            plan.apply(max_workers=max_workers)
+        return plan
+
     def list_services(self, **query_props):
+        from librato.alerts import Service
         # Note: This API currently does not have the ability to
         # filter by title, type, etc
         return self._get_paginated_results("services", Service, **query_props)
@@ -459,18 +793,28 @@ class LibratoConnection(object):
     #
     def list_spaces(self, **query_props):
         """List all spaces"""
+        from librato.spaces import Space
         return self._get_paginated_results("spaces", Space, **query_props)
 
     def get_space(self, id, **query_props):
         """Get specific space by ID"""
+        if query_props:
+            return self._get_space(id, **query_props)
+        return self._cached('space', ('id', id), lambda: self._get_space(id))
+
+    def _get_space(self, id, **query_props):
+        from librato.spaces import Space
         resp = self._mexe("spaces/%s" % id,
                           method="GET", query_props=query_props)
         return Space.from_dict(self, resp)
 
     def find_space(self, name):
+        """Find specific space by Name"""
         if type(name) is int:
             raise ValueError("This method expects name as a parameter, %s given" % name)
-        """Find specific space by Name"""
+        return self._cached('space', ('name', name.lower()), lambda: self._find_space(name))
+
+    def _find_space(self, name):
         spaces = self.list_spaces(name=name)
         # Find the Space by name (case-insensitive)
         # This returns the first space found matching the name
@@ -488,25 +832,52 @@ class LibratoConnection(object):
             payload[k] = v
         resp = self._mexe("spaces/%s" % space.id,
                           method="PUT", query_props=payload)
+        self._invalidate('space')
         return resp
 
     def create_space(self, name, **query_props):
+        from librato.spaces import Space
         payload = Space(self, name).get_payload()
         for k, v in query_props.items():
             payload[k] = v
         resp = self._mexe("spaces", method="POST", query_props=payload)
+        self._invalidate('space', 'name')
         return Space.from_dict(self, resp)
 
     def delete_space(self, id):
         """delete a space"""
         resp = self._mexe("spaces/%s" % id, method="DELETE")
+        self._invalidate('space')
+        self._invalidate('chart', id)
         return resp
 
+    def provision_spaces(self, spec, delete_missing_charts=False, dry_run=False,
+                         max_workers=DEFAULT_MAX_WORKERS):
+        """Make spaces and their charts match a declarative spec (see SpaceSet).
+        Spaces are listed once, charts once per space, and only the charts
+        that differ are created, updated or (with delete_missing_charts)
+        deleted, max_workers at a time. Returns the Plan; with dry_run it is
+        returned without being applied.
+        """
+        from librato.sync import SpaceSet
+        plan = SpaceSet.fetch(self).diff(spec, delete_missing_charts=delete_missing_charts,
+                                         max_workers=max_workers)
+        if not dry_run:
+            plan.apply(max_workers=max_workers)
+        return plan
+
     #
     # Charts
     #
     def list_charts_in_space(self, space, **query_props):
         """List all charts from space"""
+        if query_props:
+            return self._list_charts_in_space(space, **query_props)
+        # Hand out a copy so callers can't alter the cached list
+        return list(self._cached('chart', (space.id, 'list'), lambda: self._list_charts_in_space(space)))
+
+    def _list_charts_in_space(self, space, **query_props):
+        from librato.spaces import Chart
         resp = self._mexe("spaces/%s/charts" % space.id, query_props=query_props)
         # "charts" is not in the response, but make this
         # actually return Chart objects
@@ -518,6 +889,7 @@ class LibratoConnection(object):
 
     def get_chart(self, chart_id, space_or_space_id, **query_props):
         """Get specific chart by ID from Space"""
+        from librato.spaces import Space
         space_id = None
         if type(space_or_space_id) is int:
             space_id = space_or_space_id
@@ -525,6 +897,12 @@ class LibratoConnection(object):
             space_id = space_or_space_id.id
         else:
             raise ValueError("Space parameter is invalid")
+        if query_props:
+            return self._get_chart(chart_id, space_id, **query_props)
+        return self._cached('chart', (space_id, 'id', chart_id), lambda: self._get_chart(chart_id, space_id))
+
+    def _get_chart(self, chart_id, space_id, **query_props):
+        from librato.spaces import Chart
         # TODO: Add better handling around 404s
         resp = self._mexe("spaces/%s/charts/%s" % (space_id, chart_id), method="GET", query_props=query_props)
         resp['space_id'] = space_id
@@ -542,10 +920,12 @@ class LibratoConnection(object):
 
     def create_chart(self, name, space, **query_props):
         """Create a new chart in space"""
+        from librato.spaces import Chart
         payload = Chart(self, name).get_payload()
         for k, v in query_props.items():
             payload[k] = v
         resp = self._mexe("spaces/%s/charts" % space.id, method="POST", query_props=payload)
+        self._invalidate('chart', space.id)
         resp['space_id'] = space.id
         return Chart.from_dict(self, resp)
 
@@ -557,28 +937,145 @@ class LibratoConnection(object):
         resp = self._mexe("spaces/%s/charts/%s" % (space.id, chart.id),
                           method="PUT",
                           query_props=payload)
+        self._invalidate('chart', space.id)
         return resp
 
     def delete_chart(self, chart_id, space_id, **query_props):
         """delete a chart from a space"""
         resp = self._mexe("spaces/%s/charts/%s" % (space_id, chart_id), method="DELETE")
+        self._invalidate('chart', space_id)
         return resp
 
     #
     # Queue
     #
     def new_queue(self, **kwargs):
+        from librato.queue import Queue
         return Queue(self, **kwargs)
 
+    def new_annotation_queue(self, **kwargs):
+        from librato.annotation_queue import AnnotationQueue
+        return AnnotationQueue(self, **kwargs)
+
     #
     # misc
     #
     def set_timeout(self, timeout):
         self.timeout = timeout
 
+    def close(self):
+        """Release the transport's pooled connections, if any"""
+        self.transport.close()
+
+    def _after_fork(self):
+        from librato.cache import SingleFlight
+        # See librato.forksafe
+        if hasattr(self.transport, '_after_fork'):
+            self.transport._after_fork()
+        if self.metadata_cache is not None:
+            self.metadata_cache._after_fork()
+        if self.validator_cache is not None:
+            self.validator_cache._after_fork()
+        if self.single_flight is not None:
+            self.single_flight = SingleFlight()
+
+    #
+    # Metadata cache
+    #
+    def enable_metadata_cache(self, max_size=1000, ttls=None):
+        """Cache the results of get, get_space, find_space, list_charts_in_space,
+        get_chart and get_alert locally. ttls maps an entity type ('metric',
+        'space', 'chart', 'alert') to its time to live in seconds.
+        Our own create/update/delete calls invalidate the affected entries.
+        """
+        from librato.cache import MetadataCache
+        self.metadata_cache = MetadataCache(max_size=max_size, ttls=ttls)
+        return self.metadata_cache
+
+    def disable_metadata_cache(self):
+        self.metadata_cache = None
+
+    #
+    # Conditional requests
+    #
+    def enable_conditional_requests(self, max_entries=500):
+        """Remember the ETag/Last-Modified validators of GET responses and
+        revalidate repeated GETs with If-None-Match/If-Modified-Since.
+        On a 304 the previously decoded response is returned as is (shared
+        between callers, so treat it as read-only).
+        """
+        from librato.cache import ValidatorCache
+        self.validator_cache = ValidatorCache(max_size=max_entries)
+        return self.validator_cache
+
+    def disable_conditional_requests(self):
+        self.validator_cache = None
+
+    #
+    # Request coalescing
+    #
+    def enable_request_coalescing(self):
+        """Let concurrent identical GETs (same path and query parameters)
+        share a single request: the first caller sends it, the others wait
+        for its response (shared between callers, so treat it as
+        read-only) or its error. See single_flight.stats().
+        """
+        from librato.cache import SingleFlight
+        if self.single_flight is None:
+            self.single_flight = SingleFlight()
+        return self.single_flight
+
+    def disable_request_coalescing(self):
+        self.single_flight = None
+
+    #
+    # Measurement validation
+    #
+    def enable_validation(self, mode='strict', **rules):
+        """Check measurements before they are sent (by submit, submit_tagged,
+        create_tagged_payload and queues). mode is 'strict' (raise
+        InvalidMeasurement), 'drop' or 'repair'; rules are passed on to
+        librato.validation.MeasurementValidator.
+        """
+        from librato.validation import MeasurementValidator
+        self.measurement_validator = MeasurementValidator(mode, **rules)
+        return self.measurement_validator
+
+    def disable_validation(self):
+        self.measurement_validator = None
+
+    #
+    # Streamed request bodies
+    #
+    def enable_body_streaming(self, chunked=True, min_items=1000, block_size=None):
+        """Encode the JSON bodies of POST, PUT and DELETE requests whose
+        top-level lists hold at least min_items items (measurements, metric
+        names...) as they are sent, block_size bytes at a time, instead of
+        building the whole document first (block_size defaults to
+        librato.streaming.DEFAULT_BLOCK_SIZE). The body is sent with
+        Transfer-Encoding: chunked, or with a Content-Length worked out
+        beforehand if chunked is False (the payload is then encoded twice).
+        Transports that can't send iterable bodies (the stdlib and urllib3
+        ones before python 3.6, see Transport.streams_bodies) keep building
+        bodies in full.
+        """
+        self.body_streaming = {'chunked': chunked, 'min_items': min_items, 'block_size': block_size}
+
+    def disable_body_streaming(self):
+        self.body_streaming = None
+
+    def _cached(self, entity, key, loader):
+        if self.metadata_cache is None:
+            return loader()
+        return self.metadata_cache.get_or_load(entity, key, loader)
+
+    def _invalidate(self, entity, *prefix):
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(entity, *prefix)
+
 
 def connect(username=None, api_key=None, hostname=HOSTNAME, base_path=BASE_PATH, sanitizer=sanitize_no_op,
-            protocol="https", tags={}):
+            protocol="https", tags={}, transport=None):
     """
     Connect to Librato Metrics
     """
@@ -586,15 +1083,23 @@ def connect(username=None, api_key=None, hostname=HOSTNAME, base_path=BASE_PATH,
     username = username if username else os.getenv('LIBRATO_USER', '')
     api_key = api_key if api_key else os.getenv('LIBRATO_TOKEN', '')
 
-    return LibratoConnection(username, api_key, hostname, base_path, sanitizer=sanitizer, protocol=protocol, tags=tags)
+    return LibratoConnection(username, api_key, hostname, base_path, sanitizer=sanitizer, protocol=protocol, tags=tags,
+                             transport=transport)
 
 
-def _decode_body(resp):
+def _decode_body(resp, decoder=None, info=None):
     """
-    Read and decode HTTPResponse body based on charset and content-type
+    Read and decode HTTPResponse body based on charset and content-type.
+    JSON bodies are parsed with decoder (json.loads by default). A streaming
+    decoder gets the response itself for successful JSON responses.
     """
+    if getattr(decoder, 'streaming', False) and resp.status < 300 \
+            and _get_content_type(resp) == "application/json":
+        return decoder.stream(resp, _getcharset(resp))
     body = resp.read()
-    log.info("body(<-): %s" % body)
+    if info is not None and body:
+        info.response_bytes = len(body)
+    _log_body("<-", body)
     if not body:
         return None
 
@@ -602,13 +1107,48 @@ def _decode_body(resp):
     content_type = _get_content_type(resp)
 
     if content_type == "application/json":
-        resp_data = json.loads(decoded_body)
+        resp_data = (decoder or json.loads)(decoded_body)
     else:
         resp_data = decoded_body
 
     return resp_data
 
 
+def _log_body(direction, body):
+    """Log a body on the librato.body channel, only formatting it when
+    that channel is enabled for DEBUG"""
+    if body is None or not body_log.isEnabledFor(logging.DEBUG):
+        return
+    size = len(body)
+    text = body[:LOG_BODY_LIMIT]
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    if size > LOG_BODY_LIMIT:
+        body_log.debug("body(%s): %s... (%d bytes, truncated)", direction, text, size)
+    else:
+        body_log.debug("body(%s): %s", direction, text)
+
+
+def _default_user_agent():
+    global _user_agent
+    if _user_agent is None:
+        import platform
+        # http://en.wikipedia.org/wiki/User_agent#Format
+        # librato-metrics/1.0.3 (ruby; 1.9.3p385; x86_64-darwin11.4.2) direct-faraday/0.8.4
+        ua_chunks = []  # Set user agent
+        ua_chunks.append("python-librato/" + __version__)
+        p = platform
+        system_info = (p.python_version(), p.machine(), p.system(), p.release())
+        ua_chunks.append("(python; %s; %s-%s%s)" % system_info)
+        _user_agent = ' '.join(ua_chunks)
+    return _user_agent
+
+
+def _redact_headers(headers):
+    """A copy of headers safe to log"""
+    return dict((k, '<redacted>' if k.lower() == 'authorization' else v) for k, v in headers.items())
+
+
 def _getcharset(resp, default='utf-8'):
     """
     Extract the charset from an HTTPResponse.
@@ -619,6 +1159,7 @@ def _getcharset(resp, default='utf-8'):
     if hasattr(resp, 'headers'):
         return resp.headers.get_content_charset(default)
     else:
+        import email.message
         m = email.message.Message()
         m['content-type'] = resp.getheader('content-type')
         return m.get_content_charset(default)
@@ -0,0 +1,191 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Adaptive chunk size and concurrency for queue submissions.
+
+AIMDController watches the requests that post measurements, through the
+connection hooks, and steers how many measurements go in a request and how
+many requests are in flight. Fast responses grow both additively; slow
+responses, retried server errors, throttling and oversized payloads shrink
+them multiplicatively, within fixed bounds.
+"""
+import threading
+import time
+from librato import forksafe
+
+# Requests whose outcome feeds the controller
+SUBMIT_PATHS = ('metrics', 'measurements')
+
+
+class AIMDController(object):
+    """Additive increase, multiplicative decrease of chunk size and workers.
+
+    >>> controller = AIMDController(target_latency=0.5)
+    >>> q = api.new_queue(adaptive=controller)
+
+    Every response under target_latency seconds adds chunk_step to the chunk
+    size, and every round of max_workers such responses adds a worker. A
+    response over target_latency, a retried 5xx or a 429 multiplies both by
+    decrease; a 413 only shrinks the chunk size. Decreases are applied at
+    most once per cooldown seconds, so a burst of failures from requests that
+    were in flight together only counts once.
+    """
+    def __init__(self, min_chunk=25, max_chunk=300, chunk_size=None, chunk_step=25,
+                 min_workers=1, max_workers=8, workers=None,
+                 target_latency=1.0, decrease=0.5, cooldown=None, clock=time.time):
+        if not 0 < min_chunk <= max_chunk:
+            raise ValueError("Chunk bounds must satisfy 0 < min_chunk <= max_chunk")
+        if not 0 < min_workers <= max_workers:
+            raise ValueError("Worker bounds must satisfy 0 < min_workers <= max_workers")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.chunk_step = chunk_step
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.cooldown = target_latency if cooldown is None else cooldown
+        self.clock = clock
+        self.chunk_size = self._bound(chunk_size or max_chunk, min_chunk, max_chunk)
+        self.workers = self._bound(workers or min_workers, min_workers, max_workers)
+        self.connection = None
+        self._lock = threading.Lock()
+        self._good = 0
+        self._last_decrease = None
+        self.latency = None
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.errors = 0
+        self.increases = 0
+        self.decreases = 0
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bound(value, low, high):
+        return max(low, min(high, int(value)))
+
+    def install(self, connection):
+        """Start observing connection. Does nothing if already observing it."""
+        if self.connection is connection:
+            return self
+        if self.connection is not None:
+            self.uninstall()
+        self.connection = connection
+        connection.add_hook('after_response', self.after_response)
+        connection.add_hook('on_retry', self.on_retry)
+        connection.add_hook('on_error', self.on_error)
+        return self
+
+    def uninstall(self):
+        if self.connection is None:
+            return
+        self.connection.remove_hook('after_response', self.after_response)
+        self.connection.remove_hook('on_retry', self.on_retry)
+        self.connection.remove_hook('on_error', self.on_error)
+        self.connection = None
+
+    @staticmethod
+    def _observed(info):
+        return info.method == 'POST' and info.path in SUBMIT_PATHS
+
+    def after_response(self, info):
+        if not self._observed(info):
+            return
+        with self._lock:
+            self.requests += 1
+            self._record_latency(info.elapsed)
+            if info.elapsed is not None and info.elapsed > self.target_latency:
+                self._decrease()
+            else:
+                self._increase()
+
+    def on_retry(self, info):
+        if not self._observed(info):
+            return
+        with self._lock:
+            self.retries += 1
+            self._decrease()
+
+    def on_error(self, info):
+        if not self._observed(info):
+            return
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            if info.status == 429:
+                self.throttled += 1
+                self._decrease()
+            elif info.status == 413:
+                self._decrease(workers=False)
+            elif info.status is None or info.status >= 500:
+                self._decrease()
+
+    def _record_latency(self, elapsed):
+        if elapsed is None:
+            return
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * elapsed
+
+    def _increase(self):
+        self._good += 1
+        self.chunk_size = min(self.max_chunk, self.chunk_size + self.chunk_step)
+        if self._good >= self.workers:
+            self._good = 0
+            self.workers = min(self.max_workers, self.workers + 1)
+        self.increases += 1
+
+    def _decrease(self, workers=True):
+        self._good = 0
+        now = self.clock()
+        if self._last_decrease is not None and now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.chunk_size = self._bound(self.chunk_size * self.decrease, self.min_chunk, self.max_chunk)
+        if workers:
+            self.workers = self._bound(self.workers * self.decrease, self.min_workers, self.max_workers)
+        self.decreases += 1
+
+    def stats(self):
+        """The controller state as a dict"""
+        with self._lock:
+            return {
+                'chunk_size': self.chunk_size,
+                'workers': self.workers,
+                'latency': self.latency,
+                'requests': self.requests,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'increases': self.increases,
+                'decreases': self.decreases,
+            }
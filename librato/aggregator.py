@@ -23,7 +23,11 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import logging
 import time
+from librato import forksafe
+
+log = logging.getLogger("librato")
 
 
 class Aggregator(object):
@@ -31,6 +35,8 @@ class Aggregator(object):
     submitted.
     Specify a period (default: None) and the aggregator will automatically
     floor the measure_times to that interval.
+    A fork_policy (default: 'reset') says what a forked child does with the
+    measurements aggregated in its parent, see librato.forksafe.
     """
 
     def __init__(self, connection, **args):
@@ -43,6 +49,8 @@ class Aggregator(object):
         self.tagged_measurements = {}
         self.period = args.get('period')
         self.measure_time = args.get('measure_time')
+        self.fork_policy = forksafe.check_policy(args.get('fork_policy', 'reset'))
+        forksafe.register(self)
 
     # Get a shallow copy of the top-level tag set
     def get_tags(self):
@@ -182,6 +190,18 @@ class Aggregator(object):
         self.tagged_measurements = {}
         self.measure_time = None
 
+    def _before_fork(self):
+        if self.fork_policy == 'flush' and (self.measurements or self.tagged_measurements):
+            try:
+                self.submit()
+            except Exception:
+                log.exception("Could not submit the aggregator before forking")
+
+    def _after_fork(self):
+        if self.fork_policy != 'keep':
+            self.measurements = {}
+            self.tagged_measurements = {}
+
     def submit(self):
         # Submit any legacy or tagged measurements to API
         # This will actually return an empty 200 response (no body)
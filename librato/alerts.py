@@ -1,6 +1,9 @@
 class Alert(object):
     """Librato Alert Base class"""
 
+    __slots__ = ('connection', 'name', 'description', 'version', 'conditions', 'services',
+                 'attributes', 'active', 'rearm_seconds', '_id', 'md')
+
     def __init__(self, connection, name, _id=None, description=None, version=2, md=False,
                  conditions=[], services=[], attributes={}, active=True, rearm_seconds=None):
         self.connection = connection
@@ -0,0 +1,223 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Buffered, concurrent posting of annotation events.
+
+The API takes annotation events one at a time, so posting hundreds of them
+(a deploy touching many services, say) is a matter of overlapping the
+requests rather than packing them into one body.
+"""
+import logging
+import threading
+from collections import namedtuple, OrderedDict
+from six.moves import queue
+
+from librato import forksafe
+from librato.workers import DEFAULT_MAX_WORKERS, imap_bounded
+
+log = logging.getLogger("librato")
+
+_STOP = object()
+
+
+class PostedAnnotation(namedtuple('PostedAnnotation', 'name event response error')):
+    """Outcome of posting one event to the stream name: the API response,
+    or the exception raised"""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class AnnotationQueue(object):
+    """Buffers annotation events per stream and posts them concurrently.
+
+    >>> q = api.new_annotation_queue()
+    >>> q.add('deploys', 'v1.2', source='web-1')
+    >>> q.add('deploys', 'v1.2', source='web-2')
+    >>> results = q.submit()
+
+    Up to max_workers events are posted at a time. Each post goes through
+    the connection, with its usual retries on server errors.
+
+    With background=True, add() only hands the event over to worker threads
+    and returns straight away; events are dropped (and counted in
+    .dropped) rather than blocking once max_pending are waiting. flush()
+    waits for the events added so far to be posted and close() stops the
+    workers. Failed events are kept in .failed and passed to on_error.
+
+    fork_policy says what a forked child does with the events buffered in
+    its parent, see librato.forksafe. Background workers are started again
+    in the child when it adds an event.
+    """
+
+    def __init__(self, connection, max_workers=DEFAULT_MAX_WORKERS, auto_submit_count=None,
+                 background=False, max_pending=10000, on_error=None, fork_policy='reset'):
+        self.connection = connection
+        self.max_workers = max_workers
+        self.auto_submit_count = auto_submit_count
+        self.background = background
+        self.on_error = on_error
+        self.max_pending = max_pending
+        self.fork_policy = forksafe.check_policy(fork_policy)
+        self.events = OrderedDict()
+        self.failed = []
+        self.posted = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(max_pending) if background else None
+        self._threads = []
+        forksafe.register(self)
+
+    def add(self, name, title, **query_props):
+        """Queue an event for the annotation stream name. query_props are
+        those of post_annotation (source, description, start_time, ...)"""
+        event = dict(query_props, title=title)
+        if self.background:
+            self._start_workers()
+            try:
+                self._pending.put_nowait((name, event))
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+            return
+        self.events.setdefault(name, []).append(event)
+        if self.auto_submit_count and len(self) >= self.auto_submit_count:
+            self.submit()
+
+    def __len__(self):
+        return sum(len(events) for events in self.events.values())
+
+    def _post(self, item):
+        name, event = item
+        return self.connection.post_annotation(name, **event)
+
+    def _record(self, name, event, resp, error):
+        result = PostedAnnotation(name, event, resp, error)
+        with self._lock:
+            if error is None:
+                self.posted += 1
+            else:
+                self.failed.append(result)
+        if error is not None:
+            log.info("Could not post annotation to %s: %s", name, error)
+            if self.on_error is not None:
+                self.on_error(result)
+        return result
+
+    def submit(self):
+        """Post the buffered events, returns a PostedAnnotation per event in
+        the order they were added. Failures don't stop the other events."""
+        items = [(name, event) for name, events in self.events.items() for event in events]
+        self.events = OrderedDict()
+        return [self._record(name, event, resp, error)
+                for (name, event), resp, error in imap_bounded(self._post, items, self.max_workers)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.background:
+            self.close()
+        else:
+            self.submit()
+
+    def _before_fork(self):
+        if self.fork_policy == 'flush':
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Could not post the annotations before forking")
+
+    def _after_fork(self):
+        # None of the parent's threads exist here, and the locks they used
+        # may have been held when it forked
+        self._lock = threading.Lock()
+        self._threads = []
+        self.failed = []
+        self.posted = 0
+        self.dropped = 0
+        if self.fork_policy == 'keep':
+            pending = list(self._pending.queue) if self.background else []
+        else:
+            self.events = OrderedDict()
+            pending = []
+        if self.background:
+            self._pending = queue.Queue(self.max_pending)
+            for item in pending:
+                if item is not _STOP:
+                    self._pending.put_nowait(item)
+
+    #
+    # Background mode
+    #
+    def _start_workers(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(max(1, self.max_workers or 1)):
+                t = threading.Thread(target=self._work, name='librato-annotations-%d' % i)
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+    def _work(self):
+        while True:
+            item = self._pending.get()
+            try:
+                if item is _STOP:
+                    return
+                name, event = item
+                try:
+                    resp, error = self._post(item), None
+                except Exception as e:
+                    resp, error = None, e
+                try:
+                    self._record(name, event, resp, error)
+                except Exception:
+                    log.exception("on_error callback failed")
+            finally:
+                self._pending.task_done()
+
+    def flush(self):
+        """Wait for the events added so far to be posted"""
+        if self.background:
+            self._pending.join()
+        else:
+            self.submit()
+
+    def close(self):
+        """Post what is left and stop the background workers"""
+        if not self.background:
+            self.submit()
+            return
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._pending.put(_STOP)
+        for t in threads:
+            t.join()
@@ -22,11 +22,14 @@
 # ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from collections import namedtuple
 
 
 class Annotation(object):
     """Librato Annotation Stream Base class"""
 
+    __slots__ = ('connection', 'name', 'display_name', 'events', 'query')
+
     def __init__(self, connection, name, display_name=None):
         self.connection = connection
         self.name = name
@@ -49,3 +52,45 @@ class Annotation(object):
 
     def get_payload(self):
         return {'name': self.name, 'display_name': self.display_name}
+
+
+class AnnotationEvent(namedtuple('AnnotationEvent',
+                                 'id title source start_time end_time description links')):
+    """A single annotation event, as yielded by iter_annotation_events"""
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, data, source=None):
+        return cls(data.get('id'), data.get('title'), data.get('source') or source,
+                   data.get('start_time'), data.get('end_time'), data.get('description'),
+                   data.get('links'))
+
+
+def iter_events(events):
+    """AnnotationEvents out of the events member of an annotation stream,
+    a {source: [event, ...]} dict or a list of those"""
+    if not events:
+        return
+    if isinstance(events, dict):
+        events = [events]
+    for by_source in events:
+        for source, source_events in by_source.items():
+            for data in source_events:
+                yield AnnotationEvent.from_dict(data, source)
+
+
+def time_windows(start, end, window):
+    """(start, end) pairs covering start..end in steps of window seconds.
+    Consecutive windows share their boundary."""
+    if window <= 0:
+        raise ValueError("window must be positive, got %r" % (window,))
+    return _time_windows(start, end, window)
+
+
+def _time_windows(start, end, window):
+    while True:
+        stop = min(start + window, end)
+        yield start, stop
+        if stop >= end:
+            return
+        start = stop
@@ -0,0 +1,384 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Offline benchmarks for the measurement submission hot path.
+
+Run with::
+
+    python -m librato.bench                      # all benchmarks
+    python -m librato.bench --quick queue_add    # a quick run of one benchmark
+    python -m librato.bench --output new.json --compare old.json
+
+Nothing leaves the machine: end-to-end benchmarks run against a local
+FakeLibratoServer. Results can be written as JSON and compared with a
+previous run to spot regressions between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+import librato
+from librato.aggregator import Aggregator
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, size):
+    """Register a benchmark. fn(n) performs n operations (n is scaled down
+    with --quick) and may return a dict of extra figures to report. If that
+    dict has a 'seconds' entry it replaces the overall timing, for benchmarks
+    that need to exclude their setup.
+    """
+    def register(fn):
+        BENCHMARKS[name] = (fn, size)
+        return fn
+    return register
+
+
+class _NullHTTPConnection(object):
+    """Swallows requests so the client-side cost can be measured alone"""
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def request(self, method, uri, body=None, headers=None):
+        if body:
+            self.bytes_sent += len(body)
+
+    def getresponse(self):
+        return None
+
+
+def _connection(**kwargs):
+    return librato.connect('bench', 'token', **kwargs)
+
+
+@benchmark('queue_add', 100000)
+def bench_queue_add(n):
+    q = _connection().new_queue()
+    for i in range(n):
+        q.add('bench.metric.%d' % (i % 100), i, source='host-%d' % (i % 10))
+
+
+@benchmark('queue_add_tagged', 100000)
+def bench_queue_add_tagged(n):
+    q = _connection().new_queue()
+    tags = [{'host': 'host-%d' % h, 'region': 'us-east-1'} for h in range(10)]
+    for i in range(n):
+        q.add_tagged('bench.metric.%d' % (i % 100), i, tags=tags[i % 10])
+
+
+@benchmark('aggregator_add', 200000)
+def bench_aggregator_add(n):
+    a = Aggregator(_connection())
+    for i in range(n):
+        a.add('bench.metric.%d' % (i % 100), i)
+
+
+@benchmark('create_tagged_payload', 100000)
+def bench_create_tagged_payload(n):
+    conn = _connection(tags={'service': 'bench'})
+    for i in range(n):
+        conn.create_tagged_payload('bench.metric', i, tags={'host': 'a'}, inherit_tags=True)
+
+
+@benchmark('chunk_serialization', 300000)
+def bench_chunk_serialization(n):
+    conn = _connection()
+    q = conn.new_queue()
+    for i in range(n):
+        q.add_tagged('bench.metric.%d' % (i % 100), float(i), tags={'host': 'host-%d' % (i % 10)})
+    null = _NullHTTPConnection()
+    headers = {}
+    started = time.time()
+    for chunk in q.tagged_chunks:
+        conn._make_request(null, 'measurements', headers, chunk, 'POST')
+    elapsed = time.time() - started
+    return {'seconds': elapsed, 'chunks': len(q.tagged_chunks), 'bytes': null.bytes_sent}
+
+
+@benchmark('submit_end_to_end', 30000)
+def bench_submit_end_to_end(n):
+    from librato.testing import FakeLibratoServer
+    with FakeLibratoServer(check_auth=False) as server:
+        q = server.connect().new_queue()
+        for i in range(n):
+            q.add_tagged('bench.metric.%d' % (i % 100), float(i), tags={'host': 'host-%d' % (i % 10)})
+        started = time.time()
+        q.submit()
+        elapsed = time.time() - started
+        stats = server.stats()
+    return {'seconds': elapsed, 'requests': stats['requests'], 'bytes': stats['bytes_in']}
+
+
+@benchmark('pagination', 20000)
+def bench_pagination(n):
+    from librato.testing import FakeLibratoServer
+    with FakeLibratoServer(check_auth=False, page_size=100) as server:
+        for i in range(n):
+            server.store.metrics['bench.metric.%d' % i] = {
+                'name': 'bench.metric.%d' % i, 'type': 'gauge', 'description': None,
+                'period': None, 'attributes': {'display_units_short': 'ms'}}
+        started = time.time()
+        count = sum(1 for _ in server.connect().list_all_metrics())
+        elapsed = time.time() - started
+        requests = server.stats()['requests']
+    assert count == n, count
+    return {'seconds': elapsed, 'requests': requests}
+
+
+@benchmark('metric_memory', 50000)
+def bench_metric_memory(n):
+    import tracemalloc
+    from librato.metrics import Metric
+    conn = _connection()
+
+    def raw(i):
+        # As decoded from a page of the API, which is not kept
+        return {'name': 'bench.metric.%d' % i, 'type': 'gauge', 'description': None, 'period': 60,
+                'source_lag': None, 'attributes': {'display_units_short': 'ms', 'aggregate': False,
+                                                   'created_by_ua': 'python-librato/3.0'}}
+    figures = {}
+    for label, lazy in (('metric', False), ('lazy_metric', True)):
+        started = time.time()
+        metrics = [Metric.from_dict(conn, raw(i), lazy=lazy) for i in range(n)]
+        figures['seconds_lazy' if lazy else 'seconds'] = time.time() - started
+        del metrics
+        # What the metrics keep alive, their raw data included
+        tracemalloc.start()
+        metrics = [Metric.from_dict(conn, raw(i), lazy=lazy) for i in range(n)]
+        figures['bytes_per_%s' % label] = tracemalloc.get_traced_memory()[0] // n
+        tracemalloc.stop()
+        del metrics
+    return figures
+
+
+class _Plain(object):
+    """A __dict__ based stand-in for the slotted models"""
+
+
+def _slot_values(obj):
+    return [(name, getattr(obj, name)) for klass in type(obj).__mro__
+            for name in getattr(klass, '__slots__', ()) if hasattr(obj, name)]
+
+
+@benchmark('model_memory', 20000)
+def bench_model_memory(n):
+    import tracemalloc
+    from librato.alerts import Alert
+    from librato.annotations import Annotation
+    from librato.metrics import Metric
+    from librato.spaces import Chart
+    from librato.streams import Stream
+    conn = _connection()
+    samples = [
+        ('metric', Metric.from_dict(conn, {'name': 'cpu', 'type': 'gauge', 'period': 60, 'attributes': {}})),
+        ('alert', Alert(conn, 'cpu.high', _id=1, description='CPU too high')),
+        ('chart', Chart(conn, 'CPU', id=1, space_id=2, streams=[{'metric': 'cpu'}])),
+        ('stream', Stream(metric='cpu', group_function='average')),
+        ('annotation', Annotation(conn, 'deploys', display_name='Deploys')),
+    ]
+    figures = {}
+    # The bytes per instance, attribute values (shared) left out
+    for label, sample in samples:
+        values = _slot_values(sample)
+        for suffix, make in (('', lambda: type(sample).__new__(type(sample))), ('_dict', _Plain)):
+            tracemalloc.start()
+            objects = []
+            for _ in range(n):
+                obj = make()
+                for name, value in values:
+                    setattr(obj, name, value)
+                objects.append(obj)
+            figures['bytes_per_%s%s' % (label, suffix)] = tracemalloc.get_traced_memory()[0] // n
+            tracemalloc.stop()
+            del objects
+    return figures
+
+
+@benchmark('metric_index_search', 100000)
+def bench_metric_index_search(n):
+    from librato.index import MetricIndex
+    index = MetricIndex(metrics=({'name': 'svc-%d.bench.metric.%d' % (i % 50, i), 'type': 'gauge',
+                                  'period': 60, 'attributes': {'units': 'ms' if i % 3 else 's'}}
+                                 for i in range(n)))
+    started = time.time()
+    found = len(index.search(prefix='svc-7.'))
+    found += len(index.search(glob='svc-1?.bench.*', attributes={'units': 's'}))
+    found += len(index.search(regex=r'metric\.99'))
+    return {'seconds': time.time() - started, 'found': found}
+
+
+@benchmark('validate_cached', 200000)
+def bench_validate_cached(n):
+    from librato.validation import MeasurementValidator
+    validator = MeasurementValidator()
+    now = int(time.time())
+    measurements = [{'name': 'bench.metric.%d' % (i % 100), 'value': float(i), 'time': now,
+                     'tags': {'host': 'web-%d' % (i % 10), 'region': 'us-east-1'}}
+                    for i in range(1000)]
+    for m in measurements:
+        validator.validate(m)
+    started = time.time()
+    for i in range(n):
+        validator.validate(measurements[i % 1000])
+    elapsed = time.time() - started
+    return {'seconds': elapsed, 'us_per_measurement': elapsed * 1e6 / n}
+
+
+@benchmark('streamed_body', 100000)
+def bench_streamed_body(n):
+    import tracemalloc
+    from librato.streaming import StreamedBody
+    now = int(time.time())
+    payload = {'measurements': [{'name': 'bench.metric', 'value': float(i), 'time': now,
+                                 'tags': {'host': 'web-%d' % (i % 100)}} for i in range(n)]}
+    encoders = (('peak_bytes', lambda: len(json.dumps(payload).encode('utf-8'))),
+                ('peak_bytes_streamed', lambda: sum(len(block) for block in StreamedBody(payload))))
+    started = time.time()
+    figures = {'body_bytes': encoders[1][1](), 'seconds': time.time() - started}
+    for label, encode in encoders:
+        tracemalloc.start()
+        encode()
+        figures[label] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return figures
+
+
+_IMPORT_SCRIPT = """
+import importlib, sys, time
+started = time.time()
+import librato
+if sys.argv[1] == 'eager':
+    for module in sorted(set(librato._LAZY.values())):
+        importlib.import_module(module)
+elapsed = time.time() - started
+loaded = sorted(m for m in set(librato._LAZY.values()) if m in sys.modules)
+sys.stdout.write(' '.join([repr(elapsed)] + loaded))
+"""
+
+
+def _time_import(mode):
+    """Time `import librato` in a fresh interpreter, return the seconds and
+    the lazily imported modules that ended up loaded"""
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(librato.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, '-c', _IMPORT_SCRIPT, mode], env=env).decode('utf-8').split()
+    return float(output[0]), output[1:]
+
+
+@benchmark('import_time', 20)
+def bench_import_time(n):
+    lazy = eager = 0.0
+    for _ in range(n):
+        seconds, loaded = _time_import('lazy')
+        lazy += seconds
+        seconds, loaded_eager = _time_import('eager')
+        eager += seconds
+    return {'seconds': lazy, 'ms_per_import': lazy * 1e3 / n, 'ms_per_eager_import': eager * 1e3 / n,
+            'modules_loaded': loaded, 'modules_loaded_eager': loaded_eager}
+
+
+def run(names=None, quick=False, repeat=3, out=None):
+    """Run the benchmarks (all of them by default), return a result dict"""
+    results = []
+    for name in (names or BENCHMARKS):
+        fn, size = BENCHMARKS[name]
+        n = max(1, size // 20) if quick else size
+        best = None
+        extra = None
+        for _ in range(1 if quick else repeat):
+            started = time.time()
+            extra = dict(fn(n) or {})
+            elapsed = extra.pop('seconds', time.time() - started)
+            best = elapsed if best is None else min(best, elapsed)
+        result = OrderedDict([('name', name), ('ops', n), ('seconds', best),
+                              ('ops_per_sec', n / best if best else None)])
+        result.update(extra)
+        results.append(result)
+        if out:
+            out.write("%-28s %12.0f ops/s  (%d ops in %.3fs)\n" % (name, result['ops_per_sec'] or 0, n, best))
+    return OrderedDict([
+        ('version', librato.__version__),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('time', int(time.time())),
+        ('quick', quick),
+        ('results', results),
+    ])
+
+
+def compare(baseline, current, threshold=0.9, out=sys.stdout):
+    """Print the throughput ratio of every benchmark in both runs.
+    Returns the names of the benchmarks that fell below threshold.
+    """
+    before = dict((r['name'], r) for r in baseline['results'])
+    regressions = []
+    for r in current['results']:
+        if r['name'] not in before or not before[r['name']]['ops_per_sec']:
+            continue
+        ratio = r['ops_per_sec'] / before[r['name']]['ops_per_sec']
+        flag = ''
+        if ratio < threshold:
+            regressions.append(r['name'])
+            flag = '  REGRESSION'
+        out.write("%-28s %6.2fx%s\n" % (r['name'], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m librato.bench', description=__doc__.split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run: %s' % ', '.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true', help='small sizes, single run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best one counts')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.9,
+                        help='flag benchmarks slower than this ratio of the baseline')
+    args = parser.parse_args(argv)
+
+    unknown = [b for b in args.benchmarks if b not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmark(s): %s" % ', '.join(unknown))
+
+    results = run(args.benchmarks, quick=args.quick, repeat=args.repeat, out=sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
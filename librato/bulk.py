@@ -0,0 +1,79 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Chunking helpers for the bulk metric endpoints.
+
+``PUT /v1/metrics`` and ``DELETE /v1/metrics`` take a list of metric names.
+Sending tens of thousands of names in one body gets rejected, so the names
+are cut into chunks that are sent concurrently (see
+LibratoConnection.bulk_delete and bulk_update), each chunk reporting its
+own outcome.
+"""
+import json
+from collections import namedtuple
+
+# Names sent in a single bulk request
+BULK_CHUNK_SIZE = 500
+
+
+class BulkResult(namedtuple('BulkResult', 'names props error')):
+    """Outcome of one bulk request: the metric names it covered, the
+    properties set on them (None for deletes) and the exception raised, if any"""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def chunked(iterable, size=BULK_CHUNK_SIZE):
+    """Lists of up to size items, consuming iterable lazily"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def update_chunks(updates, size=BULK_CHUNK_SIZE):
+    """Group (name, props) pairs into (names, props) chunks.
+
+    Only metrics getting the very same properties can share a request, so
+    pairs are bucketed by their properties; a bucket is emitted as soon as
+    it is full and the partial ones once updates is exhausted.
+    """
+    buckets = {}
+    for name, props in updates:
+        key = json.dumps(props, sort_keys=True)
+        names, _ = buckets.setdefault(key, ([], props))
+        names.append(name)
+        if len(names) >= size:
+            del buckets[key]
+            yield names, props
+    for key in sorted(buckets):
+        yield buckets[key]
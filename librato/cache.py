@@ -0,0 +1,257 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import time
+from collections import OrderedDict
+
+# Lets us cache None (e.g. find_space found nothing)
+_MISSING = object()
+
+
+class LRUCache(object):
+    """A thread-safe, size-bounded mapping with least-recently-used eviction.
+
+    Entries may carry a time to live (in seconds), after which they are
+    treated as missing.
+    """
+
+    def __init__(self, max_size=1000, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires = entry[1]
+        if expires is not None and expires <= self.clock():
+            del self._data[key]
+            self.expirations += 1
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            # Mark as most recently used
+            del self._data[key]
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires = self.clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def remove_if(self, predicate):
+        """Remove every entry whose key matches predicate, return how many"""
+        with self._lock:
+            doomed = [k for k in self._data if predicate(k)]
+            for k in doomed:
+                del self._data[k]
+            return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _after_fork(self):
+        # The lock may have been held by a thread of the parent
+        self._lock = threading.Lock()
+
+
+class MetadataCache(object):
+    """Client-side cache for metadata lookups (metrics, spaces, charts, alerts).
+
+    Every entry belongs to an entity type which controls its time to live.
+    Keys are tuples so that everything under a prefix (e.g. all the charts
+    of one space) can be invalidated at once.
+
+    >>> conn.enable_metadata_cache(ttls={'space': 30})
+    >>> conn.get_space(123)   # API call
+    >>> conn.get_space(123)   # served from the cache
+    >>> conn.metadata_cache.stats()
+    """
+    DEFAULT_TTLS = {
+        'metric': 300,
+        'space': 60,
+        'chart': 60,
+        'alert': 60,
+    }
+    DEFAULT_TTL = 60
+
+    def __init__(self, max_size=1000, ttls=None, clock=time.time):
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.invalidations = 0
+        self._store = LRUCache(max_size, clock=clock)
+
+    def get_or_load(self, entity, key, loader):
+        """Return the cached value for (entity, key), calling loader on a miss"""
+        full_key = (entity,) + key
+        value = self._store.get(full_key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self._store.set(full_key, value, self.ttls.get(entity, self.DEFAULT_TTL))
+        return value
+
+    def invalidate(self, entity, *prefix):
+        """Drop the entries of an entity type, optionally only those whose key starts with prefix"""
+        n = len(prefix) + 1
+        full_prefix = (entity,) + prefix
+        self.invalidations += self._store.remove_if(lambda k: k[:n] == full_prefix)
+
+    def clear(self):
+        self._store.clear()
+
+    def _after_fork(self):
+        self._store._after_fork()
+
+    def __len__(self):
+        return len(self._store)
+
+    def stats(self):
+        s = self._store
+        lookups = s.hits + s.misses
+        return {
+            'hits': s.hits,
+            'misses': s.misses,
+            'hit_ratio': float(s.hits) / lookups if lookups else 0.0,
+            'evictions': s.evictions,
+            'expirations': s.expirations,
+            'invalidations': self.invalidations,
+            'size': len(s),
+        }
+
+
+class ValidatorCache(LRUCache):
+    """Decoded GET responses along with their ETag/Last-Modified validators,
+    keyed by canonical request. Used for conditional requests.
+    """
+
+    def __init__(self, max_size=500):
+        LRUCache.__init__(self, max_size)
+        self.not_modified = 0
+
+    def stats(self):
+        return {
+            'revalidations': self.hits,
+            'not_modified': self.not_modified,
+            'evictions': self.evictions,
+            'size': len(self),
+        }
+
+
+class _Flight(object):
+    __slots__ = ('done', 'result', 'error', 'finished')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # False if the leader was interrupted (KeyboardInterrupt, SystemExit...)
+        self.finished = False
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls sharing a key: the first caller runs the
+    call, those arriving while it is in flight wait for and share its
+    outcome (result or exception). If the first caller is interrupted
+    instead (KeyboardInterrupt...), the waiting ones try again themselves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if not flight.finished:
+                return self.do(key, fn)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            flight.finished = True
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            flight.finished = True
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        calls = self.executed + self.coalesced
+        return {
+            'calls': calls,
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'coalescing_ratio': float(self.coalesced) / calls if calls else 0.0,
+            'in_flight': len(self._flights),
+        }
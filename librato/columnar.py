@@ -0,0 +1,137 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Columnar decoding of measurement query responses.
+
+The measurement endpoints answer with one JSON object per data point, e.g.
+``{"time": 1502917147, "value": 80.0}``.  Turning a long series of those into
+arrays used to mean building every point dict first and then walking the list
+a second time.  The decoder below hooks into the JSON scanner instead: point
+objects are kept as flat tuples of pairs while parsing and are folded straight
+into per-field columns, so no per-point dict is ever created.
+"""
+from array import array
+import json
+
+# Fields that may show up in a single data point
+POINT_FIELDS = frozenset(['time', 'measure_time', 'value', 'count', 'sum',
+                          'min', 'max', 'last', 'stddev', 'sum_squares'])
+
+FORMATS = ('array', 'numpy', 'pandas')
+
+NAN = float('nan')
+
+
+class _Point(tuple):
+    """The (field, value) pairs of a data point, as handed out by the scanner"""
+    __slots__ = ()
+
+
+def _object_pairs_hook(pairs):
+    if not pairs:
+        return {}
+    timed = False
+    for k, _ in pairs:
+        if k not in POINT_FIELDS:
+            return dict(pairs)
+        if k == 'time' or k == 'measure_time':
+            timed = True
+    if timed:
+        return _Point(pairs)
+    return dict(pairs)
+
+
+def _columns(points):
+    """Fold a list of points into a dict of array('d') columns"""
+    cols = {}
+    n = 0
+    for point in points:
+        for k, v in point:
+            col = cols.get(k)
+            if col is None:
+                col = cols[k] = array('d', [NAN]) * n
+            col.append(NAN if v is None else v)
+        n += 1
+        if len(point) != len(cols):
+            # Heterogeneous points, pad the columns this one didn't have
+            for col in cols.values():
+                if len(col) < n:
+                    col.append(NAN)
+    return cols
+
+
+def _resolve_format(fmt):
+    if fmt is True:
+        try:
+            import numpy  # noqa
+            return 'numpy'
+        except ImportError:
+            return 'array'
+    if fmt not in FORMATS:
+        raise ValueError("Unsupported array format: %s (expected one of %s)" % (fmt, ', '.join(FORMATS)))
+    return fmt
+
+
+class ColumnarDecoder(object):
+    """Callable decoder turning a measurements response into columns.
+
+    Every list of data points in the response is replaced by a dict mapping
+    each point field (``time``, ``value``, ...) to a column. Columns are
+    ``array('d')`` for the *array* format, NumPy arrays for *numpy* and a
+    single ``pandas.DataFrame`` (one column per field) for *pandas*.
+    """
+
+    def __init__(self, fmt=True):
+        self.format = _resolve_format(fmt)
+        if self.format == 'numpy':
+            import numpy
+            self._convert = lambda cols: dict((k, numpy.frombuffer(v, dtype=numpy.float64))
+                                              for k, v in cols.items())
+        elif self.format == 'pandas':
+            import numpy
+            import pandas
+            self._convert = lambda cols: pandas.DataFrame(dict(
+                (k, numpy.frombuffer(v, dtype=numpy.float64)) for k, v in cols.items()))
+        else:
+            self._convert = lambda cols: cols
+
+    def __call__(self, text):
+        return self.columnize(json.loads(text, object_pairs_hook=_object_pairs_hook))
+
+    def columnize(self, data):
+        if isinstance(data, dict):
+            for k, v in data.items():
+                if isinstance(v, list) and v and all(isinstance(p, _Point) for p in v):
+                    data[k] = self._convert(_columns(v))
+                elif isinstance(v, (dict, list)):
+                    self.columnize(v)
+        elif isinstance(data, list):
+            for i, item in enumerate(data):
+                if isinstance(item, _Point):
+                    # A point among other objects, not a series: keep it a dict
+                    data[i] = dict(item)
+                elif isinstance(item, (dict, list)):
+                    self.columnize(item)
+        return data
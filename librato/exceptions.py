@@ -139,6 +139,16 @@ class NotFound(ClientError):
     def __init__(self, msg=None):
         ClientError.__init__(self, 404, msg)
 
+
+class InvalidMeasurement(ValueError):
+    """A measurement failed client side validation"""
+    def __init__(self, measurement, problems):
+        self.measurement = measurement
+        self.problems = problems
+        messages = ["%s: %s" % (k, ", ".join(v)) for k, v in sorted(problems.items())]
+        ValueError.__init__(self, "Invalid measurement %s: %s" % (measurement.get('name'), "; ".join(messages)))
+
+
 CODES = {
     400: BadRequest,
     401: Unauthorized,
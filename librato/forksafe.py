@@ -0,0 +1,103 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Fork awareness.
+
+Pre-fork servers often create their connection and queues before forking
+workers. Without care each child would inherit the parent's buffered
+measurements (and submit them again), its pooled sockets (shared with the
+parent, so responses get mixed up) and locks possibly held by threads that
+don't exist in the child.
+
+Connections, queues, aggregators, annotation queues, self-metrics and AIMD
+controllers register themselves here, weakly, and are told about forks
+through os.register_at_fork. What happens then depends on the object:
+
+* LibratoConnection: the child gets fresh transport pools, caches and
+  request coalescing; the parent's sockets are never used by the child.
+* Queue, Aggregator and AnnotationQueue: follow their fork_policy. With
+  'reset' (the default) the child starts empty and the parent keeps, and
+  eventually submits, what was buffered. With 'flush' the parent submits
+  its buffer right before forking. With 'keep' the child keeps a copy,
+  which is only right when the parent won't submit it.
+  Background annotation workers are started again in the child on the
+  next add().
+* SelfMetrics: the child starts from zero, and its reporting thread, if
+  it was started, comes back on the next request.
+* AIMDController: the child keeps the current chunk size and workers.
+
+On Pythons without os.register_at_fork call before_fork() and after_fork()
+yourself, e.g. from your server's pre_fork and post_fork hooks.
+"""
+import logging
+import os
+import weakref
+
+log = logging.getLogger("librato")
+
+FORK_POLICIES = ('reset', 'flush', 'keep')
+
+_registry = weakref.WeakSet()
+_installed = False
+
+
+def check_policy(policy):
+    if policy not in FORK_POLICIES:
+        raise ValueError("Unknown fork policy: %s (one of %s)" % (policy, ', '.join(FORK_POLICIES)))
+    return policy
+
+
+def register(obj):
+    """Have obj._before_fork() called in the parent before a fork and
+    obj._after_fork() in the child, for as long as obj is alive"""
+    global _installed
+    if not _installed:
+        _installed = True
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=before_fork, after_in_child=after_fork)
+    _registry.add(obj)
+    return obj
+
+
+def _call(name):
+    for obj in list(_registry):
+        # Looked up on the class: LibratoConnection answers any attribute
+        hook = getattr(type(obj), name, None)
+        if hook is None:
+            continue
+        try:
+            hook(obj)
+        except Exception:
+            log.exception("%s failed for %r", name, obj)
+
+
+def before_fork():
+    """Run in the parent right before forking"""
+    _call('_before_fork')
+
+
+def after_fork():
+    """Run in the child right after forking"""
+    _call('_after_fork')
@@ -0,0 +1,202 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""A local, searchable inventory of the account's metrics.
+
+Finding metrics by pattern with ``list_all_metrics(name=...)`` pages through
+the API every time. MetricIndex fetches the inventory once, keeps it in a
+compact form (one tuple per metric, names kept sorted for prefix lookups)
+and answers prefix, glob, regex and attribute queries in-process. It can be
+saved to and loaded from a gzipped JSON snapshot, and refreshed as a whole
+or only for the names matching a substring.
+"""
+import bisect
+import fnmatch
+import gzip
+import json
+import os
+import re
+import time
+
+from librato.metrics import Metric
+
+SNAPSHOT_VERSION = 1
+
+# What is kept of every metric, in this order
+FIELDS = ('name', 'type', 'period', 'description', 'attributes', 'composite')
+
+_WILDCARDS = re.compile(r'[*?\[]')
+
+
+class _RawMetric(object):
+    """Stand-in class making _get_paginated_results hand out the raw dicts"""
+    @staticmethod
+    def from_dict(connection, data):
+        return data
+
+
+def _record(data):
+    return tuple(data.get(field) for field in FIELDS)
+
+
+class MetricIndex(object):
+    """In-process index of metrics.
+
+    >>> index = MetricIndex.build(api)
+    >>> index.search(prefix='app.', type='counter')
+    >>> index.search(glob='*.latency.p9?', attributes={'display_units_short': 'ms'})
+    >>> index.save('metrics.json.gz')
+    """
+
+    def __init__(self, connection=None, metrics=(), built_at=None):
+        self.connection = connection
+        self.built_at = built_at
+        self._records = {}
+        self._names = []
+        self._add(_record(m) for m in metrics)
+
+    def _add(self, records):
+        for record in records:
+            self._records[record[0]] = record
+        self._names = sorted(self._records)
+
+    @classmethod
+    def build(cls, connection):
+        """Index every metric of the account"""
+        index = cls(connection)
+        index.refresh()
+        return index
+
+    def _fetch(self, **query_props):
+        return self.connection._get_paginated_results("metrics", _RawMetric, **query_props)
+
+    def refresh(self, name=None):
+        """Fetch the metrics again. With name, only those whose name
+        contains it (the API's name filter) are fetched and replaced."""
+        fetched = [_record(data) for data in (self._fetch(name=name) if name else self._fetch())]
+        if name:
+            for stale in [n for n in self._names if name in n]:
+                del self._records[stale]
+        else:
+            self._records = {}
+        self._add(fetched)
+        if not name:
+            self.built_at = time.time()
+        return self
+
+    def age(self):
+        """Seconds since the last full refresh (None if never built)"""
+        return None if self.built_at is None else time.time() - self.built_at
+
+    #
+    # Queries
+    #
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def _prefixed(self, prefix):
+        lo = bisect.bisect_left(self._names, prefix)
+        hi = lo
+        n = len(self._names)
+        while hi < n and self._names[hi].startswith(prefix):
+            hi += 1
+        return self._names[lo:hi]
+
+    def search(self, prefix=None, glob=None, regex=None, type=None, period=None, attributes=None):
+        """Names of the metrics matching all the given criteria, sorted.
+        glob uses fnmatch syntax and must match the whole name, regex is
+        searched anywhere in the name (anchor it with ^ and $ if needed) and
+        attributes maps attribute names to the values they must have."""
+        if prefix:
+            names = self._prefixed(prefix)
+        elif glob:
+            # Narrow down with the literal part before the first wildcard
+            names = self._prefixed(_WILDCARDS.split(glob, 1)[0])
+        else:
+            names = self._names
+
+        checks = []
+        if glob:
+            glob = re.compile(fnmatch.translate(glob))
+            checks.append(lambda r: glob.match(r[0]))
+        if regex:
+            regex = re.compile(regex)
+            checks.append(lambda r: regex.search(r[0]))
+        if type:
+            checks.append(lambda r: r[1] == type)
+        if period is not None:
+            checks.append(lambda r: r[2] == period)
+        if attributes:
+            wanted = list(attributes.items())
+            checks.append(lambda r: all((r[4] or {}).get(k) == v for k, v in wanted))
+
+        if not checks:
+            return list(names)
+        records = self._records
+        return [name for name in names if all(check(records[name]) for check in checks)]
+
+    def get(self, name):
+        """A (lazy) Metric for name, or None"""
+        record = self._records.get(name)
+        if record is None:
+            return None
+        return Metric.from_dict(self.connection, dict(zip(FIELDS, record)), lazy=True)
+
+    def metrics(self, **criteria):
+        """Metric objects for search(**criteria)"""
+        return [self.get(name) for name in self.search(**criteria)]
+
+    #
+    # Snapshots
+    #
+    def save(self, path):
+        """Write a gzipped JSON snapshot, replacing path atomically"""
+        snapshot = {'version': SNAPSHOT_VERSION, 'built_at': self.built_at, 'fields': FIELDS,
+                    'metrics': [self._records[name] for name in self._names]}
+        tmp = path + '.tmp'
+        with gzip.open(tmp, 'wb') as f:
+            f.write(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+        if hasattr(os, 'replace'):
+            os.replace(tmp, path)
+        else:
+            os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, connection=None):
+        """Read a snapshot written by save"""
+        with gzip.open(path, 'rb') as f:
+            snapshot = json.loads(f.read().decode('utf-8'))
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported metric index snapshot version: %s" % snapshot.get('version'))
+        fields = snapshot['fields']
+        index = cls(connection, built_at=snapshot['built_at'])
+        index._add(_record(dict(zip(fields, m))) for m in snapshot['metrics'])
+        return index
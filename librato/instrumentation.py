@@ -0,0 +1,281 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Request hooks and client self-metrics.
+
+Every call to the API goes through LibratoConnection._mexe. When hooks are
+registered on a connection a RequestInfo describing the call is handed to
+them at each stage: before_request, after_response, on_retry and on_error.
+SelfMetrics is a ready made set of hooks that keeps track of latencies and
+errors and reports them, through a Queue, as regular measurements.
+"""
+import threading
+import time
+from librato import forksafe
+
+HOOK_EVENTS = ('before_request', 'after_response', 'on_retry', 'on_error')
+
+# Upper bounds, in milliseconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def count_measurements(query_props):
+    """Number of measurements carried by a request payload"""
+    if not isinstance(query_props, dict):
+        return 0
+    n = 0
+    for key in ('measurements', 'gauges', 'counters'):
+        value = query_props.get(key)
+        if isinstance(value, (list, dict)):
+            n += len(value)
+    return n
+
+
+class RequestInfo(object):
+    """What a hook gets to know about a request.
+
+    started is the time.time() the request began at and elapsed the seconds
+    it took, retries included. status is the HTTP status of the last
+    response (None until one arrives) and error the exception that ended the
+    request, if any.
+    """
+    def __init__(self, method, path, measurements=0):
+        self.method = method
+        self.path = path
+        self.uri = None
+        self.measurements = measurements
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.status = None
+        self.retries = 0
+        self.backoff = None
+        self.error = None
+        self.started = time.time()
+        self.elapsed = None
+
+    def finish(self):
+        self.elapsed = time.time() - self.started
+        return self
+
+    def __repr__(self):
+        return "<RequestInfo %s %s status=%s retries=%d>" % (self.method, self.path, self.status, self.retries)
+
+
+class SelfMetrics(object):
+    """Collects request statistics from a connection's hooks and reports
+    them as measurements.
+
+    >>> metrics = SelfMetrics(api).install()
+    >>> metrics.start(interval=60)   # or call metrics.report() yourself
+
+    Each report adds, under prefix, the number of requests, errors and
+    retries, the bytes and measurements sent, the latency (count, sum, min and
+    max in milliseconds), a cumulative latency histogram (tagged with le) and
+    the error rate, then resets the counters.
+
+    The requests flush() makes to submit a report are not counted. A queue
+    returned by report() and submitted by the caller is, like any other.
+
+    In a forked child the counters start from zero and, if start() was
+    called in the parent, reporting resumes with the child's first request.
+    """
+    def __init__(self, connection, queue=None, prefix='librato.client', tags=None, buckets=DEFAULT_BUCKETS):
+        self.connection = connection
+        self.queue = queue
+        self.prefix = prefix
+        self.tags = dict(tags or {'client': 'python-librato'})
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._interval = None
+        self._stopped = threading.Event()
+        # Set while flush() submits, so the report doesn't count itself
+        self._local = threading.local()
+        self._reset()
+        forksafe.register(self)
+
+    def _reset(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.measurements = 0
+        self.by_status = {}
+        self.latencies = [0] * (len(self.buckets) + 1)
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+
+    def install(self):
+        self.connection.add_hook('after_response', self.after_response)
+        self.connection.add_hook('on_retry', self.on_retry)
+        self.connection.add_hook('on_error', self.on_error)
+        return self
+
+    def uninstall(self):
+        self.connection.remove_hook('after_response', self.after_response)
+        self.connection.remove_hook('on_retry', self.on_retry)
+        self.connection.remove_hook('on_error', self.on_error)
+
+    def _reporting(self):
+        return getattr(self._local, 'reporting', False)
+
+    def after_response(self, info):
+        if self._interval is not None and self._thread is None:
+            self.start(self._interval)
+        if self._reporting():
+            return
+        with self._lock:
+            self._record(info)
+
+    def on_retry(self, info):
+        if self._reporting():
+            return
+        with self._lock:
+            self.retries += 1
+
+    def on_error(self, info):
+        if self._reporting():
+            return
+        with self._lock:
+            self.errors += 1
+            self._record(info)
+
+    def _record(self, info):
+        self.requests += 1
+        self.bytes_sent += info.request_bytes
+        self.bytes_received += info.response_bytes
+        self.measurements += info.measurements
+        if info.status is not None:
+            klass = '%dxx' % (info.status // 100)
+            self.by_status[klass] = self.by_status.get(klass, 0) + 1
+        if info.elapsed is not None:
+            ms = info.elapsed * 1000.0
+            i = 0
+            while i < len(self.buckets) and ms > self.buckets[i]:
+                i += 1
+            self.latencies[i] += 1
+            self.latency_sum += ms
+            if self.latency_min is None or ms < self.latency_min:
+                self.latency_min = ms
+            if self.latency_max is None or ms > self.latency_max:
+                self.latency_max = ms
+
+    def snapshot(self, reset=False):
+        """The current counters as a dict, optionally starting over"""
+        with self._lock:
+            timed = sum(self.latencies)
+            snap = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'measurements': self.measurements,
+                'by_status': dict(self.by_status),
+                'error_rate': float(self.errors) / self.requests if self.requests else 0.0,
+                'latency': {
+                    'count': timed,
+                    'sum': self.latency_sum,
+                    'min': self.latency_min,
+                    'max': self.latency_max,
+                    'buckets': list(zip(self.buckets + (None,), self.latencies)),
+                },
+            }
+            if reset:
+                self._reset()
+        return snap
+
+    def report(self, queue=None):
+        """Add the counters to queue (or self.queue) and reset them.
+        Returns the queue, which is not submitted."""
+        q = queue or self.queue
+        if q is None:
+            q = self.queue = self.connection.new_queue()
+        snap = self.snapshot(reset=True)
+        name = self.prefix + '.%s'
+        for key in ('requests', 'errors', 'retries', 'bytes_sent', 'bytes_received', 'measurements'):
+            q.add_tagged(name % key, snap[key], tags=dict(self.tags))
+        q.add_tagged(name % 'error_rate', snap['error_rate'], tags=dict(self.tags))
+        for klass, n in sorted(snap['by_status'].items()):
+            q.add_tagged(name % 'responses', n, tags=dict(self.tags, status=klass))
+        latency = snap['latency']
+        if latency['count']:
+            q.add_tagged(name % 'latency', latency['sum'], count=latency['count'],
+                         min=latency['min'], max=latency['max'], tags=dict(self.tags))
+            cumulative = 0
+            for bound, n in latency['buckets']:
+                cumulative += n
+                le = '+Inf' if bound is None else str(bound)
+                q.add_tagged(name % 'latency.bucket', cumulative, tags=dict(self.tags, le=le))
+        return q
+
+    def _after_fork(self):
+        # The reporting thread didn't survive the fork, after_response
+        # starts a new one
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._local = threading.local()
+        self._thread = None
+        self._reset()
+
+    def flush(self):
+        """Report and submit in one go"""
+        q = self.report()
+        self._local.reporting = True
+        try:
+            q.submit()
+        finally:
+            self._local.reporting = False
+
+    def start(self, interval=60):
+        """Report and submit every interval seconds from a daemon thread"""
+        if self._thread is not None:
+            return self
+        self._interval = interval
+        self._stopped.clear()
+
+        def loop():
+            while not self._stopped.wait(interval):
+                try:
+                    self.flush()
+                except Exception:
+                    # Self-metrics must never take the application down, the
+                    # failed submission shows up in the next report anyway.
+                    pass
+        self._thread = threading.Thread(target=loop, name='librato-self-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, flush=True):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self._interval = None
+        if flush:
+            self.flush()
@@ -27,6 +27,15 @@
 class Metric(object):
     """Librato Metric Base class"""
 
+    __slots__ = ('connection', 'name', 'attributes', 'period', 'description',
+                 'measurements', 'query', 'composite', 'source_lag')
+
+    # Defaults of the fields a lazy metric's response left out, only
+    # created when first read
+    _LAZY_DEFAULTS = {'attributes': dict, 'measurements': dict, 'query': dict,
+                      'period': lambda: None, 'description': lambda: None,
+                      'composite': lambda: None, 'source_lag': lambda: None}
+
     def __init__(self, connection, name, attributes=None, period=None, description=None):
         self.connection = connection
         self.name = name
@@ -36,17 +45,41 @@ class Metric(object):
         self.measurements = {}
         self.query = {}
         self.composite = None
+        self.source_lag = None
 
     def __getitem__(self, name):
         return self.attributes[name]
 
+    def __getattr__(self, attr):
+        # Only reached for slots that are not set, i.e. those a lazy
+        # metric's response didn't have
+        default = Metric._LAZY_DEFAULTS.get(attr)
+        if default is not None:
+            value = default()
+            setattr(self, attr, value)
+            return value
+        raise AttributeError("%r object has no attribute %r" % (self.__class__.__name__, attr))
+
     def get(self, name, default=None):
         return self.attributes.get(name, default)
 
+    def _hydrate(self, data):
+        self.period = data['period']
+        self.attributes = data['attributes']
+        self.description = data['description'] if 'description' in data else None
+        self.measurements = data['measurements'] if 'measurements' in data else {}
+        self.query = data['query'] if 'query' in data else {}
+        self.composite = data.get('composite', None)
+        self.source_lag = data.get('source_lag', None)
+
     @classmethod
-    def from_dict(cls, connection, data):
+    def from_dict(cls, connection, data, lazy=False):
         """Returns a metric object from a dictionary item,
-        which is usually from librato's API"""
+        which is usually from librato's API.
+        A lazy metric only takes the fields data has, not data itself, and
+        creates the defaults of the missing ones (empty measurements and
+        query...) when they are first read. It is quicker to build and
+        lighter while those defaults go unused."""
         metric_type = data.get('type')
         if metric_type == "gauge":
             cls = Gauge
@@ -56,14 +89,16 @@ class Metric(object):
             # Since we don't have a formal Composite class, use Gauge for now
             cls = Gauge
 
-        obj = cls(connection, data['name'])
-        obj.period = data['period']
-        obj.attributes = data['attributes']
-        obj.description = data['description'] if 'description' in data else None
-        obj.measurements = data['measurements'] if 'measurements' in data else {}
-        obj.query = data['query'] if 'query' in data else {}
-        obj.composite = data.get('composite', None)
-        obj.source_lag = data.get('source_lag', None)
+        if lazy:
+            obj = cls.__new__(cls)
+            obj.connection = connection
+            obj.name = data['name']
+            for field in Metric._LAZY_DEFAULTS:
+                if field in data:
+                    setattr(obj, field, data[field])
+        else:
+            obj = cls(connection, data['name'])
+            obj._hydrate(data)
 
         return obj
 
@@ -73,6 +108,8 @@ class Metric(object):
 
 class Gauge(Metric):
     """Librato Gauge metric"""
+    __slots__ = ()
+
     def add(self, value, source=None, **params):
         """Add a new measurement to this gauge"""
         if source:
@@ -85,6 +122,8 @@ class Gauge(Metric):
 
 class Counter(Metric):
     """Librato Counter metric"""
+    __slots__ = ()
+
     def add(self, value, source=None, **params):
         if source:
             params['source'] = source
@@ -23,6 +23,158 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import json
+import logging
+from collections import namedtuple
+from librato import forksafe
+from librato.adaptive import AIMDController
+from librato.exceptions import BadRequest
+from librato.workers import imap_bounded
+
+log = logging.getLogger("librato")
+
+# How repeated measurements of a series are folded together, see Queue
+COALESCE_POLICIES = ('last', 'sum', 'merge')
+
+
+def _stats(m):
+    """(count, sum, min, max) of a simple or summarized measurement,
+    min and max being None when unknown"""
+    if m.get('value') is not None:
+        v = m['value']
+        return 1, v, v, v
+    count = m.get('count', 1)
+    total = m.get('sum', 0)
+    if count == 1:
+        return 1, total, m.get('min', total), m.get('max', total)
+    return count, total, m.get('min'), m.get('max')
+
+
+def _coalesce(policy, current, new, tagged):
+    """Fold the new measurement into current, in place"""
+    if policy == 'last':
+        current.clear()
+        current.update(new)
+        return
+    count, total, lo, hi = _stats(current)
+    new_count, new_total, new_lo, new_hi = _stats(new)
+    if policy == 'sum':
+        for k in ('value', 'count', 'sum', 'min', 'max'):
+            current.pop(k, None)
+        if tagged:
+            current['sum'] = total + new_total
+            current['count'] = 1
+        else:
+            current['value'] = total + new_total
+    else:  # merge
+        current.pop('value', None)
+        current['count'] = count + new_count
+        current['sum'] = total + new_total
+        for k, a, b, pick in (('min', lo, new_lo, min), ('max', hi, new_hi, max)):
+            if a is None or b is None:
+                current.pop(k, None)
+            else:
+                current[k] = pick(a, b)
+
+
+# Allowance for a field besides its strings: key, number (the longest repr
+# of a float) and punctuation
+_FIELD_BYTES = 48
+
+
+def _estimated_size(nm):
+    """Serialized size of a measurement in a request body, separator included.
+    Cheap rather than exact, an upper bound for ASCII names and tags (other
+    characters are escaped): the name, source and tags are counted, any
+    other field at _FIELD_BYTES"""
+    size = 4 + _FIELD_BYTES * len(nm) + len(nm['name'])
+    if 'source' in nm:
+        size += len(str(nm['source']))
+    tags = nm.get('tags')
+    if tags:
+        try:
+            size += sum(len(k) + len(v) + 8 for k, v in tags.items())
+        except TypeError:
+            size += len(json.dumps(tags, default=repr))
+    if 'attributes' in nm:
+        size += len(json.dumps(nm['attributes'], default=repr))
+    return size
+
+
+def _chunk_size(chunk):
+    empty = dict((key, []) for key in chunk)
+    return len(json.dumps(empty)) + sum(_estimated_size(nm) for _, nm in _chunk_items(chunk))
+
+
+def _chunk_items(chunk):
+    """The (type, measurement) pairs of a chunk, type being None for tagged
+    measurements"""
+    if 'measurements' in chunk:
+        return [(None, nm) for nm in chunk['measurements']]
+    return [(type, nm) for type in ('gauge', 'counter') for nm in chunk[type + 's']]
+
+
+def _build_chunk(items):
+    """The chunk posting items, and for each item the key the API uses for it
+    in a 400 error payload"""
+    if items and items[0][0] is None:
+        return {'measurements': [nm for _, nm in items]}, [str(i) for i in range(len(items))]
+    chunk = {'gauges': [], 'counters': []}
+    keys = []
+    for type, nm in items:
+        measurements = chunk[type + 's']
+        keys.append('%ss[%d]' % (type, len(measurements)))
+        measurements.append(nm)
+    return chunk, keys
+
+
+def _discard(items, done):
+    """Remove the done (type, measurement) pairs from items, in place"""
+    done = set(id(nm) for _, nm in done)
+    items[:] = [item for item in items if id(item[1]) not in done]
+
+
+def _rejected_params(error_payload):
+    """Per measurement problems named by a 400 error payload, by key"""
+    try:
+        params = error_payload['errors']['params']
+    except (KeyError, TypeError):
+        return {}
+    if not isinstance(params, dict):
+        return {}
+    problems = dict(params)
+    if isinstance(params.get('measurements'), dict):
+        problems.update(params['measurements'])
+    return problems
+
+
+class Rejected(namedtuple('Rejected', 'type measurement errors')):
+    """A measurement the API refused, with the errors it gave. type is
+    'gauge' or 'counter' for legacy measurements and None for tagged ones."""
+    __slots__ = ()
+
+
+class SubmitReport(object):
+    """Outcome of a resilient submit: how many measurements were accepted,
+    how many requests it took and the measurements rejected"""
+    def __init__(self):
+        self.sent = 0
+        self.requests = 0
+        self.rejected = []
+
+    @property
+    def ok(self):
+        return not self.rejected
+
+    def merge(self, other):
+        self.sent += other.sent
+        self.requests += other.requests
+        self.rejected.extend(other.rejected)
+        return self
+
+    def __repr__(self):
+        return "<SubmitReport sent=%d rejected=%d requests=%d>" % (self.sent, len(self.rejected), self.requests)
+
 
 class Queue(object):
     """Sending small amounts of measurements in a single HTTP request
@@ -40,15 +192,67 @@ class Queue(object):
 
     When the user sends a .submit() we iterate over the list of chunks and
     send one at a time.
+
+    A chunk is closed when it holds MAX_MEASUREMENTS_PER_CHUNK measurements
+    or when the next measurement would take its serialized size past
+    max_chunk_bytes. The size of every measurement is estimated once, as it
+    is added, so large tag sets never produce an oversized request.
+
+    With adaptive set to an AIMDController (or True for a default one),
+    submit() instead re-slices the queued measurements into chunks of the
+    controller's current size and posts them over as many threads as it
+    allows. Measurements of failed requests stay queued and the first error
+    is raised once every chunk has been tried.
+
+    With resilient=True a chunk rejected with 400 is not given up on: the
+    measurements named in the error payload (or, when it names none, found
+    by splitting the chunk in halves) are set aside and the rest is posted
+    again, so one bad measurement costs O(log n) extra requests. submit()
+    then goes on with the remaining chunks and returns a SubmitReport
+    listing the rejected measurements.
+
+    Measurements are checked, as they are added, by validator (a
+    librato.validation.MeasurementValidator) or else by the connection's,
+    see LibratoConnection.enable_validation.
+
+    fork_policy says what a forked child does with the measurements queued
+    in its parent, see librato.forksafe: 'reset' (forget them), 'flush' (the
+    parent submits them before forking) or 'keep'.
+
+    With a coalesce policy, measurements of a series already in the queue
+    (same name and source or tags, same time) are folded into the queued one
+    instead of being added: 'last' keeps the latest value, 'sum' adds the
+    values up and 'merge' keeps count, sum, min and max. Legacy counters
+    always keep their last value.
     """
     MAX_MEASUREMENTS_PER_CHUNK = 300  # based docs; on POST /metrics
+    MAX_BYTES_PER_CHUNK = 256 * 1024
 
-    def __init__(self, connection, auto_submit_count=None, tags={}):
+    def __init__(self, connection, auto_submit_count=None, tags={}, coalesce=None, max_chunk_bytes=None,
+                 adaptive=None, resilient=False, validator=None, fork_policy='reset'):
+        if coalesce is not None and coalesce not in COALESCE_POLICIES:
+            raise ValueError("Unknown coalesce policy: %s (one of %s)" % (coalesce, ', '.join(COALESCE_POLICIES)))
         self.connection = connection
         self.tags = dict(tags)
         self.chunks = []
         self.tagged_chunks = []
         self.auto_submit_count = auto_submit_count
+        self.coalesce = coalesce
+        self.max_chunk_bytes = max_chunk_bytes or self.MAX_BYTES_PER_CHUNK
+        if adaptive is True:
+            adaptive = AIMDController(max_chunk=self.MAX_MEASUREMENTS_PER_CHUNK)
+        self.adaptive = adaptive or None
+        self.resilient = resilient
+        self.validator = validator
+        self.fork_policy = forksafe.check_policy(fork_policy)
+        # Estimated serialized size of each chunk, parallel to the chunk lists
+        self._chunk_bytes = []
+        self._tagged_chunk_bytes = []
+        self._num_measurements = 0
+        # Queued measurements by series, when coalescing: (measurement, chunk index)
+        self._series = {}
+        self._tagged_series = {}
+        forksafe.register(self)
 
     # Get a shallow copy of the top-level tag set
     def get_tags(self):
@@ -74,7 +278,9 @@ class Queue(object):
             for pn, v in query_props.items():
                 nm[pn] = v
 
-            self._add_measurement(type, nm)
+            nm = self._validated(nm)
+            if nm is not None:
+                self._add_measurement(type, nm)
             self._auto_submit_if_necessary()
 
     def add_tagged(self, name, value, **query_props):
@@ -93,7 +299,9 @@ class Queue(object):
         for pn, v in query_props.items():
             nm[pn] = v
 
-        self._add_tagged_measurement(nm)
+        nm = self._validated(nm)
+        if nm is not None:
+            self._add_tagged_measurement(nm)
         self._auto_submit_if_necessary()
 
     def add_aggregator(self, aggregator):
@@ -112,7 +320,9 @@ class Queue(object):
             # Set source
             if aggregator.source:
                 nm['source'] = aggregator.source
-            self._add_measurement('gauge', nm)
+            nm = self._validated(nm)
+            if nm is not None:
+                self._add_measurement('gauge', nm)
 
         tagged_measurements = dict(aggregator.tagged_measurements)
         for name in tagged_measurements:
@@ -127,7 +337,9 @@ class Queue(object):
                     nm['tags'] = {}
                 nm['tags'].update(aggregator.tags)
 
-            self._add_tagged_measurement(nm)
+            nm = self._validated(nm)
+            if nm is not None:
+                self._add_tagged_measurement(nm)
 
         # Clear measurements from aggregator
         aggregator.clear()
@@ -135,13 +347,41 @@ class Queue(object):
         self._auto_submit_if_necessary()
 
     def submit(self):
+        if self.adaptive:
+            return self._submit_adaptive()
+        if self.resilient:
+            return self._submit_resilient()
         for c in self.chunks:
             self.connection._mexe("metrics", method="POST", query_props=c)
+        # Sent, whatever happens to the tagged ones
+        self._num_measurements -= sum(len(c['gauges']) + len(c['counters']) for c in self.chunks)
         self.chunks = []
+        self._chunk_bytes = []
+        self._series = {}
 
         for chunk in self.tagged_chunks:
             self.connection._mexe("measurements", method="POST", query_props=chunk)
+        self._clear()
+
+    def _clear(self):
+        self.chunks = []
         self.tagged_chunks = []
+        self._chunk_bytes = []
+        self._tagged_chunk_bytes = []
+        self._num_measurements = 0
+        self._series = {}
+        self._tagged_series = {}
+
+    def _before_fork(self):
+        if self.fork_policy == 'flush' and self._num_measurements:
+            try:
+                self.submit()
+            except Exception:
+                log.exception("Could not submit the queue before forking")
+
+    def _after_fork(self):
+        if self.fork_policy != 'keep':
+            self._clear()
 
     def __enter__(self):
         return self
@@ -151,20 +391,217 @@ class Queue(object):
 
     # Private, sort of.
     #
+    def _submit_resilient(self):
+        report = SubmitReport()
+        # Chunks are dropped as they are posted, queued series would point to the wrong ones
+        self._series = {}
+        self._tagged_series = {}
+        for path, chunks, sizes in (("metrics", self.chunks, self._chunk_bytes),
+                                    ("measurements", self.tagged_chunks, self._tagged_chunk_bytes)):
+            while chunks:
+                items = _chunk_items(chunks[0])
+                queued = len(items)
+                try:
+                    report.merge(self._post_isolating(path, items))
+                finally:
+                    self._num_measurements -= queued - len(items)
+                    if items:
+                        # Interrupted, keep what was not accepted for the next submit
+                        chunks[0] = _build_chunk(items)[0]
+                        sizes[0] = _chunk_size(chunks[0])
+                chunks.pop(0)
+                sizes.pop(0)
+        return report
+
+    def _post_isolating(self, path, queued):
+        """Post the queued items, setting aside the measurements rejected
+        with 400. Items are removed from queued once accepted or rejected,
+        so that after an error it holds those still to be sent.
+
+        Offenders the error payload names are set aside at once, the others
+        are found by splitting the items in halves. When both halves of the
+        first split fail like the whole, the error is taken to be about the
+        request and every item is rejected. Splitting stops after about
+        2 * log2(n) requests, rejecting what is left with the last error."""
+        report = SubmitReport()
+        budget = 2 * len(queued).bit_length() + 4
+        probed = False
+        # (items, the 400 they got if already posted, the 400 of the request they come from)
+        pending = [(list(queued), None, None)]
+        while pending:
+            items, error, cause = pending.pop()
+            if error is None:
+                if report.requests >= budget:
+                    self._reject(report, queued, items, cause)
+                    continue
+                error, keys = self._post_items(path, items, queued, report)
+                if error is None:
+                    continue
+            else:
+                keys = _build_chunk(items)[1]
+            problems = _rejected_params(error.error_payload)
+            named = [i for i, key in enumerate(keys) if key in problems]
+            if named:
+                for i in named:
+                    report.rejected.append(Rejected(items[i][0], items[i][1], problems[keys[i]]))
+                _discard(queued, [items[i] for i in named])
+                rest = [item for i, item in enumerate(items) if keys[i] not in problems]
+                if rest:
+                    pending.append((rest, None, error.error_payload))
+            elif len(items) == 1:
+                self._reject(report, queued, items, error.error_payload)
+            else:
+                middle = len(items) // 2
+                halves = [items[:middle], items[middle:]]
+                if probed:
+                    pending.extend((half, None, error.error_payload) for half in reversed(halves))
+                    continue
+                probed = True
+                outcomes = [self._post_items(path, half, queued, report) for half in halves]
+                if all(e is not None and e.error_payload == error.error_payload for e, _ in outcomes):
+                    self._reject(report, queued, items, error.error_payload)
+                    continue
+                for half, (e, _) in reversed(list(zip(halves, outcomes))):
+                    if e is not None:
+                        pending.append((half, e, error.error_payload))
+        return report
+
+    def _post_items(self, path, items, queued, report):
+        """Post items once: (None, keys) if accepted, (the BadRequest, keys)
+        if not. Accepted items are counted and removed from queued."""
+        chunk, keys = _build_chunk(items)
+        report.requests += 1
+        try:
+            self.connection._mexe(path, method="POST", query_props=chunk)
+        except BadRequest as e:
+            return e, keys
+        report.sent += len(items)
+        _discard(queued, items)
+        return None, keys
+
+    def _reject(self, report, queued, items, errors):
+        report.rejected.extend(Rejected(type, nm, errors) for type, nm in items)
+        _discard(queued, items)
+
+    def _submit_adaptive(self):
+        controller = self.adaptive.install(self.connection)
+        queued = [item for c in self.chunks for item in _chunk_items(c)]
+        queued += [item for c in self.tagged_chunks for item in _chunk_items(c)]
+        self._clear()
+
+        def post(request):
+            path, chunk, items = request
+            if self.resilient:
+                return self._post_isolating(path, items)
+            return self.connection._mexe(path, method="POST", query_props=chunk)
+
+        report = SubmitReport()
+        errors = []
+        # Measurements sent (or rejected, when isolating), by id
+        done = set()
+        try:
+            results = imap_bounded(post, self._adaptive_requests(queued, controller),
+                                   max_workers=lambda: controller.workers, ordered=False)
+            for (path, chunk, items), result, error in results:
+                if self.resilient:
+                    # items only holds what was neither accepted nor rejected
+                    left = set(id(nm) for _, nm in items)
+                    done.update(id(nm) for _, nm in _chunk_items(chunk) if id(nm) not in left)
+                elif error is None:
+                    done.update(id(nm) for _, nm in _chunk_items(chunk))
+                if error is not None:
+                    errors.append(error)
+                elif self.resilient:
+                    report.merge(result)
+        finally:
+            # Keep whatever was not sent for the next submit, even when interrupted
+            for type, nm in queued:
+                if id(nm) in done:
+                    continue
+                if type is None:
+                    self._add_tagged_measurement(nm)
+                else:
+                    self._add_measurement(type, nm)
+        if errors:
+            raise errors[0]
+        if self.resilient:
+            return report
+
+    def _adaptive_requests(self, queued, controller):
+        """(path, chunk, items) for every request, sized by controller at the
+        time each one is about to be sent"""
+        for tagged in (False, True):
+            items = [(type, nm) for type, nm in queued if (type is None) == tagged]
+            i = 0
+            while i < len(items):
+                limit = controller.chunk_size
+                chunk = {'measurements': []} if tagged else {'gauges': [], 'counters': []}
+                size = len(json.dumps(chunk))
+                start = i
+                while i < len(items) and i - start < limit:
+                    type, nm = items[i]
+                    nm_size = _estimated_size(nm)
+                    if i > start and size + nm_size > self.max_chunk_bytes:
+                        break
+                    size += nm_size
+                    chunk['measurements' if tagged else type + 's'].append(nm)
+                    i += 1
+                yield ('measurements' if tagged else 'metrics'), chunk, items[start:i]
+
+    def _validated(self, nm):
+        validator = self.validator or getattr(self.connection, 'measurement_validator', None)
+        if validator is None:
+            return nm
+        return validator.validate(nm)
+
     def _auto_submit_if_necessary(self):
         if self.auto_submit_count and self._num_measurements_in_queue() >= self.auto_submit_count:
             self.submit()
 
+    def _coalesced(self, key, nm, policy, tagged):
+        """Fold nm into the queued measurement of its series, if any"""
+        series = self._tagged_series if tagged else self._series
+        if key not in series:
+            return False
+        current, index = series[key]
+        before = _estimated_size(current)
+        _coalesce(policy, current, nm, tagged)
+        sizes = self._tagged_chunk_bytes if tagged else self._chunk_bytes
+        sizes[index] += _estimated_size(current) - before
+        return True
+
+    def _append(self, chunks, sizes, new_chunk, nm, tagged):
+        """Append nm to the current chunk, opening a new one when full.
+        Returns the index of the chunk"""
+        size = _estimated_size(nm)
+        if (not chunks or
+           self._num_measurements_in_current_chunk(tagged) == self.MAX_MEASUREMENTS_PER_CHUNK or
+           sizes[-1] + size > self.max_chunk_bytes):
+            chunks.append(new_chunk)
+            sizes.append(len(json.dumps(new_chunk)))
+        sizes[-1] += size
+        self._num_measurements += 1
+        return len(chunks) - 1
+
     def _add_measurement(self, type, nm):
-        if not self.chunks or self._num_measurements_in_current_chunk() == self.MAX_MEASUREMENTS_PER_CHUNK:
-            self.chunks.append({'gauges': [], 'counters': []})
-        self.chunks[-1][type + 's'].append(nm)
+        if self.coalesce:
+            key = (type, nm['name'], nm.get('source'), nm.get('measure_time'))
+            if self._coalesced(key, nm, 'last' if type == 'counter' else self.coalesce, False):
+                return
+        index = self._append(self.chunks, self._chunk_bytes, {'gauges': [], 'counters': []}, nm, False)
+        self.chunks[index][type + 's'].append(nm)
+        if self.coalesce:
+            self._series[key] = (nm, index)
 
     def _add_tagged_measurement(self, nm):
-        if (not self.tagged_chunks or
-           self._num_measurements_in_current_chunk(tagged=True) == self.MAX_MEASUREMENTS_PER_CHUNK):
-            self.tagged_chunks.append({'measurements': []})
-        self.tagged_chunks[-1]['measurements'].append(nm)
+        if self.coalesce:
+            key = (nm['name'], tuple(sorted(nm.get('tags', {}).items())), nm.get('time'))
+            if self._coalesced(key, nm, self.coalesce, True):
+                return
+        index = self._append(self.tagged_chunks, self._tagged_chunk_bytes, {'measurements': []}, nm, True)
+        self.tagged_chunks[index]['measurements'].append(nm)
+        if self.coalesce:
+            self._tagged_series[key] = (nm, index)
 
     def _current_chunk(self, tagged=False):
         if tagged:
@@ -186,10 +623,8 @@ class Queue(object):
                 return 0
 
     def _num_measurements_in_queue(self):
-        num = 0
-        if self.chunks:
-            num += self._num_measurements_in_current_chunk() + self.MAX_MEASUREMENTS_PER_CHUNK * (len(self.chunks) - 1)
-        if self.tagged_chunks:
-            num += (self._num_measurements_in_current_chunk(tagged=True) +
-                    self.MAX_MEASUREMENTS_PER_CHUNK * (len(self.tagged_chunks) - 1))
-        return num
+        return self._num_measurements
+
+    def _num_bytes_in_queue(self):
+        """Estimated size of all the queued request bodies"""
+        return sum(self._chunk_bytes) + sum(self._tagged_chunk_bytes)
@@ -126,6 +126,9 @@ class Chart(object):
     #   "label": "The y axis label",
     #   "use_log_yaxis": true
     # }
+    __slots__ = ('connection', 'name', 'id', 'type', 'space_id', '_space', 'streams', 'label',
+                 'min', 'max', 'use_log_yaxis', 'use_last_value', 'related_space')
+
     def __init__(self, connection, name=None, id=None, type='line',
                  space_id=None, streams=[],
                  min=None, max=None,
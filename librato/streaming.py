@@ -0,0 +1,248 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Incremental decoding of list responses and encoding of request bodies.
+
+Reading a whole page with ``resp.read()`` keeps the raw bytes, the decoded
+text and the parsed objects alive at the same time. For the list endpoints
+(``{"query": {...}, "metrics": [...]}``) the decoder below reads the
+response a chunk at a time and hands out the items of the list as soon as
+each one is complete, so only a chunk of text and the item being built are
+held on top of what the caller keeps.
+
+The other way round, StreamedBody encodes a payload a block at a time as
+it is sent, rather than building the whole JSON document first.
+"""
+import codecs
+import json
+import six
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+_BLANKS = ' \t\n\r'
+
+
+class StreamedList(object):
+    """Iterator over the items of the top-level list named key in a JSON
+    object read incrementally from resp.
+
+    The other top-level members are stored in meta as they are parsed; it
+    is complete once the iteration is over. on_close, if set, is called
+    once the response has been read to the end or the iteration abandoned.
+    """
+
+    def __init__(self, resp, key, charset='utf-8', chunk_size=DEFAULT_CHUNK_SIZE):
+        self.key = key
+        self.meta = {}
+        self.bytes_read = 0
+        self.on_close = None
+        self._resp = resp
+        self._chunk_size = chunk_size
+        self._text = codecs.getincrementaldecoder(charset)()
+        self._decoder = json.JSONDecoder()
+        self._buf = u''
+        self._pos = 0
+        self._eof = False
+        self._closed = False
+        self._items = self._parse()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._items)
+
+    next = __next__  # py2
+
+    def close(self):
+        self._items.close()
+        self._finish()
+
+    def _finish(self):
+        if not self._closed:
+            self._closed = True
+            if self.on_close is not None:
+                self.on_close()
+
+    def _fill(self):
+        """Read one more chunk, returns False at the end of the response"""
+        if self._eof:
+            return False
+        chunk = self._resp.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            self._buf += self._text.decode(b'', True)
+            return False
+        self.bytes_read += len(chunk)
+        if isinstance(chunk, bytes):
+            chunk = self._text.decode(chunk)
+        # Drop what was consumed already, the buffer stays about a chunk long
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """The next non blank character, left unconsumed"""
+        while True:
+            buf = self._buf
+            pos = self._pos
+            n = len(buf)
+            while pos < n and buf[pos] in _BLANKS:
+                pos += 1
+            self._pos = pos
+            if pos < n:
+                return buf[pos]
+            if not self._fill():
+                raise ValueError("Truncated JSON document")
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise ValueError("Expected %s, got %r" % (' or '.join(repr(x) for x in chars), c))
+        self._pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            # A number ending the buffer may carry on in the next chunk
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _parse(self):
+        try:
+            self._expect('{')
+            if self._peek() == '}':
+                self._pos += 1
+            else:
+                while True:
+                    name = self._value()
+                    self._expect(':')
+                    if name == self.key and self._peek() == '[':
+                        self._pos += 1
+                        if self._peek() == ']':
+                            self._pos += 1
+                        else:
+                            while True:
+                                yield self._value()
+                                if self._expect(',]') == ']':
+                                    break
+                    else:
+                        self.meta[name] = self._value()
+                    if self._expect(',}') == '}':
+                        break
+            # Read to the end so the connection is left in a clean state
+            while self._fill():
+                pass
+        finally:
+            self._finish()
+
+
+class StreamingDecoder(object):
+    """Decoder for LibratoConnection._mexe streaming the list named key.
+
+    Successful JSON responses come back as a StreamedList instead of being
+    parsed in one go; anything else (error payloads in particular) is
+    decoded with json.loads as usual.
+    """
+    streaming = True
+
+    def __init__(self, key, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.key = key
+        self.chunk_size = chunk_size
+
+    def stream(self, resp, charset='utf-8'):
+        return StreamedList(resp, self.key, charset, self.chunk_size)
+
+    def __call__(self, text):
+        return json.loads(text)
+
+
+def _fragments(payload):
+    """The JSON text of payload, in pieces: the items of its top-level
+    lists are encoded one at a time (the C encoder only does whole
+    documents, json.JSONEncoder.iterencode is much slower)"""
+    if not isinstance(payload, dict):
+        yield json.dumps(payload)
+        return
+    yield '{'
+    for i, (key, value) in enumerate(payload.items()):
+        if i:
+            yield ', '
+        if not isinstance(value, list) or not isinstance(key, six.string_types):
+            yield json.dumps({key: value})[1:-1]
+            continue
+        yield json.dumps(key) + ': ['
+        for j, item in enumerate(value):
+            yield ', ' + json.dumps(item) if j else json.dumps(item)
+        yield ']'
+    yield '}'
+
+
+class StreamedBody(object):
+    """The JSON encoding of payload, generated as it is iterated over in
+    blocks of about block_size bytes. The text is the same as
+    json.dumps(payload).
+
+    Unless chunked, length is worked out up front (encoding the payload
+    once more, without keeping it) so it can be sent as Content-Length;
+    otherwise the body goes out with Transfer-Encoding: chunked. Each
+    iteration encodes the payload again, retries included.
+    """
+
+    def __init__(self, payload, chunked=True, block_size=DEFAULT_BLOCK_SIZE):
+        self.payload = payload
+        self.chunked = chunked
+        self.block_size = block_size
+        self.bytes_sent = 0
+        self.length = None
+        if not chunked:
+            # json.dumps escapes non-ASCII characters, one byte per character
+            self.length = sum(len(fragment) for fragment in _fragments(payload))
+
+    def __iter__(self):
+        self.bytes_sent = 0
+        parts = []
+        size = 0
+        for fragment in _fragments(self.payload):
+            parts.append(fragment)
+            size += len(fragment)
+            if size >= self.block_size:
+                self.bytes_sent += size
+                yield ''.join(parts).encode('ascii')
+                parts = []
+                size = 0
+        if parts:
+            self.bytes_sent += size
+            yield ''.join(parts).encode('ascii')
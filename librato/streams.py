@@ -1,4 +1,9 @@
 class Stream(object):
+    __slots__ = ('metric', 'source', 'composite', 'name', 'type', 'id',
+                 'group_function', 'summary_function', 'transform_function', 'downsample_function',
+                 'period', 'split_axis', 'min', 'max', 'units_short', 'units_long',
+                 'color', 'gap_detection', 'position', '_extras')
+
     def __init__(self, metric=None, source='*', composite=None,
                  name=None, type=None, id=None,
                  group_function=None, summary_function=None,
@@ -35,13 +40,27 @@ class Stream(object):
         self.position = position
 
         # Pick up any attributes that are not explicitly defined
-        for attr in kwargs:
-            setattr(self, attr, kwargs[attr])
+        self._extras = kwargs
 
         # Can't have a composite and source
         if self.composite:
             self.source = None
 
+    def __getattr__(self, attr):
+        # Only reached for attributes that are not slots
+        if attr == '_extras':
+            raise AttributeError(attr)
+        try:
+            return self._extras[attr]
+        except KeyError:
+            raise AttributeError("'Stream' object has no attribute %r" % attr)
+
+    def __setattr__(self, attr, value):
+        try:
+            object.__setattr__(self, attr, value)
+        except AttributeError:
+            self._extras[attr] = value
+
     def _attrs(self):
         return ['metric', 'source', 'composite', 'name',
                 'type', 'id', 'group_function', 'summary_function', 'transform_function', 'downsample_function',
@@ -0,0 +1,380 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Bulk synchronization of Librato entities against a desired state.
+
+Rather than looking entities up and updating them one call at a time, the
+current state is fetched once, diffed against what we want, and only the
+needed creates/updates/deletes are issued, a few at a time.
+"""
+from librato.alerts import Alert
+from librato.spaces import Chart
+from librato.workers import imap_bounded, DEFAULT_MAX_WORKERS
+
+
+class Action(object):
+    """A single create/update/delete needed to reach the desired state"""
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    SYMBOLS = {CREATE: '+', UPDATE: '~', DELETE: '-'}
+
+    def __init__(self, op, kind, name, desired=None, current=None, apply=None,
+                 stage=0, depends_on=None):
+        self.op = op
+        self.kind = kind
+        self.name = name
+        self.desired = desired
+        self.current = current
+        self._apply = apply
+        # Actions run stage by stage, e.g. spaces before their charts
+        self.stage = stage
+        self.depends_on = depends_on
+        self.applied = False
+        self.result = None
+        self.error = None
+
+    def apply(self):
+        if self.depends_on is not None and not self.depends_on.applied:
+            raise Exception("Can't %s: '%s' failed" % (self, self.depends_on))
+        self.result = self._apply(self)
+        self.applied = True
+        return self.result
+
+    def __str__(self):
+        return "%s %s %s" % (self.SYMBOLS[self.op], self.kind, self.name)
+
+    def __repr__(self):
+        return "%s<%s>" % (self.__class__.__name__, self)
+
+
+class Plan(object):
+    """An ordered list of actions, printable as a dry-run summary"""
+
+    def __init__(self, actions=None):
+        self.actions = list(actions or [])
+        self.unchanged = []
+
+    def add(self, action):
+        self.actions.append(action)
+        return action
+
+    def _by_op(self, op):
+        return [a for a in self.actions if a.op == op]
+
+    @property
+    def creates(self):
+        return self._by_op(Action.CREATE)
+
+    @property
+    def updates(self):
+        return self._by_op(Action.UPDATE)
+
+    @property
+    def deletes(self):
+        return self._by_op(Action.DELETE)
+
+    @property
+    def failed(self):
+        return [a for a in self.actions if a.error is not None]
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def summary(self):
+        return "%d to create, %d to update, %d to delete, %d unchanged" % (
+            len(self.creates), len(self.updates), len(self.deletes), len(self.unchanged))
+
+    def __str__(self):
+        return "\n".join([str(a) for a in self.actions] + [self.summary()])
+
+    def apply(self, max_workers=DEFAULT_MAX_WORKERS):
+        """Run the actions, at most max_workers at a time. Failures don't stop
+        the other actions, they are recorded on each action (see failed).
+        """
+        for stage in sorted(set(a.stage for a in self.actions)):
+            pending = [a for a in self.actions if a.stage == stage and not a.applied]
+            for action, _, error in imap_bounded(lambda a: a.apply(), pending, max_workers):
+                action.error = error
+        return self
+
+
+class AlertSet(object):
+    """All the alerts of an account indexed by name, fetched with a single
+    (paginated) listing.
+
+    >>> alerts = AlertSet.fetch(conn)
+    >>> plan = alerts.diff([Alert(conn, 'cpu.high', conditions=...)])
+    >>> print(plan)
+    >>> plan.apply()
+    """
+
+    def __init__(self, connection, alerts):
+        self.connection = connection
+        self.alerts = {}
+        for alert in alerts:
+            self.alerts[alert.name] = alert
+
+    @classmethod
+    def fetch(cls, connection):
+        return cls(connection, connection.list_alerts())
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def __contains__(self, name):
+        return name in self.alerts
+
+    def __getitem__(self, name):
+        return self.alerts[name]
+
+    def diff(self, desired, delete_missing=False):
+        """Plan the changes needed to make the account match desired, an
+        iterable of Alert objects (or dicts of Alert constructor arguments).
+        Alerts are only compared on the fields desired sets (not None), so
+        the defaults the server fills in don't cause updates. Alerts that
+        aren't desired are only deleted if delete_missing is set.
+        """
+        plan = Plan()
+        wanted = set()
+        for alert in desired:
+            if isinstance(alert, dict):
+                alert = Alert(self.connection, **alert)
+            wanted.add(alert.name)
+            current = self.alerts.get(alert.name)
+            if current is None:
+                plan.add(Action(Action.CREATE, 'alert', alert.name, desired=alert,
+                                apply=self._create))
+            elif _alert_differs(alert, current):
+                plan.add(Action(Action.UPDATE, 'alert', alert.name, desired=alert, current=current,
+                                apply=self._update))
+            else:
+                plan.unchanged.append(current)
+        if delete_missing:
+            for name in sorted(self.alerts):
+                if name not in wanted:
+                    plan.add(Action(Action.DELETE, 'alert', name, current=self.alerts[name],
+                                    apply=self._delete))
+        return plan
+
+    def _create(self, action):
+        a = action.desired
+        created = self.connection.create_alert(a.name,
+                                               description=a.description,
+                                               version=a.version,
+                                               md=a.md,
+                                               conditions=a.conditions,
+                                               services=a.services,
+                                               attributes=a.attributes,
+                                               active=a.active,
+                                               rearm_seconds=a.rearm_seconds)
+        self.alerts[created.name] = created
+        return created
+
+    def _update(self, action):
+        action.desired._id = action.current._id
+        resp = self.connection.update_alert(action.desired)
+        self.alerts[action.name] = action.desired
+        return resp
+
+    def _delete(self, action):
+        resp = self.connection._delete_alert(action.current)
+        self.alerts.pop(action.name, None)
+        return resp
+
+
+class SpaceSet(object):
+    """All the spaces of an account indexed by (case-insensitive) name,
+    fetched with a single (paginated) listing. diff() takes a declarative
+    spec of spaces and their charts:
+
+    >>> spec = [{'name': 'Web', 'charts': [
+    ...     {'name': 'CPU', 'type': 'stacked', 'min': 0,
+    ...      'streams': [{'metric': 'cpu', 'source': '*'}]},
+    ... ]}]
+    >>> plan = SpaceSet.fetch(conn).diff(spec)
+    >>> plan.apply()
+
+    Charts are matched by name and only compared on the attributes the spec
+    sets, so server-side additions (ids, defaults) don't cause updates.
+    """
+
+    def __init__(self, connection, spaces):
+        self.connection = connection
+        self.spaces = {}
+        for space in spaces:
+            if space.name:
+                self.spaces.setdefault(space.name.lower(), space)
+
+    @classmethod
+    def fetch(cls, connection):
+        return cls(connection, connection.list_spaces())
+
+    def __len__(self):
+        return len(self.spaces)
+
+    def __contains__(self, name):
+        return name.lower() in self.spaces
+
+    def __getitem__(self, name):
+        return self.spaces[name.lower()]
+
+    def diff(self, spec, delete_missing_charts=False, max_workers=DEFAULT_MAX_WORKERS):
+        """Plan the changes needed for the spaces in spec (a list of space
+        dicts, or a dict with a 'spaces' list). The charts of the existing
+        spaces are listed once per space, max_workers spaces at a time.
+        Charts missing from the spec are only deleted with delete_missing_charts.
+        """
+        if isinstance(spec, dict):
+            spec = spec.get('spaces', [])
+        existing = [self.spaces[s['name'].lower()] for s in spec if s['name'].lower() in self.spaces]
+        charts = {}
+        for space, space_charts, error in imap_bounded(self.connection.list_charts_in_space,
+                                                       existing, max_workers):
+            if error is not None:
+                raise error
+            charts[space.id] = space_charts
+
+        plan = Plan()
+        for space_spec in spec:
+            space = self.spaces.get(space_spec['name'].lower())
+            if space is None:
+                space_action = plan.add(Action(Action.CREATE, 'space', space_spec['name'],
+                                               desired=space_spec, apply=self._create_space))
+                current_charts = []
+            else:
+                space_action = None
+                current_charts = charts[space.id]
+            self._diff_charts(plan, space, space_action, space_spec,
+                              current_charts, delete_missing_charts)
+        return plan
+
+    def _diff_charts(self, plan, space, space_action, space_spec, current_charts, delete_missing):
+        by_name = {}
+        for chart in current_charts:
+            if chart.name:
+                by_name.setdefault(chart.name.lower(), chart)
+        space_name = space_spec['name']
+        wanted = set()
+        for chart_spec in space_spec.get('charts', []):
+            chart = _chart_from_spec(self.connection, chart_spec)
+            label = "%s/%s" % (space_name, chart.name)
+            wanted.add(chart.name.lower())
+            current = by_name.get(chart.name.lower())
+            if current is None:
+                plan.add(Action(Action.CREATE, 'chart', label, desired=(space, chart),
+                                apply=self._create_chart, stage=1, depends_on=space_action))
+            elif _differs(chart.get_payload(), current.get_payload()):
+                plan.add(Action(Action.UPDATE, 'chart', label, desired=(space, chart),
+                                current=current, apply=self._update_chart, stage=1))
+            else:
+                plan.unchanged.append(current)
+        if delete_missing:
+            for name in sorted(by_name):
+                if name not in wanted:
+                    chart = by_name[name]
+                    plan.add(Action(Action.DELETE, 'chart', "%s/%s" % (space_name, chart.name),
+                                    current=(space, chart), apply=self._delete_chart, stage=1))
+
+    def _create_space(self, action):
+        spec = action.desired
+        space = self.connection.create_space(spec['name'], tags=spec.get('tags', False))
+        self.spaces[space.name.lower()] = space
+        return space
+
+    def _space_for(self, action, space):
+        if space is None:
+            # Created earlier in the same plan
+            return action.depends_on.result
+        return space
+
+    def _create_chart(self, action):
+        space, chart = action.desired
+        payload = chart.get_payload()
+        payload.pop('name')
+        return self.connection.create_chart(chart.name, self._space_for(action, space), **payload)
+
+    def _update_chart(self, action):
+        space, chart = action.desired
+        chart.id = action.current.id
+        chart.space_id = space.id
+        return self.connection.update_chart(chart, space)
+
+    def _delete_chart(self, action):
+        space, chart = action.current
+        return self.connection.delete_chart(chart.id, space.id)
+
+
+def _chart_from_spec(connection, spec):
+    if isinstance(spec, Chart):
+        return spec
+    spec = dict(spec)
+    return Chart(connection, spec.pop('name'), **spec)
+
+
+def _differs(desired, current):
+    """Does current differ from desired on any of the attributes desired sets?"""
+    for k, v in desired.items():
+        if k == 'streams':
+            if len(v) != len(current.get('streams', [])):
+                return True
+            for want, have in zip(v, current['streams']):
+                want = dict((sk, sv) for sk, sv in want.items() if sk != 'id')
+                if _differs(want, have):
+                    return True
+        elif current.get(k) != v:
+            return True
+    return False
+
+
+def _alert_payload(alert):
+    payload = alert.get_payload()
+    payload['services'] = sorted(payload['services'])
+    return payload
+
+
+def _set_fields(payload):
+    """The fields of payload that are set: those left to None (or the
+    attributes left empty) get the server's defaults"""
+    return dict((k, v) for k, v in payload.items() if v is not None and not (k == 'attributes' and not v))
+
+
+def _alert_differs(desired, current):
+    """Does current differ from desired on any of the fields desired sets?
+    Like _differs, so that server defaults (rearm_seconds, a condition's
+    summary_function...) don't cause updates."""
+    want = _set_fields(_alert_payload(desired))
+    have = _alert_payload(current)
+    conditions = want.pop('conditions')
+    if len(conditions) != len(have['conditions']):
+        return True
+    for condition, current_condition in zip(conditions, have['conditions']):
+        if _differs(_set_fields(condition), current_condition):
+            return True
+    return _differs(want, have)
@@ -0,0 +1,662 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""A local, in-memory stand-in for the Librato API.
+
+FakeLibratoServer is a real HTTP server (stdlib only) listening on a local
+port, so the client exercises its whole stack -- sockets, headers, JSON
+encoding and decoding -- just like it would against the API. It is meant for
+tests and benchmarks:
+
+>>> with FakeLibratoServer(latency=0.01, error_rate=0.05) as server:
+...     api = server.connect()   # librato.connect(hostname=..., protocol="http")
+...     api.submit("cpu", 42, tags={"host": "a"})
+...     server.inject(429, count=2)
+...     server.stats()
+
+The server keeps metrics, tagged measurements, annotations, alerts, services,
+spaces and charts in memory and implements the endpoints the client uses.
+Latency, a random error rate, forced error responses (e.g. 429 or 503) and a
+maximum body size can be configured, and every request is accounted for.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qs
+
+RecordedRequest = namedtuple('RecordedRequest',
+                             'method path query status bytes_in bytes_out measurements duration')
+
+NUMBER = (int, float)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, payload=None):
+        Exception.__init__(self, status)
+        self.status = status
+        self.payload = payload
+
+
+def _not_found(what):
+    return HTTPError(404, {'errors': {'request': ["%s not found" % what]}})
+
+
+def _bad_request(params):
+    return HTTPError(400, {'errors': {'params': params}})
+
+
+class FakeStore(object):
+    """The in-memory state of the fake API"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.metrics = OrderedDict()
+        # name -> list of (time, value, tags)
+        self.measurements = {}
+        self.annotations = OrderedDict()
+        self.alerts = OrderedDict()
+        self.services = OrderedDict()
+        self.spaces = OrderedDict()
+        self.last_id = 0
+
+    def next_id(self):
+        self.last_id += 1
+        return self.last_id
+
+
+class FakeLibratoServer(object):
+    """Local HTTP server implementing the parts of the Librato API the client uses.
+
+    :param latency: seconds to wait before answering, or a (min, max) range
+    :param error_rate: probability of answering a request with a 503
+    :param max_body_bytes: reject larger request bodies with a 413
+    :param page_size: default page length of list endpoints
+    :param check_auth: answer 401 to requests without an Authorization header
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, error_rate=0.0,
+                 max_body_bytes=None, page_size=100, check_auth=True, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_body_bytes = max_body_bytes
+        self.page_size = page_size
+        self.check_auth = check_auth
+        self.store = FakeStore()
+        self.requests = []
+        self._injected = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self._routes = [
+            ('GET', r'/v1/metrics$', self._list_metrics),
+            ('POST', r'/v1/metrics$', self._post_metrics),
+            ('PUT', r'/v1/metrics$', self._update_metrics),
+            ('DELETE', r'/v1/metrics$', self._delete_metrics),
+            ('GET', r'/v1/metrics/([^/]+)$', self._get_metric),
+            ('PUT', r'/v1/metrics/([^/]+)$', self._update_metric),
+            ('DELETE', r'/v1/metrics/([^/]+)$', self._delete_metric),
+            ('POST', r'/v1/measurements$', self._post_measurements),
+            ('GET', r'/v1/measurements$', self._get_composite),
+            ('GET', r'/v1/measurements/([^/]+)$', self._get_measurements),
+            ('GET', r'/v1/annotations$', self._list_annotations),
+            ('GET', r'/v1/annotations/([^/]+)$', self._get_annotation_stream),
+            ('POST', r'/v1/annotations/([^/]+)$', self._post_annotation),
+            ('PUT', r'/v1/annotations/([^/]+)$', self._update_annotation_stream),
+            ('DELETE', r'/v1/annotations/([^/]+)$', self._delete_annotation_stream),
+            ('GET', r'/v1/annotations/([^/]+)/(\d+)$', self._get_annotation),
+            ('GET', r'/v1/alerts$', self._list_alerts),
+            ('POST', r'/v1/alerts$', self._create_alert),
+            ('PUT', r'/v1/alerts/(\d+)$', self._update_alert),
+            ('DELETE', r'/v1/alerts/(\d+)$', self._delete_alert),
+            ('GET', r'/v1/services$', self._list_services),
+            ('GET', r'/v1/spaces$', self._list_spaces),
+            ('POST', r'/v1/spaces$', self._create_space),
+            ('GET', r'/v1/spaces/(\d+)$', self._get_space),
+            ('PUT', r'/v1/spaces/(\d+)$', self._update_space),
+            ('DELETE', r'/v1/spaces/(\d+)$', self._delete_space),
+            ('GET', r'/v1/spaces/(\d+)/charts$', self._list_charts),
+            ('POST', r'/v1/spaces/(\d+)/charts$', self._create_chart),
+            ('GET', r'/v1/spaces/(\d+)/charts/(\d+)$', self._get_chart),
+            ('PUT', r'/v1/spaces/(\d+)/charts/(\d+)$', self._update_chart),
+            ('DELETE', r'/v1/spaces/(\d+)/charts/(\d+)$', self._delete_chart),
+        ]
+        self._routes = [(m, re.compile(p), h) for m, p, h in self._routes]
+
+    #
+    # Lifecycle
+    #
+    def start(self):
+        fake = self
+
+        class Handler(_Handler):
+            server_version = 'FakeLibrato/1.0'
+
+            def handle_fake(self):
+                fake._handle(self)
+
+        self._httpd = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._httpd.server_address[1]
+        # A short poll interval keeps stop() quick
+        self._thread = threading.Thread(target=self._httpd.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    @property
+    def hostname(self):
+        return "%s:%d" % (self.host, self.port)
+
+    def connect(self, username='user', api_key='token', **kwargs):
+        """A LibratoConnection pointed at this server"""
+        import librato
+        return librato.connect(username, api_key, hostname=self.hostname, protocol="http", **kwargs)
+
+    #
+    # Fault injection and accounting
+    #
+    def inject(self, status, count=1, retry_after=None, payload=None):
+        """Answer the next count requests with status (e.g. 429 or 503)"""
+        with self._lock:
+            for _ in range(count):
+                self._injected.append((status, retry_after, payload))
+
+    def reset(self):
+        """Forget all data, accounting and pending injected errors"""
+        with self._lock:
+            self.store.clear()
+            self.requests = []
+            self._injected = []
+
+    def stats(self):
+        with self._lock:
+            requests = list(self.requests)
+        by_status = {}
+        by_endpoint = {}
+        for r in requests:
+            by_status[r.status] = by_status.get(r.status, 0) + 1
+            endpoint = "%s %s" % (r.method, re.sub(r'/\d+', '/:id', r.path))
+            by_endpoint[endpoint] = by_endpoint.get(endpoint, 0) + 1
+        return {
+            'requests': len(requests),
+            'by_status': by_status,
+            'by_endpoint': by_endpoint,
+            'bytes_in': sum(r.bytes_in for r in requests),
+            'bytes_out': sum(r.bytes_out for r in requests),
+            'measurements': sum(r.measurements for r in requests if r.status < 300),
+        }
+
+    #
+    # Request handling
+    #
+    def _handle(self, handler):
+        started = time.time()
+        url = urlparse(handler.path)
+        query = dict((k, v if len(v) > 1 or k.endswith('[]') else v[0])
+                     for k, v in parse_qs(url.query).items())
+        body = handler.read_body()
+        measurements = 0
+        headers = {}
+        try:
+            self._delay()
+            self._maybe_fail(headers)
+            if self.check_auth and not handler.headers.get('Authorization'):
+                raise HTTPError(401, {'errors': {'request': ['Authorization Required']}})
+            if self.max_body_bytes is not None and len(body) > self.max_body_bytes:
+                raise HTTPError(413, {'errors': {'request': ['Request entity too large']}})
+            payload = json.loads(body.decode('utf-8')) if body else {}
+            measurements = _count_measurements(payload)
+            status, data = self._route(handler.command, url.path, query, payload)
+        except HTTPError as e:
+            status, data = e.status, e.payload
+        except ValueError as e:
+            status, data = 400, {'errors': {'request': [str(e)]}}
+
+        out = json.dumps(data).encode('utf-8') if data is not None else b''
+        if status == 200 and handler.command == 'GET' and out:
+            etag = '"%s"' % hashlib.md5(out).hexdigest()
+            headers['ETag'] = etag
+            if handler.headers.get('If-None-Match') == etag:
+                status, out = 304, b''
+        # Account before answering so clients see their request recorded
+        with self._lock:
+            self.requests.append(RecordedRequest(handler.command, url.path, query, status,
+                                                 len(body), len(out), measurements,
+                                                 time.time() - started))
+        handler.respond(status, out, headers)
+
+    def _delay(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self._random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _maybe_fail(self, headers):
+        with self._lock:
+            injected = self._injected.pop(0) if self._injected else None
+            random_failure = self.error_rate and self._random.random() < self.error_rate
+        if injected is not None:
+            status, retry_after, payload = injected
+            if retry_after is not None:
+                headers['Retry-After'] = str(retry_after)
+            if payload is None and status < 500:
+                payload = {'request_time': int(time.time()),
+                           'error': 'You have hit the API limit for measurements'}
+            raise HTTPError(status, payload)
+        if random_failure:
+            raise HTTPError(503)
+
+    def _route(self, method, path, query, payload):
+        for m, pattern, handler in self._routes:
+            if m != method:
+                continue
+            match = pattern.match(path)
+            if match:
+                with self.store.lock:
+                    return handler(query, payload, *match.groups())
+        raise _not_found(path)
+
+    def _paginate(self, key, items, query):
+        offset = int(query.get('offset', 0))
+        length = int(query.get('length', self.page_size))
+        page = items[offset:offset + length]
+        return 200, {key: page, 'query': {'offset': offset, 'length': len(page),
+                                          'found': len(items), 'total': len(items)}}
+
+    #
+    # Metrics
+    #
+    def _metric(self, name, type='gauge'):
+        metrics = self.store.metrics
+        if name not in metrics:
+            metrics[name] = {'name': name, 'type': type, 'display_name': None,
+                             'description': None, 'period': None, 'attributes': {}}
+        return metrics[name]
+
+    def _list_metrics(self, query, payload):
+        name = query.get('name')
+        metrics = [m for m in self.store.metrics.values() if not name or name in m['name']]
+        return self._paginate('metrics', metrics, query)
+
+    def _post_metrics(self, query, payload):
+        errors = {}
+        for type in ('gauge', 'counter'):
+            for i, m in enumerate(payload.get(type + 's', [])):
+                problems = _measurement_problems(m, ('value', 'sum'))
+                if problems:
+                    errors["%ss[%d]" % (type, i)] = problems
+        if errors:
+            raise _bad_request(errors)
+        for type in ('gauge', 'counter'):
+            for m in payload.get(type + 's', []):
+                self._metric(m['name'], type)
+        return 200, None
+
+    def _get_metric(self, query, payload, name):
+        if name not in self.store.metrics:
+            raise _not_found("Metric %s" % name)
+        return 200, self.store.metrics[name]
+
+    def _update_metric(self, query, payload, name):
+        metric = self._metric(name, payload.get('type', 'gauge'))
+        for k, v in payload.items():
+            if k == 'attributes':
+                metric['attributes'].update(v)
+            else:
+                metric[k] = v
+        return 204, None
+
+    def _update_metrics(self, query, payload):
+        names = payload.pop('names', [])
+        for name in names:
+            if name in self.store.metrics:
+                self._update_metric(query, dict(payload), name)
+        return 204, None
+
+    def _delete_metric(self, query, payload, name):
+        self.store.metrics.pop(name, None)
+        self.store.measurements.pop(name, None)
+        return 204, None
+
+    def _delete_metrics(self, query, payload):
+        for name in payload.get('names', []):
+            self._delete_metric(query, payload, name)
+        return 204, None
+
+    #
+    # Measurements
+    #
+    def _post_measurements(self, query, payload):
+        measurements = payload.get('measurements', [])
+        errors = {}
+        for i, m in enumerate(measurements):
+            problems = _measurement_problems(m, ('value', 'sum'))
+            if problems:
+                errors[str(i)] = problems
+        if errors:
+            raise _bad_request({'measurements': errors})
+        top_tags = payload.get('tags', {})
+        top_time = payload.get('time', int(time.time()))
+        for m in measurements:
+            self._metric(m['name'])
+            value = m['value'] if 'value' in m else float(m['sum']) / m.get('count', 1)
+            tags = dict(top_tags, **m.get('tags', {}))
+            self.store.measurements.setdefault(m['name'], []).append((m.get('time', top_time), value, tags))
+        return 202, None
+
+    def _get_measurements(self, query, payload, name):
+        if 'start_time' not in query and 'duration' not in query:
+            raise _bad_request({'start_time': ['is required']})
+        end = int(query.get('end_time', time.time()))
+        start = int(query['start_time']) if 'start_time' in query else end - int(query['duration'])
+        wanted = dict((k[5:-1], v) for k, v in query.items() if k.startswith('tags['))
+        if 'tags_search' in query:
+            k, v = query['tags_search'].split('=', 1)
+            wanted[k] = v
+        series = OrderedDict()
+        for t, value, tags in self.store.measurements.get(name, []):
+            if start <= t <= end and all(tags.get(k) == v for k, v in wanted.items()):
+                key = tuple(sorted(tags.items()))
+                series.setdefault(key, []).append({'time': t, 'value': value})
+        return 200, {'name': name, 'resolution': int(query.get('resolution', 1)), 'links': [],
+                     'series': [{'tags': dict(k), 'measurements': sorted(v, key=lambda p: p['time'])}
+                                for k, v in series.items()]}
+
+    def _get_composite(self, query, payload):
+        match = re.search(r's\("([^"]+)"', query.get('compose', ''))
+        if not match:
+            raise _bad_request({'compose': ['is invalid']})
+        status, data = self._get_measurements(query, payload, match.group(1))
+        data['compose'] = query['compose']
+        return status, data
+
+    #
+    # Annotations
+    #
+    def _stream(self, name):
+        streams = self.store.annotations
+        if name not in streams:
+            streams[name] = {'name': name, 'display_name': name, 'events': []}
+        return streams[name]
+
+    def _list_annotations(self, query, payload):
+        streams = [{'name': s['name'], 'display_name': s['display_name']}
+                   for s in self.store.annotations.values()]
+        return self._paginate('annotations', streams, query)
+
+    def _get_annotation_stream(self, query, payload, name):
+        if name not in self.store.annotations:
+            raise _not_found("Annotation stream %s" % name)
+        stream = self.store.annotations[name]
+        data = {'name': name, 'display_name': stream['display_name']}
+        if 'start_time' in query:
+            start = int(query['start_time'])
+            end = int(query.get('end_time', time.time()))
+            sources = query.get('sources[]')
+            events = [e for e in stream['events'] if start <= e['start_time'] <= end and
+                      (not sources or e['source'] in sources)]
+            status, page = self._paginate('events', events, query)
+            by_source = OrderedDict()
+            for e in page['events']:
+                by_source.setdefault(e['source'] or 'unassigned', []).append(e)
+            data['events'] = [by_source] if by_source else []
+            data['query'] = page['query']
+        return 200, data
+
+    def _post_annotation(self, query, payload, name):
+        if not payload.get('title'):
+            raise _bad_request({'title': ['is not present']})
+        stream = self._stream(name)
+        event = {'id': self.store.next_id(), 'title': payload['title'],
+                 'description': payload.get('description'),
+                 'source': payload.get('source'),
+                 'start_time': int(payload.get('start_time', time.time())),
+                 'end_time': payload.get('end_time'),
+                 'links': payload.get('links', [])}
+        stream['events'].append(event)
+        return 201, event
+
+    def _update_annotation_stream(self, query, payload, name):
+        stream = self._stream(name)
+        stream['display_name'] = payload.get('display_name', stream['display_name'])
+        return 200, {'name': name, 'display_name': stream['display_name']}
+
+    def _delete_annotation_stream(self, query, payload, name):
+        self.store.annotations.pop(name, None)
+        return 204, None
+
+    def _get_annotation(self, query, payload, name, id):
+        for e in self.store.annotations.get(name, {}).get('events', []):
+            if e['id'] == int(id):
+                return 200, dict(e, name=name)
+        raise _not_found("Annotation %s" % id)
+
+    #
+    # Alerts and services
+    #
+    def _list_alerts(self, query, payload):
+        alerts = [a for a in self.store.alerts.values()
+                  if 'name' not in query or a['name'] == query['name']]
+        return self._paginate('alerts', alerts, query)
+
+    def _alert(self, payload, id):
+        alert = {'description': None, 'version': 2, 'conditions': [], 'services': [],
+                 'attributes': {}, 'active': True, 'rearm_seconds': 600, 'md': False}
+        alert.update(payload)
+        alert['id'] = id
+        return alert
+
+    def _create_alert(self, query, payload):
+        if not payload.get('name'):
+            raise _bad_request({'name': ['is not present']})
+        alert = self._alert(payload, self.store.next_id())
+        self.store.alerts[alert['id']] = alert
+        return 201, alert
+
+    def _update_alert(self, query, payload, id):
+        if int(id) not in self.store.alerts:
+            raise _not_found("Alert %s" % id)
+        self.store.alerts[int(id)] = self._alert(payload, int(id))
+        return 204, None
+
+    def _delete_alert(self, query, payload, id):
+        if self.store.alerts.pop(int(id), None) is None:
+            raise _not_found("Alert %s" % id)
+        return 204, None
+
+    def _list_services(self, query, payload):
+        return self._paginate('services', list(self.store.services.values()), query)
+
+    def add_service(self, title, type='mail', settings=None):
+        """Services can't be created through the API, set them up here"""
+        with self.store.lock:
+            id = self.store.next_id()
+            self.store.services[id] = {'id': id, 'title': title, 'type': type,
+                                       'settings': settings or {}}
+            return id
+
+    #
+    # Spaces and charts
+    #
+    def _space(self, id):
+        if int(id) not in self.store.spaces:
+            raise _not_found("Space %s" % id)
+        return self.store.spaces[int(id)]
+
+    def _space_payload(self, space):
+        return {'id': space['id'], 'name': space['name'], 'tags': space['tags'],
+                'charts': [{'id': c['id']} for c in space['charts'].values()]}
+
+    def _list_spaces(self, query, payload):
+        name = query.get('name', '').lower()
+        spaces = [self._space_payload(s) for s in self.store.spaces.values()
+                  if name in s['name'].lower()]
+        return self._paginate('spaces', spaces, query)
+
+    def _create_space(self, query, payload):
+        if not payload.get('name'):
+            raise _bad_request({'name': ['is not present']})
+        id = self.store.next_id()
+        self.store.spaces[id] = {'id': id, 'name': payload['name'],
+                                 'tags': payload.get('tags', False), 'charts': OrderedDict()}
+        return 201, self._space_payload(self.store.spaces[id])
+
+    def _get_space(self, query, payload, id):
+        return 200, self._space_payload(self._space(id))
+
+    def _update_space(self, query, payload, id):
+        self._space(id)['name'] = payload.get('name', self._space(id)['name'])
+        return 204, None
+
+    def _delete_space(self, query, payload, id):
+        self._space(id)
+        del self.store.spaces[int(id)]
+        return 204, None
+
+    def _chart(self, space_id, id):
+        charts = self._space(space_id)['charts']
+        if int(id) not in charts:
+            raise _not_found("Chart %s" % id)
+        return charts[int(id)]
+
+    def _chart_payload(self, chart_id, payload):
+        chart = dict(payload)
+        chart['id'] = chart_id
+        chart.setdefault('type', 'line')
+        chart['streams'] = [dict(s, id=self.store.next_id()) for s in payload.get('streams', [])]
+        return chart
+
+    def _list_charts(self, query, payload, space_id):
+        return 200, list(self._space(space_id)['charts'].values())
+
+    def _create_chart(self, query, payload, space_id):
+        space = self._space(space_id)
+        chart = self._chart_payload(self.store.next_id(), payload)
+        space['charts'][chart['id']] = chart
+        return 201, chart
+
+    def _get_chart(self, query, payload, space_id, id):
+        return 200, self._chart(space_id, id)
+
+    def _update_chart(self, query, payload, space_id, id):
+        self._chart(space_id, id)
+        self._space(space_id)['charts'][int(id)] = self._chart_payload(int(id), payload)
+        return 204, None
+
+    def _delete_chart(self, query, payload, space_id, id):
+        self._chart(space_id, id)
+        del self._space(space_id)['charts'][int(id)]
+        return 204, None
+
+
+def _count_measurements(payload):
+    if not isinstance(payload, dict):
+        return 0
+    return sum(len(payload.get(k, [])) for k in ('measurements', 'gauges', 'counters')
+               if isinstance(payload.get(k), list))
+
+
+def _measurement_problems(m, value_keys):
+    problems = {}
+    if not isinstance(m, dict):
+        return {'measurement': ['is not an object']}
+    if not m.get('name'):
+        problems['name'] = ['is not present']
+    present = [k for k in value_keys if k in m]
+    if not present:
+        problems['value'] = ['is not present']
+    for k in present:
+        if isinstance(m[k], bool) or not isinstance(m[k], NUMBER):
+            problems[k] = ['is not a number']
+    return problems
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_fake()
+
+    do_POST = do_PUT = do_DELETE = do_GET
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers up to the final empty line
+                    while self.rfile.readline().strip():
+                        pass
+                    return b''.join(parts)
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def respond(self, status, body, headers):
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', 'application/json;charset=utf-8')
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,292 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""HTTP transports.
+
+A transport opens the connections LibratoConnection sends its requests
+through. Whatever it returns from connect() only has to look like the bits
+of http.client the connection uses:
+
+* ``request(method, uri, body=None, headers=None)``
+* ``getresponse()``, a response with ``status``, ``read(amt=None)`` and
+  ``getheader(name, default=None)``
+* ``close()``
+
+StdlibTransport, the default, opens one http.client connection per call.
+The others keep pooled connections around and need an extra package:
+urllib3, requests or httpx (for HTTP/2, ``pip install httpx[http2]``).
+Pick one with ``librato.connect(..., transport='urllib3')``.
+"""
+import logging
+import sys
+
+log = logging.getLogger("librato")
+
+# http.client sends iterable bodies, chunked unless given a Content-Length,
+# from python 3.6 on
+HTTP_CLIENT_STREAMS = sys.version_info >= (3, 6)
+
+
+class Transport(object):
+    """Base class of the transports"""
+    name = None
+    # Whether request bodies can be iterables of bytes (see
+    # LibratoConnection.enable_body_streaming)
+    streams_bodies = False
+
+    def connect(self, connection):
+        """A connection-like object to the API for connection (a
+        LibratoConnection: hostname, protocol and timeout are taken from it)"""
+        raise NotImplementedError()
+
+    def close(self):
+        """Release pooled resources"""
+        pass
+
+    def _after_fork(self):
+        """Stop using the connections pooled by the parent process"""
+        pass
+
+    def __repr__(self):
+        return "<%s>" % self.__class__.__name__
+
+
+class StdlibTransport(Transport):
+    """One http.client connection per call"""
+    name = 'stdlib'
+    streams_bodies = HTTP_CLIENT_STREAMS
+
+    def connect(self, connection):
+        # Looked up on every call so librato.HTTPSConnection can be mocked
+        import librato
+        connection_class = librato.HTTPSConnection if connection.protocol == "https" else librato.HTTPConnection
+        if connection._do_we_want_to_fake_server_errors():
+            return connection_class(connection.hostname, fake_n_errors=connection.fake_n_errors)
+        else:
+            return connection_class(connection.hostname, timeout=connection.timeout)
+
+
+class _Response(object):
+    """A pooled client's response, as the connection expects it"""
+
+    def __init__(self, status, headers, read, close):
+        self.status = status
+        self._headers = headers
+        self._read = read
+        self._close = close
+
+    def getheader(self, name, default=None):
+        return self._headers.get(name, default)
+
+    def read(self, amt=None):
+        return self._read(amt)
+
+    def close(self):
+        self._close()
+
+
+class _PooledConnection(object):
+    """Turns request()/getresponse() calls into a pooled client's send"""
+
+    def __init__(self, transport, connection):
+        self._transport = transport
+        self._base = "%s://%s" % (connection.protocol, connection.hostname)
+        self._timeout = connection.timeout
+        self._response = None
+
+    def request(self, method, uri, body=None, headers=None):
+        if isinstance(body, type(u'')):
+            body = body.encode('utf-8')
+        self.close()
+        self._response = self._transport._send(method, self._base + uri, body, dict(headers or {}),
+                                               self._timeout)
+
+    def getresponse(self):
+        return self._response
+
+    def close(self):
+        # Hands the underlying connection back to the pool
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+
+class Urllib3Transport(Transport):
+    """Pooled, keep-alive connections through urllib3"""
+    name = 'urllib3'
+    # Sent through http.client
+    streams_bodies = HTTP_CLIENT_STREAMS
+
+    def __init__(self, maxsize=10, **pool_kwargs):
+        import urllib3
+        self._pool_args = dict(pool_kwargs, maxsize=maxsize)
+        self.pool = urllib3.PoolManager(**self._pool_args)
+
+    def connect(self, connection):
+        return _PooledConnection(self, connection)
+
+    def _send(self, method, url, body, headers, timeout):
+        r = self.pool.request(method, url, body=body, headers=headers, timeout=timeout,
+                              retries=False, redirect=False, preload_content=False)
+
+        def read(amt=None):
+            return r.read(amt) if amt else r.read()
+        return _Response(r.status, r.headers, read, r.release_conn)
+
+    def close(self):
+        self.pool.clear()
+
+    def _after_fork(self):
+        # The parent's sockets are left alone, they are still its own
+        import urllib3
+        self.pool = urllib3.PoolManager(**self._pool_args)
+
+
+class _SizedBody(object):
+    """A streamed body with a known length. requests sends iterables with
+    Transfer-Encoding: chunked unless it can len() them."""
+
+    def __init__(self, body):
+        self._body = body
+
+    def __len__(self):
+        return self._body.length
+
+    def __iter__(self):
+        return iter(self._body)
+
+
+class RequestsTransport(Transport):
+    """Goes through a requests Session (pass your own to share it)"""
+    name = 'requests'
+    streams_bodies = True
+
+    def __init__(self, session=None):
+        self._own_session = session is None
+        if session is None:
+            import requests
+            session = requests.Session()
+        self.session = session
+
+    def connect(self, connection):
+        return _PooledConnection(self, connection)
+
+    def _send(self, method, url, body, headers, timeout):
+        if getattr(body, 'length', None) is not None:
+            body = _SizedBody(body)
+        r = self.session.request(method, url, data=body, headers=headers, timeout=timeout,
+                                 stream=True, allow_redirects=False)
+
+        def read(amt=None):
+            return r.raw.read(amt, decode_content=True)
+        return _Response(r.status_code, r.headers, read, r.close)
+
+    def close(self):
+        self.session.close()
+
+    def _after_fork(self):
+        if self._own_session:
+            import requests
+            self.session = requests.Session()
+        else:
+            # Only drops the pooled connections, the session stays usable
+            self.session.close()
+
+
+class HttpxTransport(Transport):
+    """Goes through an httpx Client. With http2=True requests are
+    multiplexed over HTTP/2 connections when the h2 package is installed
+    (falling back to HTTP/1.1 otherwise)."""
+    name = 'httpx'
+    streams_bodies = True
+
+    def __init__(self, http2=False, client=None, **client_kwargs):
+        self._client_args = None
+        if client is None:
+            import httpx
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    log.warning("h2 is not installed, using HTTP/1.1 (pip install httpx[http2])")
+                    http2 = False
+            self._client_args = dict(client_kwargs, http2=http2)
+            client = httpx.Client(**self._client_args)
+        self.client = client
+
+    def connect(self, connection):
+        return _PooledConnection(self, connection)
+
+    def _send(self, method, url, body, headers, timeout):
+        request = self.client.build_request(method, url, content=body, headers=headers, timeout=timeout)
+        r = self.client.send(request, stream=True)
+        chunks = r.iter_bytes()
+        buffered = [b'']
+
+        def read(amt=None):
+            if amt is None:
+                data = buffered[0] + b''.join(chunks)
+                buffered[0] = b''
+                return data
+            data = buffered[0]
+            while len(data) < amt:
+                try:
+                    data += next(chunks)
+                except StopIteration:
+                    break
+            data, buffered[0] = data[:amt], data[amt:]
+            return data
+        return _Response(r.status_code, r.headers, read, r.close)
+
+    def close(self):
+        self.client.close()
+
+    def _after_fork(self):
+        if self._client_args is None:
+            log.warning("An httpx client passed to HttpxTransport can't be reset after a fork, "
+                        "create the connection in the child process")
+            return
+        import httpx
+        self.client = httpx.Client(**self._client_args)
+
+
+TRANSPORTS = {
+    'stdlib': StdlibTransport,
+    'urllib3': Urllib3Transport,
+    'requests': RequestsTransport,
+    'httpx': HttpxTransport,
+    'http2': lambda: HttpxTransport(http2=True),
+}
+
+
+def get_transport(transport=None):
+    """A Transport out of a transport or the name of one (stdlib by default)"""
+    if transport is None:
+        return StdlibTransport()
+    if hasattr(transport, 'connect'):
+        return transport
+    if transport not in TRANSPORTS:
+        raise ValueError("Unknown transport: %s (one of %s)" % (transport, ', '.join(sorted(TRANSPORTS))))
+    return TRANSPORTS[transport]()
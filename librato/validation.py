@@ -0,0 +1,249 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Client side validation of measurements.
+
+MeasurementValidator checks measurements against the API's rules before
+they are sent, so an invalid one is caught where it is added instead of
+failing a whole request with a 400. The rules are compiled once, and the
+names and tag sets already seen are remembered, so validating a measurement
+of a known series is a couple of dictionary lookups.
+"""
+import re
+import time
+from six import integer_types, string_types
+from librato.exceptions import InvalidMeasurement
+
+VALIDATION_MODES = ('strict', 'drop', 'repair')
+
+# Characters allowed in names, tag names and tag values, as regex classes
+NAME_CHARS = r'-.:_A-Za-z0-9'
+TAG_KEY_CHARS = r'-.:_A-Za-z0-9'
+TAG_VALUE_CHARS = r'-.:_?\\/A-Za-z0-9 '
+
+NUMERIC_TYPES = integer_types + (float,)
+_VALUE_KEYS = frozenset(('value', 'sum', 'count', 'min', 'max', 'last', 'sum_squares'))
+_TIME_KEYS = frozenset(('time', 'measure_time'))
+_NUMERIC_TYPES = frozenset(NUMERIC_TYPES)
+
+# Don't let the caches of a long lived process grow without bounds
+MAX_CACHED = 10000
+
+
+class MeasurementValidator(object):
+    """Validates measurement dicts, tagged ({'name', 'value' or 'sum',
+    'tags', 'time'}) or legacy ({'name', 'value', 'source', 'measure_time'}).
+
+    mode decides what happens to an invalid measurement: 'strict' raises
+    InvalidMeasurement, 'drop' discards it and 'repair' fixes what can be
+    fixed (replacing disallowed characters, truncating, dropping extra tags,
+    converting numeric strings and numeric tag values) and discards the rest.
+    validate() returns the measurement to send, or None when it is discarded.
+
+    Times must lie within max_age seconds in the past and max_ahead
+    seconds in the future.
+    """
+    def __init__(self, mode='strict', name_chars=NAME_CHARS, max_name_length=255,
+                 tag_key_chars=TAG_KEY_CHARS, max_tag_key_length=64,
+                 tag_value_chars=TAG_VALUE_CHARS, max_tag_value_length=255, max_tags=50,
+                 max_age=7200, max_ahead=600, clock=time.time):
+        if mode not in VALIDATION_MODES:
+            raise ValueError("Unknown validation mode: %s (one of %s)" % (mode, ', '.join(VALIDATION_MODES)))
+        self.mode = mode
+        self.max_name_length = max_name_length
+        self.max_tag_key_length = max_tag_key_length
+        self.max_tag_value_length = max_tag_value_length
+        self.max_tags = max_tags
+        self.max_age = max_age
+        self.max_ahead = max_ahead
+        self.clock = clock
+        self._name = re.compile(r'\A[%s]+\Z' % name_chars)
+        self._tag_key = re.compile(r'\A[%s]+\Z' % tag_key_chars)
+        self._tag_value = re.compile(r'\A[%s]+\Z' % tag_value_chars)
+        self._name_chars = re.compile(r'[^%s]' % name_chars)
+        self._tag_key_chars = re.compile(r'[^%s]' % tag_key_chars)
+        self._tag_value_chars = re.compile(r'[^%s]' % tag_value_chars)
+        # Names, tag names and tag values known to be valid
+        self._names = set()
+        self._tag_keys = set()
+        self._tag_values = set()
+        self.dropped = 0
+        self.repaired = 0
+
+    def validate(self, m):
+        """m if it is valid, otherwise what the mode says"""
+        # Fast path: known name and tags, a value and a time of the right
+        # type. Other keys (sums, legacy fields...) go through _check_fields.
+        if m.get('name') not in self._names:
+            return self._invalid(m)
+        checked = 1
+        tags = m.get('tags')
+        if tags is not None:
+            checked += 1
+            try:
+                if (len(tags) > self.max_tags or not self._tag_keys.issuperset(tags) or
+                        not self._tag_values.issuperset(tags.values())):
+                    return self._invalid(m)
+            except (TypeError, AttributeError):
+                return self._invalid(m)
+        v = m.get('value')
+        if v is not None:
+            checked += 1
+            # v - v is nan for nan and infinities
+            if (v - v != 0) if type(v) is float else type(v) not in _NUMERIC_TYPES:
+                return self._invalid(m)
+        t = m.get('time')
+        if t is not None:
+            checked += 1
+            if type(t) not in _NUMERIC_TYPES:
+                return self._invalid(m)
+            now = self.clock()
+            if t < now - self.max_age or t > now + self.max_ahead:
+                return self._invalid(m)
+        if len(m) != checked:
+            return self._check_fields(m)
+        return m
+
+    def _check_fields(self, m):
+        """The value and time checks of validate, for any keys"""
+        now = None
+        for k in m:
+            if k in _VALUE_KEYS:
+                v = m[k]
+                if type(v) not in _NUMERIC_TYPES or (type(v) is float and v - v != 0):
+                    return self._invalid(m)
+            elif k in _TIME_KEYS:
+                t = m[k]
+                if type(t) not in _NUMERIC_TYPES:
+                    return self._invalid(m)
+                if now is None:
+                    now = self.clock()
+                if t < now - self.max_age or t > now + self.max_ahead:
+                    return self._invalid(m)
+        return m
+
+    def _invalid(self, m):
+        """Check m thoroughly, and apply the mode if it is indeed invalid"""
+        problems = {}
+        repairs = {}
+        name = m.get('name')
+        outcome = self._check_name(name)
+        if outcome is not None:
+            problems['name'], repairs['name'] = outcome
+        if m.get('tags'):
+            outcome = self._check_tags(m['tags'])
+            if outcome is not None:
+                problems['tags'], repairs['tags'] = outcome
+        now = self.clock()
+        for k, v in m.items():
+            if k in _VALUE_KEYS:
+                if type(v) not in NUMERIC_TYPES or (type(v) is float and v - v != 0):
+                    problems[k] = ['is not a number']
+                    repairs[k] = _number(v)
+            elif k in _TIME_KEYS:
+                if type(v) not in NUMERIC_TYPES:
+                    problems[k] = ['is not a number']
+                    repairs[k] = None
+                elif v < now - self.max_age or v > now + self.max_ahead:
+                    problems[k] = ['is outside of the accepted time window']
+                    repairs[k] = None
+
+        if not problems:
+            return m
+        if self.mode == 'strict':
+            raise InvalidMeasurement(m, problems)
+        if self.mode == 'repair' and all(v is not None for v in repairs.values()):
+            self.repaired += 1
+            fixed = dict(m)
+            fixed.update(repairs)
+            return fixed
+        self.dropped += 1
+        return None
+
+    def _remember(self, cache, value):
+        if len(cache) >= MAX_CACHED:
+            cache.clear()
+        cache.add(value)
+
+    def _check_name(self, name):
+        """None when name is valid, otherwise (problems, repaired name or None)"""
+        if not isinstance(name, string_types):
+            return ['is not a string'], None
+        problems = []
+        if len(name) > self.max_name_length:
+            problems.append('is too long (maximum is %d characters)' % self.max_name_length)
+        if not self._name.match(name):
+            problems.append('is invalid')
+        if not problems:
+            self._remember(self._names, name)
+            return None
+        return problems, self._name_chars.sub('_', name)[:self.max_name_length] or None
+
+    def _check_tags(self, tags):
+        """None when tags are valid, otherwise (problems, repaired tags or None)"""
+        problems = []
+        repaired = {}
+        if len(tags) > self.max_tags:
+            problems.append('has more than %d tags' % self.max_tags)
+        for k, v in sorted(tags.items(), key=lambda kv: str(kv[0]))[:self.max_tags]:
+            if isinstance(k, string_types) and isinstance(v, NUMERIC_TYPES) and not isinstance(v, bool):
+                # Numbers are the usual slip, their text keeps the series
+                problems.append('%s is not a string' % k)
+                v = str(v)
+            elif not isinstance(k, string_types) or not isinstance(v, string_types):
+                problems.append('%s is not a string' % (k,))
+                continue
+            fixed_k, fixed_v = k, v
+            if len(k) > self.max_tag_key_length or not self._tag_key.match(k):
+                problems.append('%s is an invalid tag name' % k)
+                fixed_k = self._tag_key_chars.sub('_', k)[:self.max_tag_key_length]
+            else:
+                self._remember(self._tag_keys, k)
+            if len(v) > self.max_tag_value_length or not self._tag_value.match(v):
+                problems.append('%s has an invalid value' % k)
+                fixed_v = self._tag_value_chars.sub('_', v)[:self.max_tag_value_length]
+            else:
+                self._remember(self._tag_values, v)
+            if fixed_k and fixed_v:
+                repaired[fixed_k] = fixed_v
+        if not problems:
+            return None
+        return problems, repaired or None
+
+    def stats(self):
+        return {'dropped': self.dropped, 'repaired': self.repaired}
+
+
+def _number(v):
+    """v as a float if it can stand for a finite number, None otherwise"""
+    if isinstance(v, bool):
+        return int(v)
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return None
+    if v - v != 0:
+        return None
+    return v
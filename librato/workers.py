@@ -0,0 +1,115 @@
+# Copyright (c) 2013. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Bounded thread concurrency for bulk operations.
+
+The connection opens a fresh HTTP connection per call, so running several
+calls at once is a matter of spreading them over a few threads while keeping
+the number of requests in flight under control.
+"""
+import threading
+from six.moves import queue
+
+DEFAULT_MAX_WORKERS = 4
+
+_STOP = object()
+
+
+def imap_bounded(func, iterable, max_workers=DEFAULT_MAX_WORKERS, ordered=True):
+    """Call func on every item of iterable using up to max_workers threads.
+
+    Yields (item, result, error) tuples, error being the exception raised by
+    func (result is then None). Items are pulled from iterable lazily, at
+    most max_workers of them are in flight (or buffered) at any time. With ordered=True
+    the tuples come out in input order, otherwise as soon as they complete.
+
+    max_workers may also be a callable returning the current bound, which is
+    then checked again before each item is started.
+    """
+    if callable(max_workers):
+        limit = max_workers
+    elif max_workers is None or max_workers <= 1:
+        for item in iterable:
+            try:
+                yield item, func(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+    else:
+        def limit():
+            return max_workers
+
+    tasks = queue.Queue()
+    done = queue.Queue()
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is _STOP:
+                return
+            idx, item = task
+            try:
+                done.put((idx, item, func(item), None))
+            except Exception as e:
+                done.put((idx, item, None, e))
+
+    threads = []
+    items = iter(iterable)
+    in_flight = 0
+    next_idx = 0
+    next_to_yield = 0
+    pending = {}
+    exhausted = False
+    try:
+        while True:
+            # Results waiting for their turn count against the bound too
+            while not exhausted and in_flight + len(pending) < max(1, limit()):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if len(threads) < in_flight + 1:
+                    t = threading.Thread(target=work)
+                    t.daemon = True
+                    t.start()
+                    threads.append(t)
+                tasks.put((next_idx, item))
+                next_idx += 1
+                in_flight += 1
+            if in_flight == 0:
+                return
+            idx, item, result, error = done.get()
+            in_flight -= 1
+            if not ordered:
+                yield item, result, error
+                continue
+            pending[idx] = (item, result, error)
+            while next_to_yield in pending:
+                yield pending.pop(next_to_yield)
+                next_to_yield += 1
+    finally:
+        for _ in threads:
+            tasks.put(_STOP)
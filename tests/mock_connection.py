@@ -156,6 +156,14 @@ class MockServer(object):
         del self.alerts[int(_id)]
         return ''
 
+    def update_alert(self, _id, payload):
+        if int(_id) not in self.alerts:
+            # TODO: return 404
+            raise Exception("Trying to update alert that doesn't exist %s" % _id)
+        payload["id"] = int(_id)
+        self.alerts[int(_id)] = payload
+        return ''
+
     def list_of_alerts(self, name=None):
         answer = {}
         answer["query"] = {}
@@ -474,6 +482,7 @@ class MockResponse(object):
         self.request = request
         self.status = 500 if fake_failure else 200
         self._headers = {'content-type': "application/json;charset=utf-8"}
+        self._body = None
 
     class headers(object):
         @staticmethod
@@ -483,8 +492,15 @@ class MockResponse(object):
     def getheader(self, name, default=None):
         return self._headers.get(name.lower(), default)
 
-    def read(self):
-        return self._json_body_based_on_request()
+    def read(self, amt=None):
+        # Like HTTPResponse, hand out amt sized pieces when asked to
+        if self._body is None:
+            self._body = self._json_body_based_on_request() or b''
+        if amt is None:
+            body, self._body = self._body, self._body[:0]
+        else:
+            body, self._body = self._body[:amt], self._body[amt:]
+        return body
 
     def _json_body_based_on_request(self):
         r = self.request
@@ -519,6 +535,8 @@ class MockResponse(object):
             return server.create_alert(r.body)
         elif self._req_is_delete_alert():
             return server.delete_alert(self._extract_id_from_url(), r.body)
+        elif self._req_is_update_alert():
+            return server.update_alert(self._extract_id_from_url(), r.body)
         elif self._req_is_get_annotation_stream():
             return server.get_annotation_stream()
         elif self._req_is_list_of_spaces():
@@ -598,6 +616,10 @@ class MockResponse(object):
         return (self._method_is('DELETE') and
                 re.match('/v1/alerts/\d+', self.request.uri))
 
+    def _req_is_update_alert(self):
+        return (self._method_is('PUT') and
+                re.match('/v1/alerts/\d+', self.request.uri))
+
     # Services
     def _req_is_list_of_services(self):
         return self._method_is('GET') and self._path_is('/v1/services')
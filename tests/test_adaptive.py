@@ -0,0 +1,173 @@
+import logging
+import time
+import unittest
+import librato
+from librato.adaptive import AIMDController
+from librato.instrumentation import RequestInfo
+from librato.testing import FakeLibratoServer
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def post(elapsed=0.1, status=200, path='measurements'):
+    info = RequestInfo('POST', path)
+    info.status = status
+    info.elapsed = elapsed
+    return info
+
+
+class TestAIMDController(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ctl = AIMDController(min_chunk=50, max_chunk=500, chunk_size=100, chunk_step=50,
+                                  max_workers=4, target_latency=1.0, clock=self.clock)
+
+    def test_additive_increase(self):
+        self.ctl.after_response(post())
+        assert self.ctl.chunk_size == 150
+        assert self.ctl.workers == 2
+        self.ctl.after_response(post())
+        assert self.ctl.workers == 2
+        self.ctl.after_response(post())
+        assert self.ctl.workers == 3
+
+    def test_bounds(self):
+        for _ in range(50):
+            self.ctl.after_response(post())
+        assert self.ctl.chunk_size == 500
+        assert self.ctl.workers == 4
+
+    def test_slow_response_decreases(self):
+        for _ in range(10):
+            self.ctl.after_response(post())
+        self.ctl.after_response(post(elapsed=2.0))
+        assert self.ctl.chunk_size == 250
+        assert self.ctl.workers == 2
+        assert self.ctl.stats()['latency'] > 0.1
+
+    def test_throttling(self):
+        self.ctl.on_error(post(status=429))
+        stats = self.ctl.stats()
+        assert stats['chunk_size'] == 50
+        assert stats['throttled'] == 1
+        assert stats['decreases'] == 1
+
+    def test_payload_too_large_only_shrinks_chunks(self):
+        for _ in range(3):
+            self.ctl.after_response(post())
+        self.ctl.on_error(post(status=413))
+        assert self.ctl.workers == 3
+        assert self.ctl.chunk_size == 125
+
+    def test_bad_requests_are_not_congestion(self):
+        self.ctl.on_error(post(status=400))
+        assert self.ctl.stats()['decreases'] == 0
+        assert self.ctl.stats()['errors'] == 1
+
+    def test_decreases_are_rate_limited(self):
+        self.ctl.on_retry(post(status=503))
+        self.ctl.on_retry(post(status=503))
+        assert self.ctl.decreases == 1
+        self.clock.now += 1
+        self.ctl.on_retry(post(status=503))
+        assert self.ctl.decreases == 2
+        assert self.ctl.chunk_size == 50
+
+    def test_other_requests_are_ignored(self):
+        info = RequestInfo('GET', 'metrics')
+        info.elapsed = 5.0
+        self.ctl.after_response(info)
+        assert self.ctl.stats()['requests'] == 0
+
+    def test_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            AIMDController(min_chunk=10, max_chunk=5)
+        with self.assertRaises(ValueError):
+            AIMDController(decrease=1.5)
+
+
+class TestAdaptiveQueue(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeLibratoServer().start()
+        self.conn = self.server.connect()
+        self.conn.backoff_logic = lambda backoff: 0.01
+
+    def tearDown(self):
+        self.server.stop()
+
+    def fill(self, q, n):
+        now = int(time.time())
+        for i in range(n):
+            q.add_tagged('cpu', i, time=now, tags={'host': 'h%d' % i})
+        for i in range(n):
+            q.add('load', i, source='h%d' % i)
+
+    def test_submit(self):
+        ctl = AIMDController(min_chunk=10, max_chunk=100, chunk_size=10, chunk_step=10)
+        q = self.conn.new_queue(adaptive=ctl)
+        self.fill(q, 200)
+        q.submit()
+
+        stats = self.server.stats()
+        assert stats['measurements'] == 400
+        assert stats['by_status'] == {200: stats['by_endpoint']['POST /v1/metrics'],
+                                      202: stats['by_endpoint']['POST /v1/measurements']}
+        assert ctl.chunk_size == 100
+        assert ctl.workers > 1
+        assert q._num_measurements_in_queue() == 0
+
+    def test_throttling_shrinks_chunks(self):
+        ctl = AIMDController(min_chunk=10, max_chunk=100, chunk_size=100, cooldown=0)
+        q = self.conn.new_queue(adaptive=ctl)
+        self.fill(q, 100)
+        self.server.inject(429)
+        with self.assertRaises(librato.exceptions.ClientError):
+            q.submit()
+
+        assert ctl.stats()['throttled'] == 1
+        # The throttled request's measurements are still queued
+        assert 0 < q._num_measurements_in_queue() <= 100
+        q.submit()
+        assert self.server.stats()['measurements'] == 200
+
+    def test_interrupted_submit_keeps_unsent(self):
+        # One worker, so both requests before the interruption are done
+        ctl = AIMDController(min_chunk=10, max_chunk=10, max_workers=1)
+        q = self.conn.new_queue(adaptive=ctl)
+        self.fill(q, 50)
+        requests = q._adaptive_requests
+
+        def interrupted(queued, controller):
+            for i, request in enumerate(requests(queued, controller)):
+                if i == 2:
+                    raise KeyboardInterrupt()
+                yield request
+        q._adaptive_requests = interrupted
+        with self.assertRaises(KeyboardInterrupt):
+            q.submit()
+        assert self.server.stats()['measurements'] == 20
+        assert q._num_measurements_in_queue() == 80
+
+        del q._adaptive_requests
+        q.submit()
+        assert self.server.stats()['measurements'] == 100
+        assert q._num_measurements_in_queue() == 0
+
+    def test_default_controller(self):
+        q = self.conn.new_queue(adaptive=True)
+        assert q.adaptive.max_chunk == q.MAX_MEASUREMENTS_PER_CHUNK
+        self.fill(q, 10)
+        q.submit()
+        assert self.server.stats()['measurements'] == 20
+        assert q.adaptive.connection is self.conn
+
+if __name__ == '__main__':
+    unittest.main()
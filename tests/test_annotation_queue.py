@@ -0,0 +1,88 @@
+import logging
+import unittest
+import librato
+from librato.testing import FakeLibratoServer
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class TestAnnotationQueue(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.server.latency = 0
+        self.conn = self.server.connect()
+        self.conn.backoff_logic = lambda backoff: 0.01
+
+    def titles(self, name):
+        return sorted(e['title'] for e in self.server.store.annotations[name]['events'])
+
+    def test_submit(self):
+        q = self.conn.new_annotation_queue(max_workers=3)
+        for i in range(5):
+            q.add('deploys', 'v%d' % i, source='web-%d' % i)
+        q.add('incidents', 'outage', description='db down')
+        assert len(q) == 6
+
+        results = q.submit()
+        assert len(q) == 0
+        assert [r.name for r in results] == ['deploys'] * 5 + ['incidents']
+        assert all(r.ok for r in results)
+        assert results[0].response['title'] == 'v0'
+        assert self.titles('deploys') == ['v0', 'v1', 'v2', 'v3', 'v4']
+        assert self.server.store.annotations['incidents']['events'][0]['description'] == 'db down'
+
+    def test_failures_and_retries(self):
+        self.server.inject(503)
+        self.server.inject(400)
+        errors = []
+        q = self.conn.new_annotation_queue(max_workers=1, on_error=errors.append)
+        q.add('deploys', 'v1')
+        q.add('deploys', 'v2')
+
+        results = q.submit()
+        # The first event is retried after the 503 and then rejected
+        assert [r.ok for r in results] == [False, True]
+        assert isinstance(results[0].error, librato.exceptions.BadRequest)
+        assert errors == q.failed == [results[0]]
+        assert q.posted == 1
+        assert self.server.stats()['by_status'] == {503: 1, 400: 1, 201: 1}
+
+    def test_context_manager_and_auto_submit(self):
+        with self.conn.new_annotation_queue(auto_submit_count=2) as q:
+            q.add('deploys', 'v1')
+            q.add('deploys', 'v2')
+            assert len(q) == 0
+            q.add('deploys', 'v3')
+        assert self.titles('deploys') == ['v1', 'v2', 'v3']
+
+    def test_background(self):
+        q = self.conn.new_annotation_queue(background=True, max_workers=2)
+        for i in range(10):
+            q.add('deploys', 'v%d' % i)
+        q.flush()
+        assert q.posted == 10
+        assert len(self.titles('deploys')) == 10
+
+        q.add('deploys', 'last')
+        q.close()
+        assert q.posted == 11
+
+    def test_background_drops_when_full(self):
+        self.server.latency = 0.1
+        q = self.conn.new_annotation_queue(background=True, max_workers=1, max_pending=1)
+        for i in range(5):
+            q.add('deploys', 'v%d' % i)
+        q.close()
+        assert q.dropped >= 3
+        assert q.posted + q.dropped == 5
+
+if __name__ == '__main__':
+    unittest.main()
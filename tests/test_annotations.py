@@ -1,6 +1,8 @@
 import logging
 import unittest
 import librato
+from librato.annotations import AnnotationEvent, iter_events, time_windows
+from librato.testing import FakeLibratoServer
 from mock_connection import MockConnect, server
 
 # logging.basicConfig(level=logging.DEBUG)
@@ -36,5 +38,71 @@ class TestLibratoAnnotations(unittest.TestCase):
     def cls(self, connection, data):
         return librato.Annotation(self.conn, '', '')
 
+
+class TestAnnotationEvents(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer(page_size=3).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.conn = self.server.connect()
+        # Events every 100s from 1000 to 1900, alternating sources
+        for i in range(10):
+            self.conn.post_annotation('deploys', title='v%d' % i, source='web-%d' % (i % 2),
+                                      start_time=1000 + i * 100)
+
+    def test_time_windows(self):
+        assert list(time_windows(0, 250, 100)) == [(0, 100), (100, 200), (200, 250)]
+        assert list(time_windows(5, 5, 100)) == [(5, 5)]
+        for window in (0, -10):
+            with self.assertRaises(ValueError):
+                time_windows(0, 250, window)
+            with self.assertRaises(ValueError):
+                list(self.conn.iter_annotation_events('deploys', 1000, 1900, window=window))
+
+    def test_iter_events(self):
+        events = [{'web': [{'id': 1, 'title': 'a'}]}, {'db': [{'id': 2, 'title': 'b', 'source': 'db-1'}]}]
+        assert [(e.id, e.source) for e in iter_events(events)] == [(1, 'web'), (2, 'db-1')]
+        assert [e.id for e in iter_events({'web': [{'id': 1}]})] == [1]
+        assert list(iter_events(None)) == []
+
+    def test_iterates_over_windows_and_pages(self):
+        events = list(self.conn.iter_annotation_events('deploys', 1000, 1900, window=400, page_size=3))
+
+        assert all(isinstance(e, AnnotationEvent) for e in events)
+        # Events on window boundaries are only yielded once
+        assert [e.title for e in events] == ['v%d' % i for i in range(10)]
+        assert events[3].source == 'web-1'
+        assert events[3].start_time == 1300
+        # Windows of 5, 5 and 2 events, 3 per page
+        assert self.server.stats()['by_endpoint']['GET /v1/annotations/deploys'] == 5
+
+    def test_sources_and_sequential_fetching(self):
+        events = self.conn.iter_annotation_events('deploys', 1000, 1900, sources=['web-0'],
+                                                  window=300, max_workers=1)
+        assert [e.title for e in events] == ['v0', 'v2', 'v4', 'v6', 'v8']
+
+    def test_lazy(self):
+        events = self.conn.iter_annotation_events('deploys', 1000, 1900, window=100, max_workers=2)
+        assert next(events).title == 'v0'
+        events.close()
+        assert self.server.stats()['by_endpoint']['GET /v1/annotations/deploys'] <= 3
+
+    def test_events_without_ids(self):
+        def mexe(path, query_props=None, **kwargs):
+            return {'events': [{'web': [{'title': 'a'}, {'title': 'b'}]}], 'query': {'length': 2, 'total': 2}}
+        self.conn._mexe = mexe
+        events = list(self.conn.iter_annotation_events('deploys', 1000, 1100, window=100))
+        assert [e.title for e in events] == ['a', 'b']
+
+    def test_errors(self):
+        with self.assertRaises(librato.exceptions.NotFound):
+            list(self.conn.iter_annotation_events('nothing', 1000, 1900))
+
 if __name__ == '__main__':
     unittest.main()
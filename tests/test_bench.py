@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from six import StringIO
+from librato import bench
+
+try:
+    import tracemalloc
+except ImportError:  # python < 3.4
+    tracemalloc = None
+
+
+class TestBench(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_run(self):
+        results = bench.run(['queue_add', 'chunk_serialization'], quick=True)
+        names = [r['name'] for r in results['results']]
+        assert names == ['queue_add', 'chunk_serialization']
+        for r in results['results']:
+            assert r['ops'] > 0
+            assert r['ops_per_sec'] > 0
+        assert results['results'][1]['bytes'] > 0
+
+    def test_end_to_end(self):
+        result = bench.run(['submit_end_to_end'], quick=True)['results'][0]
+        assert result['requests'] == 5
+
+    @unittest.skipIf(tracemalloc is None, "needs tracemalloc")
+    def test_metric_memory(self):
+        result = bench.run(['metric_memory'], quick=True)['results'][0]
+        # Lazy metrics don't create the empty defaults they are not asked for
+        assert 0 < result['bytes_per_lazy_metric'] < result['bytes_per_metric']
+        assert result['seconds_lazy'] > 0
+
+    @unittest.skipIf(tracemalloc is None, "needs tracemalloc")
+    def test_model_memory(self):
+        result = bench.run(['model_memory'], quick=True)['results'][0]
+        for model in ('metric', 'alert', 'chart', 'stream', 'annotation'):
+            assert 0 < result['bytes_per_%s' % model] < result['bytes_per_%s_dict' % model], model
+
+    def test_validate_cached(self):
+        result = bench.run(['validate_cached'], quick=True)['results'][0]
+        assert result['us_per_measurement'] > 0
+
+    @unittest.skipIf(tracemalloc is None, "needs tracemalloc")
+    def test_streamed_body(self):
+        result = bench.run(['streamed_body'], quick=True)['results'][0]
+        assert result['peak_bytes_streamed'] < result['peak_bytes']
+
+    @unittest.skipIf(sys.version_info < (3, 7), "module __getattr__ needs python 3.7")
+    def test_import_time(self):
+        result = bench.run(['import_time'], quick=True)['results'][0]
+        assert result['ms_per_import'] > 0
+        assert result['ms_per_eager_import'] > 0
+        # Timings are too noisy to compare, what gets imported is not
+        assert result['modules_loaded'] == []
+        assert 'librato.metrics' in result['modules_loaded_eager']
+
+    def test_compare(self):
+        baseline = {'results': [{'name': 'a', 'ops_per_sec': 100.0}, {'name': 'b', 'ops_per_sec': 100.0}]}
+        current = {'results': [{'name': 'a', 'ops_per_sec': 95.0}, {'name': 'b', 'ops_per_sec': 50.0}]}
+        out = StringIO()
+        assert bench.compare(baseline, current, threshold=0.9, out=out) == ['b']
+        assert 'REGRESSION' in out.getvalue()
+
+    def test_main_writes_json(self):
+        path = os.path.join(self.tmp, 'results.json')
+        assert bench.main(['--quick', '--output', path, 'aggregator_add']) == 0
+        with open(path) as f:
+            results = json.load(f)
+        assert results['results'][0]['name'] == 'aggregator_add'
+        # Comparing a run with itself can't regress much
+        assert bench.main(['--quick', '--compare', path, '--threshold', '0.01', 'aggregator_add']) == 0
+
+if __name__ == '__main__':
+    unittest.main()
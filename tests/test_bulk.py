@@ -0,0 +1,77 @@
+import logging
+import unittest
+import librato
+from librato.bulk import chunked, update_chunks
+from librato.testing import FakeLibratoServer
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class TestChunking(unittest.TestCase):
+    def test_chunked(self):
+        assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+        assert list(chunked([], 2)) == []
+
+    def test_update_chunks_group_by_props(self):
+        updates = [('a', {'period': 60}), ('b', {'period': 10}), ('c', {'period': 60}),
+                   ('d', {'period': 60})]
+        assert list(update_chunks(updates, 2)) == [
+            (['a', 'c'], {'period': 60}), (['b'], {'period': 10}), (['d'], {'period': 60})]
+
+
+class TestBulkOperations(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.conn = self.server.connect()
+        self.names = ['m%02d' % i for i in range(25)]
+        q = self.conn.new_queue()
+        for name in self.names:
+            q.add(name, 1)
+        q.submit()
+
+    def test_bulk_delete(self):
+        results = list(self.conn.bulk_delete(iter(self.names[:20]), chunk_size=7, max_workers=3))
+
+        assert sorted(len(r.names) for r in results) == [6, 7, 7]
+        assert all(r.ok for r in results)
+        assert sorted(self.server.store.metrics) == self.names[20:]
+        assert self.server.stats()['by_endpoint']['DELETE /v1/metrics'] == 3
+
+    def test_bulk_delete_partial_failure(self):
+        self.server.inject(400)
+        results = list(self.conn.bulk_delete(self.names, chunk_size=10, max_workers=1))
+
+        failed = [r for r in results if not r.ok]
+        assert len(failed) == 1
+        assert failed[0].names == self.names[:10]
+        assert isinstance(failed[0].error, librato.exceptions.BadRequest)
+        assert sorted(self.server.store.metrics) == self.names[:10]
+
+    def test_bulk_update(self):
+        updates = dict((name, {'period': 60 if i % 2 else 10}) for i, name in enumerate(self.names))
+        updates['m00'] = {'attributes': {'display_units_short': 'ms'}}
+        results = list(self.conn.bulk_update(updates, chunk_size=5))
+
+        assert all(r.ok for r in results)
+        assert sum(len(r.names) for r in results) == 25
+        metrics = self.server.store.metrics
+        assert metrics['m01']['period'] == 60
+        assert metrics['m02']['period'] == 10
+        assert metrics['m00']['attributes']['display_units_short'] == 'ms'
+        # 12 at 60s and 12 at 10s in chunks of 5, plus m00
+        assert self.server.stats()['by_endpoint']['PUT /v1/metrics'] == 7
+
+    def test_nothing_happens_until_iterated(self):
+        self.conn.bulk_delete(self.names)
+        assert len(self.server.store.metrics) == 25
+
+if __name__ == '__main__':
+    unittest.main()
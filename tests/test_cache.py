@@ -0,0 +1,274 @@
+import logging
+import threading
+import time
+import unittest
+import librato
+from librato.cache import LRUCache, MetadataCache, SingleFlight
+from librato.testing import FakeLibratoServer
+from mock_connection import MockConnect, server
+
+# logging.basicConfig(level=logging.DEBUG)
+# Mock the server
+librato.HTTPSConnection = MockConnect
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        c = LRUCache(max_size=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        assert c.get('a') == 1
+        c.set('c', 3)
+
+        assert 'b' not in c
+        assert c.get('a') == 1
+        assert c.get('c') == 3
+        assert c.evictions == 1
+
+    def test_expiry(self):
+        clock = FakeClock()
+        c = LRUCache(clock=clock)
+        c.set('a', 1, ttl=10)
+        assert c.get('a') == 1
+        clock.now += 10
+        assert c.get('a') is None
+        assert c.expirations == 1
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = MetadataCache(ttls={'space': 5}, clock=self.clock)
+        self.calls = 0
+
+    def load(self):
+        self.calls += 1
+        return self.calls
+
+    def test_hit_and_miss(self):
+        assert self.cache.get_or_load('space', ('id', 1), self.load) == 1
+        assert self.cache.get_or_load('space', ('id', 1), self.load) == 1
+        assert self.calls == 1
+
+        stats = self.cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_ratio'] == 0.5
+        assert stats['size'] == 1
+
+    def test_per_entity_ttl(self):
+        self.cache.get_or_load('space', ('id', 1), self.load)
+        self.cache.get_or_load('metric', ('cpu',), self.load)
+        self.clock.now += 6
+
+        self.cache.get_or_load('space', ('id', 1), self.load)
+        self.cache.get_or_load('metric', ('cpu',), self.load)
+        assert self.calls == 3
+
+    def test_caches_none(self):
+        self.cache.get_or_load('alert', ('missing',), lambda: None)
+        assert self.cache.get_or_load('alert', ('missing',), self.load) is None
+        assert self.calls == 0
+
+    def test_invalidate_by_prefix(self):
+        self.cache.get_or_load('chart', (1, 'list'), self.load)
+        self.cache.get_or_load('chart', (2, 'list'), self.load)
+        self.cache.invalidate('chart', 1)
+
+        assert len(self.cache) == 1
+        assert self.cache.stats()['invalidations'] == 1
+
+
+class TestConnectionMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+        self.conn.enable_metadata_cache()
+        self.requests = []
+        mexe = self.conn._mexe
+
+        def counting_mexe(path, method="GET", **kwargs):
+            self.requests.append((method, path))
+            return mexe(path, method=method, **kwargs)
+        self.conn._mexe = counting_mexe
+
+    def test_disabled_by_default(self):
+        assert librato.connect('user_test', 'key_test').metadata_cache is None
+
+    def test_get_space_is_cached(self):
+        space = self.conn.create_space('My Space')
+        self.requests = []
+
+        assert self.conn.get_space(space.id).name == 'My Space'
+        assert self.conn.get_space(space.id).name == 'My Space'
+        assert len(self.requests) == 1
+
+    def test_update_space_invalidates(self):
+        space = self.conn.create_space('My Space')
+        self.conn.get_space(space.id)
+        space.name = 'Renamed'
+        self.conn.update_space(space)
+
+        assert self.conn.get_space(space.id).name == 'Renamed'
+
+    def test_find_space_is_cached(self):
+        self.conn.create_space('My Space')
+        self.requests = []
+
+        assert self.conn.find_space('My Space') is not None
+        assert self.conn.find_space('my space') is not None
+        # One listing and one get_space
+        assert len(self.requests) == 2
+
+    def test_create_space_invalidates_negative_lookups(self):
+        assert self.conn.find_space('My Space') is None
+        self.conn.create_space('My Space')
+        assert self.conn.find_space('My Space') is not None
+
+    def test_charts_are_cached_per_space(self):
+        space = self.conn.create_space('My Space')
+        self.conn.create_chart('CPU', space)
+        self.requests = []
+
+        assert len(self.conn.list_charts_in_space(space)) == 1
+        assert self.conn.find_chart('cpu', space).name == 'CPU'
+        assert self.conn.find_chart('cpu', space).name == 'CPU'
+        assert self.requests == [('GET', 'spaces/%s/charts' % space.id),
+                                 ('GET', 'spaces/%s/charts/%s' % (space.id, 0))]
+
+        self.conn.create_chart('Memory', space)
+        assert len(self.conn.list_charts_in_space(space)) == 2
+
+    def test_alerts_are_cached(self):
+        self.conn.create_alert('my_alert')
+        self.requests = []
+        assert self.conn.get_alert('my_alert')._id == 1
+        assert self.conn.get_alert('my_alert')._id == 1
+        assert len(self.requests) == 1
+
+        self.conn.delete_alert('my_alert')
+        assert self.conn.get_alert('my_alert') is None
+
+    def test_metric_get_and_delete(self):
+        self.conn.submit('cpu', 10)
+        assert self.conn.get('cpu').name == 'cpu'
+        self.requests = []
+        self.conn.get('cpu')
+        assert self.requests == []
+
+        self.conn.delete('cpu')
+        self.conn.submit('cpu', 20)
+        self.requests = []
+        self.conn.get('cpu')
+        assert self.requests == [('GET', 'metrics/cpu')]
+
+
+def run_concurrently(n, fn):
+    start = threading.Event()
+    results = [None] * n
+
+    def call(i):
+        start.wait()
+        try:
+            results[i] = fn()
+        except BaseException as e:
+            results[i] = e
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    start.set()
+    for t in threads:
+        t.join()
+    return results
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.1)
+            return len(calls)
+
+        assert run_concurrently(8, lambda: flight.do('k', slow)) == [1] * 8
+        assert calls == [1]
+        stats = flight.stats()
+        assert stats['executed'] == 1
+        assert stats['coalesced'] == 7
+        assert stats['coalescing_ratio'] == 7 / 8.0
+        assert stats['in_flight'] == 0
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight()
+
+        def failing():
+            time.sleep(0.1)
+            raise ValueError("boom")
+
+        results = run_concurrently(4, lambda: flight.do('k', failing))
+        assert all(isinstance(r, ValueError) for r in results)
+        assert flight.stats()['executed'] == 1
+
+    def test_interrupted_leader_lets_waiters_retry(self):
+        flight = SingleFlight()
+        calls = []
+
+        def interrupted_once():
+            calls.append(1)
+            time.sleep(0.1)
+            if len(calls) == 1:
+                raise KeyboardInterrupt()
+            return 'ok'
+
+        results = run_concurrently(4, lambda: flight.do('k', interrupted_once))
+        assert sum(isinstance(r, KeyboardInterrupt) for r in results) == 1
+        assert results.count('ok') == 3
+        assert len(calls) == 2
+        assert flight.stats()['in_flight'] == 0
+
+    def test_sequential_calls_are_not_coalesced(self):
+        flight = SingleFlight()
+        assert flight.do('k', lambda: 1) == 1
+        assert flight.do('k', lambda: 2) == 2
+
+
+class TestRequestCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeLibratoServer(latency=0.1).start()
+        self.conn = self.server.connect()
+        self.conn.submit_tagged('cpu', 1, tags={'host': 'a'})
+        self.server.reset()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_identical_gets_are_coalesced(self):
+        flight = self.conn.enable_request_coalescing()
+        results = run_concurrently(10, lambda: self.conn.get_tagged('cpu', duration=60, tags={'host': 'a'}))
+
+        assert all(r is results[0] for r in results)
+        assert self.server.stats()['requests'] == 1
+        assert flight.stats()['coalesced'] == 9
+
+    def test_different_gets_are_not(self):
+        self.conn.enable_request_coalescing()
+        run_concurrently(2, lambda: self.conn.get_tagged('cpu', duration=60))
+        run_concurrently(1, lambda: self.conn.get_tagged('cpu', duration=120))
+        assert self.server.stats()['requests'] == 2
+
+    def test_disabled_by_default(self):
+        run_concurrently(3, lambda: self.conn.get_tagged('cpu', duration=60))
+        assert self.server.stats()['requests'] == 3
+
+if __name__ == '__main__':
+    unittest.main()
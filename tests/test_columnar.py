@@ -0,0 +1,93 @@
+import logging
+import math
+import unittest
+from array import array
+import time
+import librato
+from librato.columnar import ColumnarDecoder
+from mock_connection import MockConnect, server
+
+# logging.basicConfig(level=logging.DEBUG)
+# Mock the server
+librato.HTTPSConnection = MockConnect
+
+
+class TestColumnarDecoder(unittest.TestCase):
+    def test_points_become_columns(self):
+        body = '{"series": [{"tags": {"host": "a"}, "measurements": [' \
+               '{"time": 1, "value": 2.5}, {"time": 2, "value": 3.5}]}], "resolution": 1}'
+        resp = ColumnarDecoder('array')(body)
+
+        series = resp['series'][0]
+        assert series['tags'] == {'host': 'a'}
+        assert resp['resolution'] == 1
+        assert series['measurements']['time'] == array('d', [1, 2])
+        assert series['measurements']['value'] == array('d', [2.5, 3.5])
+
+    def test_other_objects_are_untouched(self):
+        body = '{"attributes": {"min": 1, "max": 2}, "series": []}'
+        resp = ColumnarDecoder('array')(body)
+        assert resp == {'attributes': {'min': 1, 'max': 2}, 'series': []}
+
+    def test_heterogeneous_points_are_padded(self):
+        body = '{"series": [{"measurements": [' \
+               '{"time": 1, "value": 2}, {"time": 2, "value": 3, "count": 4}, {"time": 3, "value": null}]}]}'
+        cols = ColumnarDecoder('array')(body)['series'][0]['measurements']
+
+        assert list(cols['time']) == [1, 2, 3]
+        assert math.isnan(cols['count'][0])
+        assert cols['count'][1] == 4
+        assert math.isnan(cols['count'][2])
+        assert math.isnan(cols['value'][2])
+
+    def test_legacy_measure_time(self):
+        body = '{"measurements": [{"series": [{"measure_time": 10, "value": 1}]}]}'
+        cols = ColumnarDecoder('array')(body)['measurements'][0]['series']
+        assert list(cols['measure_time']) == [10]
+
+    def test_mixed_lists_are_left_as_lists(self):
+        body = '{"items": [{"time": 1, "value": 2}, {"name": "x"}]}'
+        resp = ColumnarDecoder('array')(body)
+        assert resp == {'items': [{'time': 1, 'value': 2}, {'name': 'x'}]}
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            ColumnarDecoder('matrix')
+
+
+class TestColumnarQueries(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+
+    def test_get_tagged_as_arrays(self):
+        mt = int(time.time()) - 5
+        self.conn.submit_tagged('user_cpu', 20.2, time=mt, tags={'hostname': 'web-1'})
+        self.conn.submit_tagged('user_cpu', 30.5, time=mt + 1, tags={'hostname': 'web-1'})
+
+        resp = self.conn.get_tagged('user_cpu', duration=60, tags={'hostname': 'web-1'}, as_arrays='array')
+
+        assert len(resp['series']) == 1
+        assert resp['series'][0]['tags'] == {'hostname': 'web-1'}
+        cols = resp['series'][0]['measurements']
+        assert list(cols['time']) == [mt, mt + 1]
+        assert list(cols['value']) == [20.2, 30.5]
+
+    def test_get_tagged_default_is_unchanged(self):
+        mt = int(time.time()) - 5
+        self.conn.submit_tagged('user_cpu', 20.2, time=mt, tags={'hostname': 'web-1'})
+
+        resp = self.conn.get_tagged('user_cpu', duration=60, tags={'hostname': 'web-1'})
+        assert resp['series'][0]['measurements'] == [{'time': mt, 'value': 20.2}]
+
+    def test_get_tagged_best_available_format(self):
+        mt = int(time.time()) - 5
+        self.conn.submit_tagged('user_cpu', 20.2, time=mt, tags={'hostname': 'web-1'})
+
+        resp = self.conn.get_tagged('user_cpu', duration=60, tags={'hostname': 'web-1'}, as_arrays=True)
+        values = resp['series'][0]['measurements']['value']
+        assert len(values) == 1
+        assert values[0] == 20.2
+
+if __name__ == '__main__':
+    unittest.main()
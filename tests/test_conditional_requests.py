@@ -0,0 +1,117 @@
+import json
+import logging
+import unittest
+import librato
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class FakeResponse(object):
+    def __init__(self, status, body=b'', headers=None):
+        self.status = status
+        self._body = body
+        self._headers = {'content-type': 'application/json;charset=utf-8'}
+        self._headers.update(headers or {})
+
+    class headers(object):
+        @staticmethod
+        def get_content_charset(default):
+            return 'utf-8'
+
+    def getheader(self, name, default=None):
+        return self._headers.get(name.lower(), default)
+
+    def read(self):
+        return self._body
+
+
+class ETagServer(object):
+    """Serves a single document with an ETag, honouring If-None-Match"""
+    def __init__(self):
+        self.version = 1
+        self.requests = []
+
+    def respond(self, uri, headers):
+        self.requests.append((uri, dict(headers)))
+        etag = '"v%d"' % self.version
+        if headers.get('If-None-Match') == etag:
+            return FakeResponse(304)
+        body = json.dumps({'id': 1, 'name': 'space v%d' % self.version}).encode('utf-8')
+        return FakeResponse(200, body, {'etag': etag})
+
+
+etag_server = ETagServer()
+
+
+class ETagConnect(object):
+    def __init__(self, hostname, fake_n_errors=0, timeout=10):
+        pass
+
+    def request(self, method, uri, body, headers):
+        self.uri = uri
+        self.headers = headers
+
+    def getresponse(self):
+        return etag_server.respond(self.uri, self.headers)
+
+    def close(self):
+        pass
+
+
+class TestConditionalRequests(unittest.TestCase):
+    def setUp(self):
+        self.saved = librato.HTTPSConnection
+        librato.HTTPSConnection = ETagConnect
+        etag_server.__init__()
+        self.conn = librato.connect('user_test', 'key_test')
+        self.conn.enable_conditional_requests()
+
+    def tearDown(self):
+        librato.HTTPSConnection = self.saved
+
+    def test_revalidates_with_etag(self):
+        first = self.conn._mexe('spaces/1')
+        second = self.conn._mexe('spaces/1')
+
+        assert first == {'id': 1, 'name': 'space v1'}
+        assert second is first
+        assert 'If-None-Match' not in etag_server.requests[0][1]
+        assert etag_server.requests[1][1]['If-None-Match'] == '"v1"'
+        assert self.conn.validator_cache.stats()['not_modified'] == 1
+
+    def test_changed_document_is_fetched(self):
+        self.conn._mexe('spaces/1')
+        etag_server.version = 2
+        assert self.conn._mexe('spaces/1')['name'] == 'space v2'
+        assert self.conn._mexe('spaces/1')['name'] == 'space v2'
+        assert self.conn.validator_cache.stats()['not_modified'] == 1
+
+    def test_get_space(self):
+        assert self.conn.get_space(1).name == 'space v1'
+        assert self.conn.get_space(1).name == 'space v1'
+        assert self.conn.validator_cache.not_modified == 1
+
+    def test_query_params_are_canonical(self):
+        self.conn._mexe('spaces/1', query_props={'a': 1, 'b': 2})
+        self.conn._mexe('spaces/1', query_props={'b': 2, 'a': 1})
+        assert self.conn.validator_cache.not_modified == 1
+
+    def test_other_methods_are_not_conditional(self):
+        self.conn._mexe('spaces/1')
+        self.conn._mexe('spaces/1', method="PUT", query_props={'name': 'x'})
+        assert 'If-None-Match' not in etag_server.requests[1][1]
+
+    def test_custom_headers_bypass_the_cache(self):
+        self.conn._mexe('spaces/1')
+        self.conn._mexe('spaces/1', p_headers={'If-None-Match': '"v0"'})
+        assert etag_server.requests[1][1]['If-None-Match'] == '"v0"'
+        assert self.conn.validator_cache.stats()['not_modified'] == 0
+
+    def test_disabled_by_default(self):
+        conn = librato.connect('user_test', 'key_test')
+        conn._mexe('spaces/1')
+        conn._mexe('spaces/1')
+        assert 'If-None-Match' not in etag_server.requests[1][1]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import gc
+import json
+import logging
+import os
+import time
+import unittest
+import weakref
+import librato
+from librato import forksafe
+from librato.aggregator import Aggregator
+from librato.instrumentation import SelfMetrics
+from librato.testing import FakeLibratoServer
+from librato.transport import Urllib3Transport
+from mock_connection import MockConnect, server
+
+# logging.basicConfig(level=logging.DEBUG)
+# Mock the server
+librato.HTTPSConnection = MockConnect
+
+
+def installed(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+class TestForkPolicies(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+
+    def test_queue_reset(self):
+        q = self.conn.new_queue()
+        q.add('cpu', 1)
+        q.add_tagged('cpu', 2, tags={'host': 'a'})
+        q._after_fork()
+        assert q.chunks == []
+        assert q.tagged_chunks == []
+        assert q._num_measurements_in_queue() == 0
+
+    def test_queue_keep(self):
+        q = self.conn.new_queue(fork_policy='keep')
+        q.add('cpu', 1)
+        q._after_fork()
+        assert q._num_measurements_in_queue() == 1
+
+    def test_queue_flush(self):
+        q = self.conn.new_queue(fork_policy='flush')
+        q.add('cpu', 1)
+        q._before_fork()
+        assert q._num_measurements_in_queue() == 0
+        assert len(self.conn.list_metrics()) == 1
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.conn.new_queue(fork_policy='share')
+
+    def test_aggregator(self):
+        a = Aggregator(self.conn, measure_time=100)
+        a.add('cpu', 1)
+        a.add_tagged('cpu', 1)
+        a._after_fork()
+        assert a.measurements == {}
+        assert a.tagged_measurements == {}
+        assert a.measure_time == 100
+
+        a = Aggregator(self.conn, fork_policy='flush')
+        a.add('cpu', 1)
+        a._before_fork()
+        assert a.measurements == {}
+        assert len(self.conn.list_metrics()) == 1
+
+    def test_annotation_queue(self):
+        q = self.conn.new_annotation_queue()
+        q.add('deploys', 'v1')
+        q._after_fork()
+        assert len(q) == 0
+
+    def test_connection(self):
+        self.conn.enable_metadata_cache()
+        flight = self.conn.enable_request_coalescing()
+        self.conn._after_fork()
+        assert self.conn.single_flight is not flight
+        assert self.conn.metadata_cache is not None
+
+    @unittest.skipUnless(installed('urllib3'), "urllib3 is not installed")
+    def test_urllib3_pool_is_replaced(self):
+        transport = Urllib3Transport(maxsize=3)
+        pool = transport.pool
+        transport._after_fork()
+        assert transport.pool is not pool
+        assert transport.pool.connection_pool_kw['maxsize'] == 3
+
+    def test_registry_is_weak(self):
+        q = self.conn.new_queue()
+        ref = weakref.ref(q)
+        assert q in forksafe._registry
+        del q
+        gc.collect()
+        assert ref() is None
+
+
+class TestBackgroundThreads(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeLibratoServer().start()
+        self.conn = self.server.connect()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_annotation_workers_restart(self):
+        q = self.conn.new_annotation_queue(background=True, max_workers=2)
+        q.add('deploys', 'v1')
+        q.flush()
+        q._after_fork()
+        assert q._threads == []
+        q.add('deploys', 'v2')
+        q.flush()
+        assert len(q._threads) == 2
+        assert q.posted == 1
+        q.close()
+
+    def test_self_metrics_thread_restarts(self):
+        metrics = SelfMetrics(self.conn).install()
+        metrics.start(interval=60)
+        metrics._after_fork()
+        assert metrics._thread is None
+        self.conn.list_metrics()
+        assert metrics._thread is not None
+        assert metrics.snapshot()['requests'] == 1
+        metrics.stop(flush=False)
+        self.conn.list_metrics()
+        assert metrics._thread is None
+
+
+@unittest.skipUnless(hasattr(os, 'register_at_fork'), "needs os.register_at_fork")
+class TestFork(unittest.TestCase):
+    def fork(self, child):
+        """Run child() in a forked process, returns what it returned"""
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(r)
+                os.write(w, json.dumps(child()).encode('utf-8'))
+            finally:
+                os._exit(0)
+        os.close(w)
+        with os.fdopen(r) as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        return json.loads(data)
+
+    def test_child_starts_empty(self):
+        conn = librato.connect('user_test', 'key_test')
+        q = conn.new_queue()
+        kept = conn.new_queue(fork_policy='keep')
+        for i in range(3):
+            q.add_tagged('cpu', i, tags={'host': 'a'})
+            kept.add_tagged('cpu', i, tags={'host': 'a'})
+
+        seen = self.fork(lambda: [q._num_measurements_in_queue(), kept._num_measurements_in_queue()])
+        assert seen == [0, 3]
+        assert q._num_measurements_in_queue() == 3
+
+    def test_parent_flushes(self):
+        fake = FakeLibratoServer().start()
+        try:
+            q = fake.connect().new_queue(fork_policy='flush')
+            q.add_tagged('cpu', 1, time=int(time.time()), tags={'host': 'a'})
+            assert self.fork(lambda: q._num_measurements_in_queue()) == 0
+            assert fake.stats()['measurements'] == 1
+        finally:
+            fake.stop()
+
+if __name__ == '__main__':
+    unittest.main()
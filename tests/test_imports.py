@@ -0,0 +1,58 @@
+import logging
+import os
+import subprocess
+import sys
+import unittest
+import six
+import librato
+
+# logging.basicConfig(level=logging.DEBUG)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(librato.__file__)))
+
+
+def run_python(script):
+    # Without site, so nothing imported by .pth files hides a missing import
+    path = [ROOT, os.path.dirname(os.path.abspath(six.__file__))]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path))
+    return subprocess.check_output([sys.executable, '-S', '-c', script], env=env).decode('utf-8').split()
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "module __getattr__ needs python 3.7")
+class TestLazyImports(unittest.TestCase):
+    def test_import_is_light(self):
+        loaded = run_python("import sys, librato; print(' '.join(sys.modules))")
+        for module in ['librato.metrics', 'librato.queue', 'librato.spaces', 'librato.streaming',
+                       'platform', 'base64', 'email.message', 'http.client']:
+            assert module not in loaded, module
+
+    def test_usable_without_site(self):
+        output = run_python("import librato; print(librato.connect('u', 'k')._url_encode_params({'a': 1}))")
+        assert output == ['a=1']
+
+    def test_attribute_loads_module(self):
+        loaded = run_python("import sys, librato; librato.Gauge; print(' '.join(sys.modules))")
+        assert 'librato.metrics' in loaded
+        assert 'librato.spaces' not in loaded
+
+    def test_from_import(self):
+        from librato import Gauge, Queue, Space
+        from librato.metrics import Gauge as MetricsGauge
+        assert Gauge is MetricsGauge
+        assert Queue.__module__ == 'librato.queue'
+        assert Space.__module__ == 'librato.spaces'
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            librato.NoSuchThing
+
+    def test_dir(self):
+        assert 'Gauge' in dir(librato)
+        assert 'connect' in dir(librato)
+
+    def test_user_agent_is_probed_once(self):
+        conn = librato.connect('user_test', 'key_test')
+        assert conn._compute_ua() is librato._default_user_agent()
+        assert librato._default_user_agent().startswith('python-librato/' + librato.__version__)
+
+if __name__ == '__main__':
+    unittest.main()
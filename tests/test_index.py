@@ -0,0 +1,92 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import librato
+from librato.index import MetricIndex
+from librato.testing import FakeLibratoServer
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class TestMetricIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer(page_size=4).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.conn = self.server.connect()
+        self.conn.submit('app.requests', 1, type='counter')
+        for name in ['app.latency.p50', 'app.latency.p99', 'db.latency.p99', 'db.connections', 'cpu']:
+            self.conn.submit(name, 1)
+        self.conn.update('app.latency.p99', attributes={'display_units_short': 'ms'}, period=60)
+        self.index = MetricIndex.build(self.conn)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_build(self):
+        assert len(self.index) == 6
+        assert 'cpu' in self.index
+        assert self.index.age() < 60
+        # Paged through the API once
+        assert self.server.stats()['by_endpoint']['GET /v1/metrics'] == 2
+
+    def test_prefix(self):
+        assert self.index.search(prefix='app.') == ['app.latency.p50', 'app.latency.p99', 'app.requests']
+        assert self.index.search(prefix='nothing') == []
+
+    def test_glob(self):
+        assert self.index.search(glob='*.latency.p99') == ['app.latency.p99', 'db.latency.p99']
+        assert self.index.search(glob='app.latency.p?0') == ['app.latency.p50']
+        assert self.index.search(glob='app.*', prefix='app.l') == ['app.latency.p50', 'app.latency.p99']
+
+    def test_regex(self):
+        assert self.index.search(regex=r'^db\.') == ['db.connections', 'db.latency.p99']
+        assert self.index.search(regex=r'p\d9$') == ['app.latency.p99', 'db.latency.p99']
+
+    def test_filters(self):
+        assert self.index.search(type='counter') == ['app.requests']
+        assert self.index.search(period=60) == ['app.latency.p99']
+        assert self.index.search(attributes={'display_units_short': 'ms'}) == ['app.latency.p99']
+        assert self.index.search(prefix='db', attributes={'display_units_short': 'ms'}) == []
+
+    def test_metrics(self):
+        metric = self.index.get('app.latency.p99')
+        assert isinstance(metric, librato.metrics.Gauge)
+        assert metric.period == 60
+        assert metric.attributes == {'display_units_short': 'ms'}
+        assert self.index.get('nothing') is None
+        assert [m.name for m in self.index.metrics(type='counter')] == ['app.requests']
+
+    def test_snapshot(self):
+        path = os.path.join(self.tmp, 'metrics.json.gz')
+        self.index.save(path)
+        loaded = MetricIndex.load(path, self.conn)
+
+        assert list(loaded) == list(self.index)
+        assert loaded.built_at == self.index.built_at
+        assert loaded.search(attributes={'display_units_short': 'ms'}) == ['app.latency.p99']
+
+    def test_partial_refresh(self):
+        self.conn.delete('db.connections')
+        self.conn.submit('db.queries', 1)
+        self.conn.submit('app.errors', 1)
+        self.index.refresh(name='db.')
+
+        assert self.index.search(prefix='db.') == ['db.latency.p99', 'db.queries']
+        # Only the db. metrics were looked at
+        assert 'app.errors' not in self.index
+
+        self.index.refresh()
+        assert 'app.errors' in self.index
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import logging
+import unittest
+import librato
+from librato.instrumentation import RequestInfo, SelfMetrics, count_measurements
+from librato.testing import FakeLibratoServer
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class TestHooks(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.conn = self.server.connect()
+        self.conn.backoff_logic = lambda backoff: 0.01
+        self.events = []
+        for event in ('before_request', 'after_response', 'on_retry', 'on_error'):
+            self.conn.add_hook(event, self.recorder(event))
+
+    def recorder(self, event):
+        def record(info):
+            self.events.append((event, info.status, info.retries))
+        return record
+
+    def test_successful_request(self):
+        infos = []
+        self.conn.add_hook('after_response', infos.append)
+        q = self.conn.new_queue()
+        q.add_tagged('cpu', 1, tags={'host': 'a'})
+        q.add_tagged('cpu', 2, tags={'host': 'b'})
+        q.submit()
+
+        assert self.events == [('before_request', None, 0), ('after_response', 202, 0)]
+        info = infos[0]
+        assert info.method == 'POST'
+        assert info.path == 'measurements'
+        assert info.uri == '/v1/measurements'
+        assert info.measurements == 2
+        assert info.request_bytes > 0
+        assert info.elapsed >= 0
+
+    def test_retries(self):
+        self.server.inject(503, count=2)
+        self.conn.submit('cpu', 1)
+        assert self.events == [('before_request', None, 0), ('on_retry', 503, 1),
+                               ('on_retry', 503, 2), ('after_response', 200, 2)]
+
+    def test_errors(self):
+        errors = []
+        self.conn.add_hook('on_error', errors.append)
+        with self.assertRaises(librato.exceptions.NotFound):
+            self.conn.get_space(42)
+        assert self.events == [('before_request', None, 0), ('on_error', 404, 0)]
+        assert isinstance(errors[0].error, librato.exceptions.NotFound)
+        assert errors[0].response_bytes > 0
+
+    def test_failing_hook_does_not_break_requests(self):
+        def broken(info):
+            raise RuntimeError("boom")
+        self.conn.add_hook('before_request', broken)
+        self.conn.list_metrics()
+        assert self.events[-1][0] == 'after_response'
+
+    def test_remove_hook(self):
+        conn = self.server.connect()
+        calls = []
+        conn.add_hook('after_response', calls.append)
+        conn.remove_hook('after_response', calls.append)
+        conn.list_metrics()
+        assert calls == []
+
+    def test_unknown_event(self):
+        with self.assertRaises(ValueError):
+            self.conn.add_hook('on_everything', lambda info: None)
+
+
+class TestSelfMetrics(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeLibratoServer().start()
+        self.conn = self.server.connect()
+        self.conn.backoff_logic = lambda backoff: 0.01
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_counts_requests(self):
+        metrics = SelfMetrics(self.conn).install()
+        self.server.inject(503)
+        self.conn.submit('cpu', 1)
+        with self.assertRaises(librato.exceptions.NotFound):
+            self.conn.get_space(42)
+
+        snap = metrics.snapshot()
+        assert snap['requests'] == 2
+        assert snap['errors'] == 1
+        assert snap['retries'] == 1
+        assert snap['measurements'] == 1
+        assert snap['error_rate'] == 0.5
+        assert snap['by_status'] == {'2xx': 1, '4xx': 1}
+        assert snap['latency']['count'] == 2
+
+    def test_report(self):
+        metrics = SelfMetrics(self.conn, prefix='client').install()
+        self.conn.list_metrics()
+        metrics.uninstall()
+        metrics.flush()
+
+        stored = self.server.store.measurements
+        assert set(['client.requests', 'client.latency', 'client.latency.bucket',
+                    'client.error_rate', 'client.responses']) <= set(stored)
+        assert stored['client.requests'][0][1] == 1
+        assert {'client': 'python-librato', 'le': '+Inf'} in [tags for _, _, tags in stored['client.latency.bucket']]
+        # Counters start over after a report
+        assert metrics.snapshot()['requests'] == 0
+
+    def test_reports_do_not_count_themselves(self):
+        metrics = SelfMetrics(self.conn).install()
+        self.conn.list_metrics()
+        metrics.flush()
+        assert self.server.stats()['by_endpoint']['POST /v1/measurements'] == 1
+        snap = metrics.snapshot()
+        assert snap['requests'] == 0
+        assert snap['bytes_sent'] == 0
+        assert snap['latency']['count'] == 0
+
+    def test_histogram_buckets(self):
+        metrics = SelfMetrics(self.conn, buckets=(10, 100))
+        for elapsed in (0.005, 0.05, 0.5):
+            info = RequestInfo('GET', 'metrics')
+            info.elapsed = elapsed
+            metrics.after_response(info)
+        latency = metrics.snapshot()['latency']
+        assert latency['buckets'] == [(10, 1), (100, 1), (None, 1)]
+        assert latency['min'] == 5.0
+        assert latency['max'] == 500.0
+
+    def test_background_reporting(self):
+        metrics = SelfMetrics(self.conn).install().start(interval=0.01)
+        self.conn.list_metrics()
+        metrics.stop()
+        assert self.server.stats()['by_endpoint'].get('POST /v1/measurements', 0) >= 1
+
+
+class TestCountMeasurements(unittest.TestCase):
+    def test_payloads(self):
+        assert count_measurements(None) == 0
+        assert count_measurements({'measurements': [{}, {}]}) == 2
+        assert count_measurements({'gauges': [{}], 'counters': [{}]}) == 2
+        assert count_measurements({'name': 'cpu'}) == 0
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import logging
+import unittest
+import librato
+from mock_connection import MockConnect, server
+
+# logging.basicConfig(level=logging.DEBUG)
+# Mock the server
+librato.HTTPSConnection = MockConnect
+
+
+class CapturingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def messages(self, name=None):
+        return [r.getMessage() for r in self.records if name is None or r.name == name]
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+        self.handler = CapturingHandler()
+        self.logger = logging.getLogger('librato')
+        self.saved_level = self.logger.level
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.saved_level)
+
+    def test_bodies_are_not_logged_at_info(self):
+        self.logger.setLevel(logging.INFO)
+        self.conn.submit('cpu', 10)
+        assert self.handler.messages('librato.body') == []
+        assert 'method=POST uri=/v1/metrics' in self.handler.messages('librato')
+
+    def test_bodies_are_logged_at_debug(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.conn.submit('cpu', 10)
+        sent = [m for m in self.handler.messages('librato.body') if m.startswith('body(->)')]
+        assert len(sent) == 1
+        assert '"name": "cpu"' in sent[0]
+
+    def test_large_bodies_are_truncated(self):
+        self.logger.setLevel(logging.DEBUG)
+        librato._log_body('->', 'x' * (librato.LOG_BODY_LIMIT + 10))
+        message = self.handler.messages('librato.body')[0]
+        assert message.endswith('... (%d bytes, truncated)' % (librato.LOG_BODY_LIMIT + 10))
+        assert len(message) < librato.LOG_BODY_LIMIT + 50
+
+    def test_authorization_is_redacted(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.conn.list_metrics()
+        headers = [m for m in self.handler.messages('librato') if m.startswith('headers(->)')]
+        assert len(headers) == 1
+        assert '<redacted>' in headers[0]
+        assert 'Basic' not in headers[0]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,7 +35,7 @@ class TestLibrato(unittest.TestCase):
         assert len(metrics) == 0
 
     def test_list_all_metrics(self):
-        def mock_list(entity, query_props=None):
+        def mock_list(entity, query_props=None, decoder=None):
             length = query_props['length']
             offset = query_props['offset']
             # I don't care what the metrics are
@@ -61,6 +61,34 @@ class TestLibrato(unittest.TestCase):
             assert len(metrics) == 12
             assert list_prop.call_count == 3
 
+    def test_lazy_metrics(self):
+        metric = librato.metrics.Metric.from_dict(self.conn, fake_metric, lazy=True)
+        assert isinstance(metric, librato.metrics.Gauge)
+        assert metric.name == '3333'
+        # Fields missing from the response are only created when read
+        with self.assertRaises(AttributeError):
+            object.__getattribute__(metric, 'measurements')
+        assert metric.measurements == {}
+        assert metric.composite is None
+
+        assert metric.period == 60
+        assert metric.description == 'a description'
+        assert metric.source_lag == 60
+        assert metric['created_by_ua'] == 'fake'
+        with self.assertRaises(AttributeError):
+            metric.nothing
+
+    def test_list_lazy_metrics(self):
+        self.conn.submit('gauge_1', 1, description='desc 1')
+        metrics = self.conn.list_metrics(lazy=True)
+        assert metrics[0].description == 'desc 1'
+        assert [m.description for m in self.conn.list_all_metrics(lazy=True)] == ['desc 1']
+
+    def test_metrics_have_no_dict(self):
+        metric = librato.metrics.Metric.from_dict(self.conn, fake_metric)
+        assert not hasattr(metric, '__dict__')
+        assert metric.source_lag == 60
+
     def test_list_metrics_adding_gauge(self):
         """ Notice that the api forces you to send a value even when you are
             just trying to create the metric without measurements."""
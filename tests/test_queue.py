@@ -1,7 +1,9 @@
+import json
 import logging
 import unittest
 import librato
 from librato.aggregator import Aggregator
+from librato.testing import FakeLibratoServer
 from mock_connection import MockConnect, server
 from random import randint
 import time
@@ -399,5 +401,360 @@ class TestLibratoQueue(unittest.TestCase):
         assert measurements[0]['time'] == mt1
         assert measurements[0]['value'] == 3.2
 
+
+class TestQueueCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+
+    def test_disabled_by_default(self):
+        q = self.conn.new_queue()
+        q.add('cpu', 1, measure_time=100)
+        q.add('cpu', 2, measure_time=100)
+        assert len(q.chunks[0]['gauges']) == 2
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.conn.new_queue(coalesce='avg')
+
+    def test_last_value_wins(self):
+        q = self.conn.new_queue(coalesce='last')
+        q.add('cpu', 1, measure_time=100)
+        q.add('cpu', 2, measure_time=100)
+        q.add('cpu', 3, measure_time=101)
+        q.add('cpu', 4, measure_time=100, source='web')
+        assert q.chunks[0]['gauges'] == [
+            {'name': 'cpu', 'value': 2, 'measure_time': 100},
+            {'name': 'cpu', 'value': 3, 'measure_time': 101},
+            {'name': 'cpu', 'value': 4, 'measure_time': 100, 'source': 'web'}]
+
+    def test_tagged_series_identity(self):
+        q = self.conn.new_queue(coalesce='last')
+        q.add_tagged('cpu', 1, time=100, tags={'host': 'a', 'region': 'x'})
+        q.add_tagged('cpu', 2, time=100, tags={'region': 'x', 'host': 'a'})
+        q.add_tagged('cpu', 3, time=100, tags={'host': 'b'})
+        measurements = q.tagged_chunks[0]['measurements']
+        assert [m['sum'] for m in measurements] == [2, 3]
+        assert q._num_measurements_in_queue() == 2
+
+    def test_sum(self):
+        q = self.conn.new_queue(coalesce='sum')
+        q.add('requests', 1, measure_time=100)
+        q.add('requests', 2, measure_time=100)
+        q.add_tagged('requests', 3, time=100, tags={'host': 'a'})
+        q.add_tagged('requests', 4, time=100, tags={'host': 'a'})
+        assert q.chunks[0]['gauges'] == [{'name': 'requests', 'value': 3, 'measure_time': 100}]
+        assert q.tagged_chunks[0]['measurements'] == [
+            {'name': 'requests', 'sum': 7, 'count': 1, 'time': 100, 'tags': {'host': 'a'}}]
+
+    def test_merge(self):
+        q = self.conn.new_queue(coalesce='merge')
+        q.add('latency', 5, measure_time=100)
+        q.add('latency', 1, measure_time=100)
+        q.add('latency', 9, measure_time=100)
+        assert q.chunks[0]['gauges'] == [
+            {'name': 'latency', 'measure_time': 100, 'count': 3, 'sum': 15, 'min': 1, 'max': 9}]
+
+        q.add_tagged('latency', 5, time=100, tags={'host': 'a'})
+        q.add_tagged('latency', 2, time=100, tags={'host': 'a'})
+        m = q.tagged_chunks[0]['measurements'][0]
+        assert (m['count'], m['sum'], m['min'], m['max']) == (2, 7, 2, 5)
+
+    def test_merge_summaries(self):
+        q = self.conn.new_queue(coalesce='merge')
+        q.add('latency', None, measure_time=100, count=2, sum=10, min=4, max=6)
+        q.add('latency', 3, measure_time=100)
+        m = q.chunks[0]['gauges'][0]
+        assert (m['count'], m['sum'], m['min'], m['max']) == (3, 13, 3, 6)
+        assert 'value' not in m
+
+    def test_counters_keep_last_value(self):
+        q = self.conn.new_queue(coalesce='sum')
+        q.add('hits', 10, type='counter', measure_time=100)
+        q.add('hits', 12, type='counter', measure_time=100)
+        assert q.chunks[0]['counters'] == [{'name': 'hits', 'value': 12, 'measure_time': 100}]
+
+    def test_aggregator(self):
+        q = self.conn.new_queue(coalesce='merge')
+        for values in ([1, 2], [3]):
+            a = Aggregator(self.conn, measure_time=100)
+            for v in values:
+                a.add('latency', v)
+            q.add_aggregator(a)
+        m = q.chunks[0]['gauges'][0]
+        assert (m['count'], m['sum'], m['min'], m['max']) == (3, 6, 1, 3)
+
+    def test_submit_resets_series(self):
+        q = self.conn.new_queue(coalesce='sum')
+        q.add_tagged('requests', 1, time=int(time.time()), tags={'host': 'a'})
+        q.submit()
+        q.add_tagged('requests', 2, time=int(time.time()), tags={'host': 'a'})
+        assert q.tagged_chunks[0]['measurements'][0]['sum'] == 2
+
+    def test_failed_tagged_post_keeps_sent_legacy_out(self):
+        q = self.conn.new_queue(coalesce='sum')
+        q.add('g', 1)
+        q.add_tagged('t', 1, tags={'host': 'a'})
+        mexe = self.conn._mexe
+
+        def failing_mexe(path, **kwargs):
+            if path == "measurements":
+                raise librato.exceptions.Forbidden(403)
+            return mexe(path, **kwargs)
+        self.conn._mexe = failing_mexe
+        with self.assertRaises(librato.exceptions.Forbidden):
+            q.submit()
+        del self.conn._mexe
+
+        q.add('g', 2)
+        assert q.chunks == [{'gauges': [{'name': 'g', 'value': 2}], 'counters': []}]
+        assert len(q._chunk_bytes) == 1
+        assert q._num_measurements_in_queue() == 2
+        q.submit()
+        assert self.conn.get('g').measurements['unassigned'][-1]['value'] == 2
+
+
+class TestQueueByteBudget(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+
+    def tags(self, i):
+        return dict(('tag_%d' % t, 'value-%d-%d' % (i, t)) for t in range(20))
+
+    def test_chunks_stay_under_budget(self):
+        q = self.conn.new_queue(max_chunk_bytes=8 * 1024)
+        for i in range(100):
+            q.add_tagged('cpu', i, time=100, tags=self.tags(i))
+
+        assert len(q.tagged_chunks) > 1
+        assert sum(len(c['measurements']) for c in q.tagged_chunks) == 100
+        for chunk, estimate in zip(q.tagged_chunks, q._tagged_chunk_bytes):
+            size = len(json.dumps(chunk))
+            assert size <= estimate <= 8 * 1024
+            # Not so rough that chunks are left half empty
+            assert estimate < 1.5 * size
+        assert q._num_measurements_in_queue() == 100
+
+    def test_count_limit_still_applies(self):
+        q = self.conn.new_queue()
+        for i in range(q.MAX_MEASUREMENTS_PER_CHUNK + 1):
+            q.add('cpu', i)
+        assert [len(c['gauges']) for c in q.chunks] == [q.MAX_MEASUREMENTS_PER_CHUNK, 1]
+
+    def test_legacy_chunks(self):
+        q = self.conn.new_queue(max_chunk_bytes=1024)
+        for i in range(50):
+            q.add('cpu', i, source='host-%d' % i)
+            q.add('hits', i, type='counter', source='host-%d' % i)
+        assert len(q.chunks) > 1
+        for chunk, estimate in zip(q.chunks, q._chunk_bytes):
+            assert len(json.dumps(chunk)) <= estimate <= 1024
+        assert q._num_bytes_in_queue() == sum(q._chunk_bytes)
+
+    def test_coalescing_updates_estimate(self):
+        q = self.conn.new_queue(coalesce='merge')
+        q.add_tagged('latency', 1, time=100, tags={'host': 'a'})
+        before = q._tagged_chunk_bytes[0]
+        q.add_tagged('latency', 2, time=100, tags={'host': 'a'})
+        # min and max are added
+        assert q._tagged_chunk_bytes[0] == before + 2 * librato.queue._FIELD_BYTES
+        assert len(json.dumps(q.tagged_chunks[0])) <= q._tagged_chunk_bytes[0]
+
+    def test_submit_resets_accounting(self):
+        q = self.conn.new_queue()
+        q.add_tagged('cpu', 1, tags={'host': 'a'})
+        q.submit()
+        assert q._num_bytes_in_queue() == 0
+        assert q._num_measurements_in_queue() == 0
+
+
+class TestQueueByteBudgetServer(unittest.TestCase):
+    def test_no_oversized_requests(self):
+        fake = FakeLibratoServer().start()
+        try:
+            fake.max_body_bytes = 16 * 1024
+            conn = fake.connect()
+            q = conn.new_queue(max_chunk_bytes=fake.max_body_bytes)
+            for i in range(300):
+                q.add_tagged('cpu', i, time=int(time.time()), tags={'host': 'host-%d' % i, 'padding': 'x' * 100})
+            q.submit()
+
+            stats = fake.stats()
+            assert stats['by_status'] == {202: stats['requests']}
+            assert stats['requests'] > 1
+            assert stats['measurements'] == 300
+        finally:
+            fake.stop()
+
+
+class TestResilientSubmit(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeLibratoServer().start()
+        self.conn = self.server.connect()
+        self.conn.backoff_logic = lambda backoff: 0.01
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_named_offenders_are_set_aside(self):
+        q = self.conn.new_queue(resilient=True)
+        now = int(time.time())
+        for i in range(300):
+            q.add_tagged('cpu', 'oops' if i in (7, 123) else i, time=now, tags={'host': 'h%d' % i})
+        report = q.submit()
+
+        assert report.sent == 298
+        assert report.requests == 2
+        assert [r.measurement['tags']['host'] for r in report.rejected] == ['h7', 'h123']
+        assert report.rejected[0].type is None
+        assert report.rejected[0].errors == {'sum': ['is not a number']}
+        assert not report.ok
+        assert len(self.server.store.measurements['cpu']) == 298
+
+    def test_legacy_offenders(self):
+        q = self.conn.new_queue(resilient=True)
+        q.add('cpu', 1)
+        q.add('hits', 'oops', type='counter')
+        q.add('hits', 2, type='counter')
+        report = q.submit()
+
+        assert report.sent == 2
+        assert report.rejected == [('counter', {'name': 'hits', 'value': 'oops'}, {'value': ['is not a number']})]
+
+    def test_continues_with_remaining_chunks(self):
+        q = self.conn.new_queue(resilient=True)
+        for i in range(q.MAX_MEASUREMENTS_PER_CHUNK * 2):
+            q.add_tagged('cpu', 'oops' if i == 0 else i, tags={'host': 'h%d' % i})
+        report = q.submit()
+
+        assert report.sent == q.MAX_MEASUREMENTS_PER_CHUNK * 2 - 1
+        assert len(report.rejected) == 1
+        assert q._num_measurements_in_queue() == 0
+        assert q.tagged_chunks == []
+
+    def test_other_errors_keep_the_rest_queued(self):
+        q = self.conn.new_queue(resilient=True)
+        for i in range(q.MAX_MEASUREMENTS_PER_CHUNK + 1):
+            q.add_tagged('cpu', i, tags={'host': 'h%d' % i})
+        q.add('load', 1)
+        self.server.inject(403)
+        with self.assertRaises(librato.exceptions.Forbidden):
+            q.submit()
+        assert q._num_measurements_in_queue() == q.MAX_MEASUREMENTS_PER_CHUNK + 2
+
+        assert q.submit().sent == q.MAX_MEASUREMENTS_PER_CHUNK + 2
+
+    def test_request_wide_errors_are_not_bisected(self):
+        q = self.conn.new_queue(resilient=True)
+        for i in range(300):
+            q.add_tagged('cpu', i, tags={'host': 'h%d' % i})
+        payload = {'errors': {'params': {'measurements': ['are not accepted right now']}}}
+        self.server.inject(400, count=1000, payload=payload)
+        report = q.submit()
+
+        # The chunk, then its two halves
+        assert report.requests == self.server.stats()['requests'] == 3
+        assert report.sent == 0
+        assert len(report.rejected) == 300
+        assert report.rejected[0].errors == payload
+        assert q._num_measurements_in_queue() == 0
+
+    def test_adaptive(self):
+        q = self.conn.new_queue(resilient=True, adaptive=True)
+        for i in range(100):
+            q.add_tagged('cpu', 'oops' if i == 50 else i, tags={'host': 'h%d' % i})
+        report = q.submit()
+        assert report.sent == 99
+        assert len(report.rejected) == 1
+
+
+class BisectingConnection(object):
+    """Rejects any chunk holding a bad measurement without saying which"""
+    def __init__(self, forbidden_at=None):
+        self.requests = 0
+        self.forbidden_at = forbidden_at
+        self.accepted = []
+
+    def sanitize(self, name):
+        return name
+
+    def get_tags(self):
+        return {}
+
+    def add_hook(self, event, callback):
+        pass
+
+    def remove_hook(self, event, callback):
+        pass
+
+    def _mexe(self, path, method="GET", query_props=None):
+        self.requests += 1
+        if self.requests == self.forbidden_at:
+            raise librato.exceptions.Forbidden(403)
+        if any(m['sum'] == 'bad' for m in query_props['measurements']):
+            raise librato.exceptions.BadRequest({'errors': {'request': ['Invalid measurements']}})
+        self.accepted.extend(m['tags']['host'] for m in query_props['measurements'])
+
+
+class TestBisection(unittest.TestCase):
+    def test_offender_is_found_by_splitting(self):
+        conn = BisectingConnection()
+        q = librato.Queue(conn, resilient=True)
+        for i in range(256):
+            q.add_tagged('cpu', 'bad' if i == 100 else i, tags={'host': 'h%d' % i})
+        report = q.submit()
+
+        assert report.sent == 255
+        assert [r.measurement['tags']['host'] for r in report.rejected] == ['h100']
+        assert report.rejected[0].errors == {'errors': {'request': ['Invalid measurements']}}
+        # One request for the chunk, then two per halving of a 256 measurement chunk
+        assert conn.requests == report.requests == 1 + 2 * 8
+
+    def test_every_measurement_bad(self):
+        conn = BisectingConnection()
+        q = librato.Queue(conn, resilient=True)
+        for i in range(4):
+            q.add_tagged('cpu', 'bad', tags={'host': 'h%d' % i})
+        report = q.submit()
+        assert report.sent == 0
+        assert len(report.rejected) == 4
+
+    def test_bisection_is_capped(self):
+        conn = BisectingConnection()
+        q = librato.Queue(conn, resilient=True)
+        for i in range(256):
+            q.add_tagged('cpu', 'bad' if i % 16 == 0 and i < 128 else i, tags={'host': 'h%d' % i})
+        report = q.submit()
+
+        assert conn.requests == report.requests <= 2 * 9 + 4
+        assert report.sent + len(report.rejected) == 256
+        bad = ['h%d' % i for i in range(0, 128, 16)]
+        assert set(bad) <= set(r.measurement['tags']['host'] for r in report.rejected)
+        assert not set(bad) & set(conn.accepted)
+
+    def check_interrupted_isolation(self, **kwargs):
+        # [h0 h1 h2 h3] is rejected, [h0 h1] accepted, then [h2 h3] fails with 403
+        conn = BisectingConnection(forbidden_at=3)
+        q = librato.Queue(conn, resilient=True, **kwargs)
+        for i in range(4):
+            q.add_tagged('cpu', 'bad' if i == 3 else i, tags={'host': 'h%d' % i})
+        with self.assertRaises(librato.exceptions.Forbidden):
+            q.submit()
+        assert conn.accepted == ['h0', 'h1']
+        assert [m['tags']['host'] for m in q.tagged_chunks[0]['measurements']] == ['h2', 'h3']
+        assert q._num_measurements_in_queue() == 2
+
+        report = q.submit()
+        assert conn.accepted == ['h0', 'h1', 'h2']
+        assert [r.measurement['tags']['host'] for r in report.rejected] == ['h3']
+        assert q._num_measurements_in_queue() == 0
+
+    def test_interrupted_isolation_keeps_only_unsent(self):
+        self.check_interrupted_isolation()
+
+    def test_interrupted_adaptive_isolation_keeps_only_unsent(self):
+        self.check_interrupted_isolation(adaptive=True)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import logging
+import unittest
+import librato
+from librato.streaming import StreamedBody, StreamedList, StreamingDecoder
+from librato.testing import FakeLibratoServer
+from librato.transport import HTTP_CLIENT_STREAMS, StdlibTransport
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+def stream(doc, key='metrics', chunk_size=3):
+    body = doc if isinstance(doc, bytes) else json.dumps(doc).encode('utf-8')
+    return StreamedList(io.BytesIO(body), key, chunk_size=chunk_size)
+
+
+class TestStreamedList(unittest.TestCase):
+    def test_items_and_meta(self):
+        doc = {'query': {'offset': 0, 'length': 2, 'total': 5},
+               'metrics': [{'name': 'a', 'period': 60}, {'name': 'b', 'period': None}]}
+        for chunk_size in (1, 2, 3, 7, 1024):
+            items = stream(doc, chunk_size=chunk_size)
+            assert list(items) == doc['metrics']
+            assert items.meta == {'query': doc['query']}
+
+    def test_meta_after_the_list(self):
+        items = stream(b'{"metrics": [1, 22, 333], "query": {"total": 3}}')
+        assert list(items) == [1, 22, 333]
+        assert items.meta == {'query': {'total': 3}}
+
+    def test_numbers_split_across_chunks(self):
+        assert list(stream(b'{"metrics": [12345, 678]}', chunk_size=2)) == [12345, 678]
+
+    def test_multibyte_characters_split_across_chunks(self):
+        items = stream(u'{"metrics": ["héhé", "☃"]}'.encode('utf-8'), chunk_size=1)
+        assert list(items) == [u'héhé', u'☃']
+
+    def test_empty_and_missing_lists(self):
+        assert list(stream(b'{"metrics": []}')) == []
+        assert list(stream(b'{}')) == []
+        items = stream(b'{"query": {"total": 0}}')
+        assert list(items) == []
+        assert items.meta == {'query': {'total': 0}}
+
+    def test_truncated_document(self):
+        with self.assertRaises(ValueError):
+            list(stream(b'{"metrics": [{"name": "a"}, {"na'))
+
+    def test_on_close(self):
+        closed = []
+        items = stream({'metrics': [1, 2, 3]})
+        items.on_close = lambda: closed.append(True)
+        next(items)
+        assert closed == []
+        items.close()
+        assert closed == [True]
+
+        items = stream({'metrics': [1, 2, 3]})
+        items.on_close = lambda: closed.append(True)
+        list(items)
+        assert closed == [True, True]
+
+    def test_decoder_falls_back_to_json(self):
+        assert StreamingDecoder('metrics')('{"errors": {}}') == {'errors': {}}
+
+
+class TestStreamedPagination(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer(page_size=3).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.conn = self.server.connect()
+
+    def test_list_all_metrics(self):
+        names = ['m%02d' % i for i in range(10)]
+        for name in names:
+            self.conn.submit(name, 1)
+        metrics = self.conn.list_all_metrics()
+        assert [m.name for m in metrics] == names
+        assert self.server.stats()['by_endpoint']['GET /v1/metrics'] == 4
+
+    def test_stops_early(self):
+        for i in range(10):
+            self.conn.submit('m%02d' % i, 1)
+        metrics = self.conn.list_all_metrics()
+        assert next(metrics).name == 'm00'
+        metrics.close()
+        assert self.server.stats()['by_endpoint']['GET /v1/metrics'] == 1
+
+    def test_errors_are_decoded(self):
+        self.server.inject(400, payload={'errors': {'params': {'length': ['is too big']}}})
+        with self.assertRaises(librato.exceptions.BadRequest) as cm:
+            next(self.conn.list_all_metrics())
+        assert cm.exception.error_payload == {'errors': {'params': {'length': ['is too big']}}}
+
+
+def tagged_payload(n):
+    return {'measurements': [{'name': 'cpu', 'value': i, 'tags': {'host': u'h\xe9%d' % i}} for i in range(n)],
+            'tags': {'region': 'us-east-1'}}
+
+
+class TestStreamedBody(unittest.TestCase):
+    def test_same_text_as_json_dumps(self):
+        for payload in [tagged_payload(50), {'gauges': [], 'counters': [{'name': 'c', 'value': 1}]},
+                        {'names': ['a', 'b'], 1: [2]}, [1, 2], {}]:
+            body = StreamedBody(payload, block_size=100)
+            assert b''.join(body) == json.dumps(payload).encode('utf-8')
+
+    def test_blocks(self):
+        body = StreamedBody(tagged_payload(500), block_size=1000)
+        blocks = list(body)
+        assert len(blocks) > 10
+        # Blocks end on the first item going past block_size
+        assert all(1000 <= len(b) < 1200 for b in blocks[:-1])
+        assert body.bytes_sent == sum(len(b) for b in blocks)
+
+    def test_length(self):
+        payload = tagged_payload(100)
+        assert StreamedBody(payload).length is None
+        body = StreamedBody(payload, chunked=False, block_size=100)
+        assert body.length == len(json.dumps(payload))
+        # Iterated again on retries
+        assert len(b''.join(body)) == len(b''.join(body)) == body.length
+
+
+class RecordingConnect(object):
+    requests = []
+
+    def __init__(self, hostname, fake_n_errors=0, timeout=10):
+        pass
+
+    def request(self, method, uri, body, headers):
+        RecordingConnect.requests.append((body, dict(headers)))
+
+    def getresponse(self):
+        return None
+
+
+class TestStreamedRequests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.conn = self.server.connect()
+        self.conn.backoff_logic = lambda backoff: 0.01
+        self.conn.enable_body_streaming(min_items=10, block_size=1000)
+
+    def send(self, conn, payload):
+        RecordingConnect.requests = []
+        conn._make_request(RecordingConnect('localhost'), 'measurements', {}, payload, 'POST')
+        return RecordingConnect.requests[0]
+
+    def test_disabled_by_default(self):
+        body, headers = self.send(self.server.connect(), tagged_payload(2000))
+        assert body == json.dumps(tagged_payload(2000))
+
+    @unittest.skipUnless(HTTP_CLIENT_STREAMS, "http.client can't send iterable bodies")
+    def test_chunked(self):
+        body, headers = self.send(self.conn, tagged_payload(100))
+        assert isinstance(body, StreamedBody)
+        assert 'Content-Length' not in headers
+        assert headers['Content-Type'] == 'application/json'
+
+    @unittest.skipUnless(HTTP_CLIENT_STREAMS, "http.client can't send iterable bodies")
+    def test_content_length(self):
+        self.conn.enable_body_streaming(chunked=False, min_items=10)
+        body, headers = self.send(self.conn, tagged_payload(100))
+        assert headers['Content-Length'] == str(len(json.dumps(tagged_payload(100))))
+
+    def test_transport_without_streaming(self):
+        class BufferingTransport(StdlibTransport):
+            streams_bodies = False
+        conn = self.server.connect(transport=BufferingTransport())
+        conn.enable_body_streaming(min_items=10)
+        body, headers = self.send(conn, tagged_payload(100))
+        assert body == json.dumps(tagged_payload(100))
+
+    def test_small_bodies_are_not_streamed(self):
+        body, headers = self.send(self.conn, tagged_payload(9))
+        assert body == json.dumps(tagged_payload(9))
+
+    def test_roundtrip(self):
+        for chunked in (True, False):
+            self.server.reset()
+            self.conn.enable_body_streaming(chunked=chunked, min_items=10, block_size=1000)
+            q = self.conn.new_queue()
+            for i in range(250):
+                q.add_tagged('cpu', i, tags={'host': 'h%d' % i})
+            q.submit()
+            assert self.server.stats()['measurements'] == 250
+            assert len(self.conn.get_tagged('cpu', duration=60)['series']) == 250
+
+    def test_retries_resend_the_body(self):
+        self.server.inject(503)
+        self.conn.submit_tagged('cpu', 1, tags={'host': 'a'})
+        q = self.conn.new_queue()
+        for i in range(20):
+            q.add_tagged('mem', i, tags={'host': 'h%d' % i})
+        self.server.inject(503)
+        q.submit()
+        assert self.server.stats()['by_status'] == {503: 2, 202: 2}
+        assert self.server.stats()['measurements'] == 21
+
+    def test_request_bytes(self):
+        sizes = []
+        self.conn.add_hook('after_response', lambda info: sizes.append(info.request_bytes))
+        payload = tagged_payload(100)
+        self.conn._mexe('measurements', method="POST", query_props=payload)
+        assert sizes == [len(json.dumps(payload))]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -92,6 +92,14 @@ class TestStreamModel(unittest.TestCase):
         self.assertEqual(s.color, '#f00')
         self.assertEqual(s.something, 'foo')
 
+    def test_extra_attributes_set_later(self):
+        s = Stream(metric='my.metric')
+        s.something = 'foo'
+        self.assertEqual(s.something, 'foo')
+        self.assertFalse(hasattr(s, '__dict__'))
+        with self.assertRaises(AttributeError):
+            s.nothing
+
     def test_get_payload(self):
         self.assertEqual(Stream(metric='my.metric').get_payload(),
                          {'metric': 'my.metric', 'source': '*'})
@@ -0,0 +1,157 @@
+import logging
+import unittest
+import librato
+from librato.alerts import Alert, Condition
+from librato.sync import AlertSet, SpaceSet, Action
+from mock_connection import MockConnect, server
+
+# logging.basicConfig(level=logging.DEBUG)
+# Mock the server
+librato.HTTPSConnection = MockConnect
+
+
+class TestAlertSync(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+
+    def alert(self, name, threshold=42, **kwargs):
+        return Alert(self.conn, name, conditions=[Condition('cpu').above(threshold)], **kwargs)
+
+    def test_fetch_indexes_by_name(self):
+        self.conn.create_alert('a')
+        self.conn.create_alert('b')
+        alerts = AlertSet.fetch(self.conn)
+        assert len(alerts) == 2
+        assert 'a' in alerts
+        assert alerts['b']._id == 2
+
+    def test_diff(self):
+        self.conn.create_alert('same', conditions=[Condition('cpu').above(42)])
+        self.conn.create_alert('changed', conditions=[Condition('cpu').above(1)])
+        self.conn.create_alert('extra')
+
+        desired = [self.alert('same'), self.alert('changed'), self.alert('new')]
+        plan = AlertSet.fetch(self.conn).diff(desired)
+
+        assert [str(a) for a in plan] == ['~ alert changed', '+ alert new']
+        assert [a.name for a in plan.unchanged] == ['same']
+
+        plan = AlertSet.fetch(self.conn).diff(desired, delete_missing=True)
+        assert [str(a) for a in plan.deletes] == ['- alert extra']
+        assert plan.summary() == "1 to create, 1 to update, 1 to delete, 1 unchanged"
+
+    def test_server_defaults_are_not_changes(self):
+        # As the API returns an alert created without rearm_seconds or summary_function
+        current = Alert.from_dict(self.conn, {
+            'id': 1, 'name': 'cpu.high', 'version': 2, 'description': None, 'active': True,
+            'rearm_seconds': 600, 'attributes': {'runbook_url': ''}, 'md': False, 'services': [],
+            'conditions': [{'type': 'above', 'metric_name': 'cpu', 'source': '*', 'threshold': 42,
+                            'summary_function': 'average', 'duration': None, 'tags': []}]})
+        alerts = AlertSet(self.conn, [current])
+
+        condition = Condition('cpu').above(42)
+        condition.summary_function = None
+        plan = alerts.diff([Alert(self.conn, 'cpu.high', conditions=[condition])])
+        assert len(plan) == 0
+        assert plan.unchanged == [current]
+
+        plan = alerts.diff([self.alert('cpu.high', rearm_seconds=300)])
+        assert [str(a) for a in plan] == ['~ alert cpu.high']
+        plan = alerts.diff([self.alert('cpu.high', threshold=90)])
+        assert [str(a) for a in plan] == ['~ alert cpu.high']
+
+    def test_dict_specs(self):
+        plan = AlertSet.fetch(self.conn).diff([{'name': 'from_dict', 'description': 'd'}])
+        assert plan.creates[0].desired.description == 'd'
+
+    def test_dry_run_changes_nothing(self):
+        plan = self.conn.sync_alerts([self.alert('new')], dry_run=True)
+        assert len(plan) == 1
+        assert not plan.creates[0].applied
+        assert list(self.conn.list_alerts()) == []
+
+    def test_sync_applies_changes(self):
+        self.conn.create_alert('changed', conditions=[Condition('cpu').above(1)])
+        self.conn.create_alert('extra')
+
+        desired = [self.alert('changed', threshold=90), self.alert('new')]
+        plan = self.conn.sync_alerts(desired, delete_missing=True, max_workers=1)
+        assert plan.failed == []
+
+        alerts = AlertSet.fetch(self.conn)
+        assert sorted(alerts.alerts) == ['changed', 'new']
+        assert alerts['changed'].conditions[0].threshold == 90
+        assert alerts['new'].conditions[0].threshold == 42
+
+        # Nothing left to do
+        assert len(self.conn.sync_alerts(desired, delete_missing=True)) == 0
+
+    def test_failures_are_recorded(self):
+        plan = AlertSet.fetch(self.conn).diff([self.alert('new')])
+        plan.creates[0]._apply = lambda action: 1 / 0
+        plan.apply()
+        assert len(plan.failed) == 1
+        assert isinstance(plan.failed[0].error, ZeroDivisionError)
+
+
+class TestSpaceProvisioning(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+        self.spec = [
+            {'name': 'Web', 'charts': [
+                {'name': 'CPU', 'streams': [{'metric': 'cpu', 'source': '*'}]},
+                {'name': 'Memory', 'type': 'stacked', 'streams': [{'metric': 'mem'}]},
+            ]},
+            {'name': 'Workers', 'charts': [
+                {'name': 'Jobs', 'streams': [{'metric': 'jobs'}]},
+            ]},
+        ]
+
+    def test_fetch_indexes_by_lowercase_name(self):
+        self.conn.create_space('Web')
+        spaces = SpaceSet.fetch(self.conn)
+        assert 'web' in spaces
+        assert spaces['WEB'].name == 'Web'
+
+    def test_plan_for_empty_account(self):
+        plan = SpaceSet.fetch(self.conn).diff(self.spec)
+        assert [str(a) for a in plan] == [
+            '+ space Web', '+ chart Web/CPU', '+ chart Web/Memory',
+            '+ space Workers', '+ chart Workers/Jobs']
+
+    def test_provision_creates_spaces_and_charts(self):
+        plan = self.conn.provision_spaces({'spaces': self.spec}, max_workers=1)
+        assert plan.failed == []
+
+        web = self.conn.find_space('Web')
+        charts = dict((c.name, c) for c in self.conn.list_charts_in_space(web))
+        assert sorted(charts) == ['CPU', 'Memory']
+        assert charts['Memory'].type == 'stacked'
+        assert charts['CPU'].streams[0].metric == 'cpu'
+
+        # Applying the same spec again is a no-op
+        plan = self.conn.provision_spaces(self.spec)
+        assert len(plan) == 0
+        assert len(plan.unchanged) == 3
+
+    def test_minimal_diff(self):
+        web = self.conn.create_space('Web')
+        self.conn.create_chart('CPU', web, streams=[{'metric': 'cpu', 'source': '*'}])
+        self.conn.create_chart('Memory', web, type='line', streams=[{'metric': 'mem'}])
+        self.conn.create_chart('Disk', web, streams=[{'metric': 'disk'}])
+
+        plan = self.conn.provision_spaces(self.spec[:1], delete_missing_charts=True, dry_run=True)
+        assert [str(a) for a in plan] == ['~ chart Web/Memory', '- chart Web/Disk']
+        assert [c.name for c in plan.unchanged] == ['CPU']
+
+    def test_charts_wait_for_their_space(self):
+        plan = SpaceSet.fetch(self.conn).diff(self.spec[1:])
+        plan.actions[0]._apply = lambda action: 1 / 0
+        plan.apply()
+        assert len(plan.failed) == 2
+        assert not plan.actions[1].applied
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import logging
+import time
+import unittest
+import librato
+from six.moves.http_client import HTTPConnection
+from librato.testing import FakeLibratoServer
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class TestFakeLibratoServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer(page_size=2).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.server.latency = 0
+        self.server.error_rate = 0.0
+        self.server.max_body_bytes = None
+        self.conn = self.server.connect()
+        # We don't want to wait seconds for retries
+        self.conn.backoff_logic = lambda backoff: 0.01
+
+    def test_tagged_roundtrip(self):
+        now = int(time.time())
+        q = self.conn.new_queue()
+        q.add_tagged('cpu', 10, time=now - 2, tags={'host': 'a'})
+        q.add_tagged('cpu', 20, time=now - 1, tags={'host': 'b'})
+        q.submit()
+
+        resp = self.conn.get_tagged('cpu', duration=60, tags={'host': 'a'})
+        assert resp['series'] == [{'tags': {'host': 'a'}, 'measurements': [{'time': now - 2, 'value': 10}]}]
+        assert len(self.conn.get_tagged('cpu', duration=60)['series']) == 2
+
+    def test_legacy_metrics_and_pagination(self):
+        for name in ['a', 'b', 'c', 'd', 'e']:
+            self.conn.submit(name, 1)
+        assert len(self.conn.list_metrics()) == 2
+        assert [m.name for m in self.conn.list_all_metrics()] == ['a', 'b', 'c', 'd', 'e']
+        assert self.conn.get('c').name == 'c'
+
+        self.conn.delete(['a', 'b'])
+        assert [m.name for m in self.conn.list_all_metrics()] == ['c', 'd', 'e']
+
+    def test_alerts_and_spaces(self):
+        self.conn.create_alert('cpu.high')
+        assert self.conn.get_alert('cpu.high').name == 'cpu.high'
+
+        space = self.conn.create_space('Web')
+        chart = space.add_chart('CPU', streams=[{'metric': 'cpu'}])
+        assert self.conn.find_space('web').chart_ids == [chart.id]
+        assert self.conn.find_chart('CPU', space).streams[0].metric == 'cpu'
+
+    def test_annotations(self):
+        self.conn.post_annotation('deploys', title='v1', source='web', start_time=100)
+        stream = self.conn.get_annotation_stream('deploys', start_time=0)
+        assert stream.events[0]['web'][0]['title'] == 'v1'
+
+    def test_inject_throttling(self):
+        self.server.inject(429, retry_after=1)
+        with self.assertRaises(librato.exceptions.ClientError) as cm:
+            self.conn.submit('cpu', 1)
+        assert cm.exception.code == 429
+        self.conn.submit('cpu', 1)
+        assert self.server.stats()['by_status'] == {429: 1, 200: 1}
+
+    def test_server_errors_are_retried(self):
+        self.server.inject(503, count=2)
+        self.conn.submit('cpu', 1)
+        assert self.server.stats()['by_status'] == {503: 2, 200: 1}
+
+    def test_error_rate(self):
+        self.server.error_rate = 1.0
+        self.server.inject(400)
+        with self.assertRaises(librato.exceptions.BadRequest):
+            self.conn.submit('cpu', 1)
+
+    def test_bad_measurements(self):
+        with self.assertRaises(librato.exceptions.BadRequest) as cm:
+            self.conn.submit_tagged('cpu', 'not a number', tags={'host': 'a'})
+        assert cm.exception.error_payload == {
+            'errors': {'params': {'measurements': {'0': {'value': ['is not a number']}}}}}
+
+    def test_max_body_bytes(self):
+        self.server.max_body_bytes = 10
+        with self.assertRaises(librato.exceptions.ClientError) as cm:
+            self.conn.submit('cpu', 1)
+        assert cm.exception.code == 413
+
+    def test_authorization_required(self):
+        conn = HTTPConnection(self.server.hostname)
+        conn.request('GET', '/v1/metrics')
+        assert conn.getresponse().status == 401
+        conn.close()
+
+    def test_latency(self):
+        self.server.latency = 0.05
+        started = time.time()
+        self.conn.list_metrics()
+        assert time.time() - started >= 0.05
+
+    def test_conditional_requests(self):
+        self.conn.enable_conditional_requests()
+        space = self.conn.create_space('Web')
+        self.conn.get_space(space.id)
+        self.conn.get_space(space.id)
+        assert self.server.stats()['by_status'].get(304) == 1
+
+    def test_conditional_list_requests(self):
+        self.conn.enable_conditional_requests()
+        self.conn.create_alert('cpu.high')
+        assert [a.name for a in self.conn.list_alerts()] == ['cpu.high']
+        assert [a.name for a in self.conn.list_alerts()] == ['cpu.high']
+        assert self.server.stats()['by_status'].get(304) == 1
+        assert len(self.conn.validator_cache) == 1
+
+    def test_accounting(self):
+        q = self.conn.new_queue()
+        for i in range(3):
+            q.add_tagged('cpu', i, tags={'host': 'a'})
+        q.submit()
+        self.conn.list_metrics()
+
+        stats = self.server.stats()
+        assert stats['requests'] == 2
+        assert stats['measurements'] == 3
+        assert stats['by_endpoint'] == {'POST /v1/measurements': 1, 'GET /v1/metrics': 1}
+        assert stats['bytes_in'] > 0
+        assert stats['bytes_out'] > 0
+        assert self.server.requests[0].measurements == 3
+
+if __name__ == '__main__':
+    unittest.main()
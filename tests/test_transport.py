@@ -0,0 +1,122 @@
+import logging
+import unittest
+import librato
+from librato.testing import FakeLibratoServer
+from librato.transport import StdlibTransport, Transport, get_transport
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+def installed(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+class TransportChecks(object):
+    """Run against every transport"""
+    transport = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeLibratoServer(page_size=2).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.reset()
+        self.conn = self.server.connect(transport=self.transport)
+        self.conn.backoff_logic = lambda backoff: 0.01
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_roundtrip(self):
+        for name in ['a', 'b', 'c', 'd', 'e']:
+            self.conn.submit(name, 1)
+        assert [m.name for m in self.conn.list_all_metrics()] == ['a', 'b', 'c', 'd', 'e']
+        assert self.conn.get('c').name == 'c'
+
+    def test_retries(self):
+        self.server.inject(503, count=2)
+        self.conn.submit('cpu', 1)
+        assert self.server.stats()['by_status'] == {503: 2, 200: 1}
+
+    def test_client_errors(self):
+        with self.assertRaises(librato.exceptions.BadRequest) as cm:
+            self.conn.submit_tagged('cpu', 'not a number', tags={'host': 'a'})
+        assert cm.exception.error_payload == {
+            'errors': {'params': {'measurements': {'0': {'value': ['is not a number']}}}}}
+
+    def test_streamed_bodies(self):
+        for chunked in (True, False):
+            self.conn.enable_body_streaming(chunked=chunked, min_items=10, block_size=100)
+            results = list(self.conn.bulk_delete(['m%d' % i for i in range(10)]))
+            assert [r.error for r in results] == [None]
+            self.conn.submit_tagged('cpu', 1, tags={'host': 'a'})
+        q = self.conn.new_queue()
+        for i in range(100):
+            q.add_tagged('cpu', i, tags={'host': 'h%d' % i})
+        q.submit()
+        assert self.server.stats()['measurements'] == 102
+
+    def test_conditional_requests(self):
+        self.conn.enable_conditional_requests()
+        space = self.conn.create_space('Web')
+        assert self.conn.get_space(space.id).name == 'Web'
+        assert self.conn.get_space(space.id).name == 'Web'
+        assert self.server.stats()['by_status'].get(304) == 1
+
+
+class TestStdlibTransport(TransportChecks, unittest.TestCase):
+    transport = 'stdlib'
+
+
+@unittest.skipUnless(installed('urllib3'), "urllib3 is not installed")
+class TestUrllib3Transport(TransportChecks, unittest.TestCase):
+    transport = 'urllib3'
+
+
+@unittest.skipUnless(installed('requests'), "requests is not installed")
+class TestRequestsTransport(TransportChecks, unittest.TestCase):
+    transport = 'requests'
+
+
+@unittest.skipUnless(installed('httpx'), "httpx is not installed")
+class TestHttpxTransport(TransportChecks, unittest.TestCase):
+    transport = 'httpx'
+
+
+class CountingTransport(StdlibTransport):
+    def __init__(self):
+        self.connections = 0
+
+    def connect(self, connection):
+        self.connections += 1
+        return StdlibTransport.connect(self, connection)
+
+
+class TestGetTransport(unittest.TestCase):
+    def test_default(self):
+        assert isinstance(librato.connect('user_test', 'key_test').transport, StdlibTransport)
+
+    def test_custom_transport(self):
+        transport = CountingTransport()
+        with FakeLibratoServer() as server:
+            server.connect(transport=transport).list_metrics()
+        assert transport.connections == 1
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_transport('carrier-pigeon')
+
+    def test_interface(self):
+        with self.assertRaises(NotImplementedError):
+            Transport().connect(None)
+
+if __name__ == '__main__':
+    unittest.main()
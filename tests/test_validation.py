@@ -0,0 +1,165 @@
+import logging
+import time
+import unittest
+import librato
+from librato.exceptions import InvalidMeasurement
+from librato.validation import MeasurementValidator
+from mock_connection import MockConnect, server
+
+# logging.basicConfig(level=logging.DEBUG)
+# Mock the server
+librato.HTTPSConnection = MockConnect
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMeasurementValidator(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.v = MeasurementValidator(clock=self.clock)
+
+    def measurement(self, **kwargs):
+        m = {'name': 'cpu.user', 'value': 1.5, 'time': 100000, 'tags': {'host': 'web-1', 'path': '/a/b'}}
+        m.update(kwargs)
+        return m
+
+    def problems(self, m):
+        with self.assertRaises(InvalidMeasurement) as cm:
+            self.v.validate(m)
+        return cm.exception.problems
+
+    def test_valid(self):
+        m = self.measurement()
+        assert self.v.validate(m) is m
+        # Again, from the caches
+        assert self.v.validate(m) is m
+        legacy = {'name': 'cpu', 'value': 1, 'source': 'web', 'measure_time': 100000}
+        assert self.v.validate(legacy) is legacy
+        summary = {'name': 'cpu', 'count': 2, 'sum': 3.0, 'min': 1, 'max': 2}
+        assert self.v.validate(summary) is summary
+
+    def test_names(self):
+        assert self.problems(self.measurement(name='cpu user')) == {'name': ['is invalid']}
+        assert self.problems(self.measurement(name='x' * 256)) == {
+            'name': ['is too long (maximum is 255 characters)']}
+        assert self.problems(self.measurement(name=None)) == {'name': ['is not a string']}
+
+    def test_values(self):
+        for value in ('1', None, float('nan'), float('inf'), True):
+            assert self.problems(self.measurement(value=value)) == {'value': ['is not a number']}
+        assert self.problems(self.measurement(sum='x', count=1)) == {'sum': ['is not a number']}
+
+    def test_values_of_known_series(self):
+        self.v.validate(self.measurement())
+        for value in ('1', None, float('nan'), True):
+            assert self.problems(self.measurement(value=value)) == {'value': ['is not a number']}
+        assert self.problems(self.measurement(count='2')) == {'count': ['is not a number']}
+        assert self.problems(self.measurement(time=None)) == {'time': ['is not a number']}
+        assert self.problems(self.measurement(measure_time=1)) == {
+            'measure_time': ['is outside of the accepted time window']}
+        self.clock.now += 7201
+        assert self.problems(self.measurement()) == {'time': ['is outside of the accepted time window']}
+
+    def test_tags(self):
+        problems = self.problems(self.measurement(tags={'host name': 'a', 'ok': 'b*'}))
+        assert problems == {'tags': ['host name is an invalid tag name', 'ok has an invalid value']}
+        problems = self.problems(self.measurement(tags=dict(('t%d' % i, 'v') for i in range(51))))
+        assert problems['tags'][0] == 'has more than 50 tags'
+        assert self.problems(self.measurement(tags={'host': ['a']})) == {'tags': ['host is not a string']}
+
+    def test_time_window(self):
+        assert self.problems(self.measurement(time=100000 - 7201)) == {
+            'time': ['is outside of the accepted time window']}
+        assert self.problems(self.measurement(time=100000 + 601))
+        assert self.problems(self.measurement(time='now')) == {'time': ['is not a number']}
+        self.clock.now += 7000
+        assert self.v.validate(self.measurement()) is not None
+
+    def test_message(self):
+        with self.assertRaises(InvalidMeasurement) as cm:
+            self.v.validate(self.measurement(value='x'))
+        assert str(cm.exception) == 'Invalid measurement cpu.user: value: is not a number'
+        assert isinstance(cm.exception, ValueError)
+
+    def test_drop(self):
+        v = MeasurementValidator('drop', clock=self.clock)
+        assert v.validate(self.measurement(value='x')) is None
+        assert v.validate(self.measurement()) is not None
+        assert v.stats() == {'dropped': 1, 'repaired': 0}
+
+    def test_repair(self):
+        v = MeasurementValidator('repair', max_tags=2, clock=self.clock)
+        m = self.measurement(name='cpu user', value='2.5', tags={'c': 'x', 'b': 'y*', 'a': 'z'})
+        assert v.validate(m) == {'name': 'cpu_user', 'value': 2.5, 'time': 100000,
+                                 'tags': {'a': 'z', 'b': 'y_'}}
+        # The original is left alone
+        assert m['name'] == 'cpu user'
+        assert v.validate(self.measurement(value='many')) is None
+        assert v.validate(self.measurement(time=1)) is None
+        assert v.stats() == {'dropped': 2, 'repaired': 1}
+
+    def test_repair_numeric_tag_values(self):
+        v = MeasurementValidator('repair', clock=self.clock)
+        m = self.measurement(tags={'port': 8080, 'ratio': 0.5, 'flag': True, 'host': 'web-1'})
+        # Booleans are more likely a mistake than a number, that tag goes
+        assert v.validate(m)['tags'] == {'port': '8080', 'ratio': '0.5', 'host': 'web-1'}
+        assert self.problems(self.measurement(tags={'port': 8080})) == {'tags': ['port is not a string']}
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            MeasurementValidator('lenient')
+
+
+class TestValidationIntegration(unittest.TestCase):
+    def setUp(self):
+        self.conn = librato.connect('user_test', 'key_test')
+        server.clean()
+
+    def test_disabled_by_default(self):
+        assert self.conn.measurement_validator is None
+        assert self.conn.create_tagged_payload('cpu user', 'x')['name'] == 'cpu user'
+
+    def test_create_tagged_payload(self):
+        self.conn.enable_validation()
+        with self.assertRaises(InvalidMeasurement):
+            self.conn.create_tagged_payload('cpu user', 1, tags={'host': 'a'})
+        self.conn.enable_validation('drop')
+        assert self.conn.create_tagged_payload('cpu user', 1, tags={'host': 'a'}) is None
+
+    def test_submit(self):
+        self.conn.enable_validation('drop')
+        self.conn.submit('cpu', 'x')
+        self.conn.submit_tagged('cpu', 'x', tags={'host': 'a'})
+        self.conn.submit('cpu', 1)
+        assert len(self.conn.list_metrics()) == 1
+        assert self.conn.measurement_validator.dropped == 2
+        self.conn.disable_validation()
+        assert self.conn.measurement_validator is None
+
+    def test_queue_uses_connection_validator(self):
+        self.conn.enable_validation('repair')
+        q = self.conn.new_queue()
+        q.add('cpu user', 1)
+        q.add_tagged('cpu', '2', tags={'host': 'web*1'})
+        q.add_tagged('cpu', 'x', tags={'host': 'a'})
+        assert q.chunks[0]['gauges'][0]['name'] == 'cpu_user'
+        measurements = q.tagged_chunks[0]['measurements']
+        assert len(measurements) == 1
+        assert measurements[0]['sum'] == 2.0
+        assert measurements[0]['tags'] == {'host': 'web_1'}
+        assert q._num_measurements_in_queue() == 2
+
+    def test_queue_validator(self):
+        q = self.conn.new_queue(validator=MeasurementValidator())
+        with self.assertRaises(InvalidMeasurement):
+            q.add('cpu', 'x')
+        assert q._num_measurements_in_queue() == 0
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+from librato.workers import imap_bounded
+
+
+class TestImapBounded(unittest.TestCase):
+    def test_ordered_results(self):
+        def slow_square(x):
+            time.sleep(0.01 * (5 - x))
+            return x * x
+        results = list(imap_bounded(slow_square, range(5), max_workers=3))
+        assert results == [(x, x * x, None) for x in range(5)]
+
+    def test_errors_are_returned(self):
+        def fail_on_two(x):
+            if x == 2:
+                raise ValueError('two')
+            return x
+        results = list(imap_bounded(fail_on_two, range(4), max_workers=2))
+        assert [r[1] for r in results] == [0, 1, None, 3]
+        assert isinstance(results[2][2], ValueError)
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def track(x):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+            return x
+
+        assert len(list(imap_bounded(track, range(20), max_workers=3, ordered=False))) == 20
+        assert 1 < state['peak'] <= 3
+
+    def test_sequential(self):
+        calls = []
+        results = list(imap_bounded(calls.append, range(3), max_workers=1))
+        assert calls == [0, 1, 2]
+        assert len(results) == 3
+
+    def test_dynamic_bound(self):
+        lock = threading.Lock()
+        bound = {'workers': 4}
+        peaks = []
+        state = {'running': 0}
+
+        def track(x):
+            with lock:
+                state['running'] += 1
+                peaks.append((bound['workers'], state['running']))
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+                if x == 10:
+                    bound['workers'] = 1
+            return x
+
+        results = list(imap_bounded(track, range(30), max_workers=lambda: bound['workers'], ordered=False))
+        assert len(results) == 30
+        assert max(running for _, running in peaks) > 1
+        # Once lowered, only the requests already in flight overlap
+        assert peaks[-1] == (1, 1)
+
+if __name__ == '__main__':
+    unittest.main()